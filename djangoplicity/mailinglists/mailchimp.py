@@ -0,0 +1,559 @@
+# -*- coding: utf-8 -*-
+#
+# djangoplicity-newsletters
+# Copyright (c) 2007-2011, European Southern Observatory (ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#
+#    * Neither the name of the European Southern Observatory nor the names
+#      of its contributors may be used to endorse or promote products derived
+#      from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+'''
+Support for calling the MailChimp API (see ``MailChimpList.connection'').
+
+Clients
+-------
+mailchimp3 sends each request with ``requests.request'', i.e. over a new
+connection (and TLS handshake) for every API call. The clients returned by
+``get_client'' are shared by all callers using the same API key in the
+process, and send their requests through a ``requests.Session'' so
+connections to the MailChimp API are kept alive and reused.
+
+Retries
+-------
+Failed calls (429, 5xx, connection errors and timeouts) are retried with
+exponential backoff and full jitter, or after the delay given by the
+``Retry-After'' header of a 429 response. The number of retries is limited
+per API path by MAILINGLISTS_MAILCHIMP_RETRY_BUDGETS, e.g.::
+
+    MAILINGLISTS_MAILCHIMP_RETRY_BUDGETS = {
+        'default': 5,
+        'lists.members.get': 2,
+    }
+
+Retries and give-ups are counted per path in the Django cache (see
+``get_metrics'').
+
+Concurrent connections
+----------------------
+MailChimp allows 10 simultaneous connections per API key. Each call holds
+one of MAILINGLISTS_MAILCHIMP_MAX_CONNECTIONS slots (default 10) for the
+duration of the request. The slots are shared by all processes through the
+Django cache (``cache.add'' on one key per slot), callers wait for a free
+slot, and a slot is never held while sleeping before a retry. Requests time
+out after REQUEST_TIMEOUT seconds and slots expire after SLOT_TIMEOUT, so
+the slots of crashed processes are freed. Callers give up waiting after
+SLOT_MAX_WAIT seconds (e.g. when the cache is down and refuses every slot)
+and make the request without a slot.
+
+Circuit breaker
+---------------
+Server errors, connection errors and timeouts are counted per API key in
+the Django cache, so the count is shared by all Celery workers. Once
+MAILINGLISTS_MAILCHIMP_CIRCUIT_THRESHOLD failures (default 5) happened
+within MAILINGLISTS_MAILCHIMP_CIRCUIT_WINDOW seconds (default 60) the
+circuit opens: calls fail immediately with ``CircuitOpenError'' for
+MAILINGLISTS_MAILCHIMP_CIRCUIT_TIMEOUT seconds (default 60). The circuit is
+then half-open: a single call is let through to probe the API, closing the
+circuit if it succeeds and opening it again if it fails.
+
+Tasks decorated with ``requeue_on_open_circuit'' are re-queued with a
+countdown instead of failing while the circuit is open.
+
+Batches
+-------
+``run_batch'' submits many operations through the /batches endpoint (in
+batches of MAILINGLISTS_MAILCHIMP_BATCH_SIZE operations, default 500),
+polls MailChimp until they are processed and downloads the results, so
+bulk changes take a handful of API calls instead of one or two per member.
+'''
+
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import tarfile
+import threading
+import time
+import uuid
+
+from celery import current_task
+from django.conf import settings
+from django.core.cache import cache
+import requests
+from requests.adapters import HTTPAdapter
+from mailchimp3 import MailChimp
+from mailchimp3.mailchimpclient import MailChimpError
+
+
+logger = logging.getLogger(__name__)
+
+# MailChimp allows up to 10 simultaneous connections per API key
+POOL_MAXSIZE = 10
+
+REQUEST_TIMEOUT = 30
+SLOT_TIMEOUT = 60
+SLOT_WAIT = 0.05
+SLOT_MAX_WAIT = REQUEST_TIMEOUT
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_RETRY_BUDGET = 5
+BASE_DELAY = 0.5
+MAX_DELAY = 10
+
+METRICS_EXPIRE = 60 * 60 * 24 * 7
+
+CIRCUIT_FAILURE_STATUSES = (500, 502, 503, 504)
+
+_clients = {}
+_clients_pid = None
+_clients_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    '''
+    The circuit for the API key is open, the call should be retried in
+    ``retry_in`` seconds
+    '''
+    def __init__(self, retry_in):
+        super(CircuitOpenError, self).__init__(
+            'MailChimp circuit open, retry in %ds' % retry_in)
+        self.retry_in = retry_in
+
+
+class PooledMailChimp(MailChimp):
+    '''
+    MailChimp client sending its requests through a requests.Session.
+    The last response of each thread is kept for error handling.
+    '''
+    def __init__(self, *args, **kwargs):
+        self.session = kwargs.pop('session')
+        self._local = threading.local()
+        super(PooledMailChimp, self).__init__(*args, **kwargs)
+
+    def _make_request(self, **kwargs):
+        self._local.response = None
+        self._local.response = self.session.request(**kwargs)
+        return self._local.response
+
+    def last_response(self):
+        return getattr(self._local, 'response', None)
+
+    def clear_last_response(self):
+        self._local.response = None
+
+
+def get_client(api_key):
+    '''
+    Return the MailChimp client for the API key
+    '''
+    global _clients, _clients_pid
+
+    with _clients_lock:
+        # Don't share connections with a parent process (e.g. forked
+        # Celery workers)
+        if _clients_pid != os.getpid():
+            _clients = {}
+            _clients_pid = os.getpid()
+
+        client = _clients.get(api_key)
+        if client is None:
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_maxsize=POOL_MAXSIZE))
+            client = PooledMailChimp(mc_api=api_key, mc_user='USER',
+                timeout=REQUEST_TIMEOUT, session=session)
+            _clients[api_key] = client
+
+    return client
+
+
+def get_retry_budget(path):
+    '''
+    Maximum number of retries for an API path
+    '''
+    budgets = getattr(settings, 'MAILINGLISTS_MAILCHIMP_RETRY_BUDGETS', {})
+    return budgets.get(path, budgets.get('default', DEFAULT_RETRY_BUDGET))
+
+
+def parse_retry_after(response):
+    '''
+    Delay in seconds requested by the Retry-After header of a 429 response
+    (only the delay-seconds form is supported), or None
+    '''
+    if response is None or response.status_code != 429:
+        return None
+
+    try:
+        return max(0, int(response.headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, retry_after=None):
+    '''
+    Delay before the given retry (starting at 1): the server's Retry-After
+    if any, otherwise exponential backoff with full jitter.
+    '''
+    if retry_after is not None:
+        return min(retry_after, MAX_DELAY)
+
+    return random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2 ** (attempt - 1)))
+
+
+def _api_key_digest(api_key):
+    return hashlib.md5(api_key.encode('utf-8')).hexdigest()
+
+
+def acquire_slot(api_key):
+    '''
+    Take one of the API key's connection slots, waiting until one is free.
+    Returns the slot, to be given back with release_slot(), or None if no
+    slot could be taken within SLOT_MAX_WAIT seconds.
+    '''
+    limit = getattr(settings, 'MAILINGLISTS_MAILCHIMP_MAX_CONNECTIONS', POOL_MAXSIZE)
+    digest = _api_key_digest(api_key)
+    token = uuid.uuid4().hex
+    deadline = time.time() + SLOT_MAX_WAIT
+
+    while True:
+        # Start at a random slot so callers don't all compete for the first
+        start = random.randrange(limit)
+        for i in range(limit):
+            key = 'mailchimp_slot_%s_%d' % (digest, (start + i) % limit)
+            if cache.add(key, token, SLOT_TIMEOUT):
+                return (key, token)
+
+        if time.time() >= deadline:
+            logger.warning('No free MailChimp connection slot after %ss, proceeding without one', SLOT_MAX_WAIT)
+            return None
+
+        time.sleep(random.uniform(0, 2 * SLOT_WAIT))
+
+
+def release_slot(slot):
+    if slot is None:
+        return
+    key, token = slot
+    # The slot may have expired and been taken by another caller
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def _metric_key(metric, path):
+    return 'mailchimp_metrics_%s_%s' % (metric, path)
+
+
+def record_metric(metric, path):
+    key = _metric_key(metric, path)
+    cache.add(key, 0, METRICS_EXPIRE)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_metrics(path):
+    '''
+    Number of retries and give-ups for an API path (over the last week)
+    '''
+    return {
+        'retries': cache.get(_metric_key('retries', path), 0),
+        'giveups': cache.get(_metric_key('giveups', path), 0),
+    }
+
+
+def _circuit_setting(name, default):
+    return getattr(settings, 'MAILINGLISTS_MAILCHIMP_CIRCUIT_%s' % name, default)
+
+
+def _circuit_keys(api_key):
+    digest = _api_key_digest(api_key)
+    return (
+        'mailchimp_circuit_opened_%s' % digest,
+        'mailchimp_circuit_failures_%s' % digest,
+        'mailchimp_circuit_probe_%s' % digest,
+    )
+
+
+def circuit_state(api_key):
+    '''
+    State of the API key's circuit: 'closed', 'open' or 'half-open'
+    '''
+    opened_key, _failures_key, _probe_key = _circuit_keys(api_key)
+    opened = cache.get(opened_key)
+
+    if opened is None:
+        return 'closed'
+    if time.time() < opened + _circuit_setting('TIMEOUT', 60):
+        return 'open'
+    return 'half-open'
+
+
+def check_circuit(api_key):
+    '''
+    Raise CircuitOpenError if calls for the API key are not allowed. Return
+    True if the call is the probe of a half-open circuit.
+    '''
+    opened_key, _failures_key, probe_key = _circuit_keys(api_key)
+    opened = cache.get(opened_key)
+
+    if opened is None:
+        return False
+
+    timeout = _circuit_setting('TIMEOUT', 60)
+    remaining = opened + timeout - time.time()
+    if remaining > 0:
+        raise CircuitOpenError(remaining)
+
+    # Half-open: only one caller gets to probe the API
+    if not cache.add(probe_key, True, timeout):
+        raise CircuitOpenError(timeout)
+
+    return True
+
+
+def record_success(api_key, probe):
+    if probe:
+        cache.delete_many(_circuit_keys(api_key))
+        logger.info('MailChimp circuit closed')
+
+
+def record_failure(api_key, probe):
+    opened_key, failures_key, probe_key = _circuit_keys(api_key)
+
+    if probe:
+        cache.set(opened_key, time.time(), None)
+        cache.delete(probe_key)
+        logger.warning('MailChimp circuit opened again, probe failed')
+        return
+
+    cache.add(failures_key, 0, _circuit_setting('WINDOW', 60))
+    try:
+        failures = cache.incr(failures_key)
+    except ValueError:
+        failures = 1
+
+    if failures >= _circuit_setting('THRESHOLD', 5):
+        if cache.add(opened_key, time.time(), None):
+            logger.warning('MailChimp circuit opened after %d failures', failures)
+
+
+def requeue_on_open_circuit(func):
+    '''
+    Decorator for Celery tasks calling the MailChimp API: re-queue the task
+    once the circuit closes rather than failing while it is open.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except CircuitOpenError as e:
+            # Outside a worker (e.g. called directly) there is nothing to
+            # re-queue
+            task = current_task._get_current_object()
+            if task is None:
+                raise
+
+            logger.info('%s re-queued in %ds: %s', task.name, e.retry_in, e)
+            raise task.retry(
+                exc=e,
+                countdown=e.retry_in,
+                max_retries=_circuit_setting('MAX_REQUEUES', 30),
+            )
+    return wrapper
+
+
+def is_transient_error(e):
+    '''
+    Tell if an exception raised by ``call'' is worth trying again later:
+    the circuit is open, or the retries of a 429, server or connection error
+    were exhausted.
+    '''
+    if isinstance(e, (CircuitOpenError, requests.ConnectionError, requests.Timeout)):
+        return True
+
+    status = None
+    if isinstance(e, MailChimpError) and e.args and isinstance(e.args[0], dict):
+        status = e.args[0].get('status')
+    elif isinstance(e, requests.HTTPError) and e.response is not None:
+        status = e.response.status_code
+
+    return status in RETRY_STATUSES
+
+
+def _request(api_key, method, args, kwargs):
+    '''
+    Call the API method while holding a connection slot
+    '''
+    slot = acquire_slot(api_key)
+    try:
+        return method(*args, **kwargs)
+    finally:
+        release_slot(slot)
+
+
+def call(api_key, path, *args, **kwargs):
+    '''
+    Call the API method with the given path (e.g. 'lists.members.get'),
+    retrying transient errors (see above)
+    '''
+    client = get_client(api_key)
+
+    # Extract the final method from the path
+    method = client
+    for name in path.split('.'):
+        method = getattr(method, name)
+
+    budget = get_retry_budget(path)
+    attempt = 0
+
+    while True:
+        probe = check_circuit(api_key)
+        try:
+            client.clear_last_response()
+            try:
+                result = _request(api_key, method, args, kwargs)
+            except Exception as e:
+                response = client.last_response()
+                if response is None:
+                    # No response: only connection errors and timeouts are
+                    # worth retrying
+                    if not isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                        raise
+                    record_failure(api_key, probe)
+                elif response.status_code not in RETRY_STATUSES:
+                    record_success(api_key, probe)
+                    logger.warning('%s: %s', path, response.text)
+                    raise
+                elif response.status_code in CIRCUIT_FAILURE_STATUSES:
+                    record_failure(api_key, probe)
+                else:
+                    record_success(api_key, probe)
+
+                attempt += 1
+                if attempt > budget:
+                    record_metric('giveups', path)
+                    logger.error('%s: giving up after %d retries (%s)', path,
+                        budget, response.text if response is not None else 'no response')
+                    raise
+
+                record_metric('retries', path)
+                delay = backoff_delay(attempt, parse_retry_after(response))
+                logger.debug('Oops! Caught %s (%d), retrying in %.1fs: %s',
+                    response.status_code if response is not None else 'connection error',
+                    attempt, delay, path)
+                time.sleep(delay)
+            else:
+                record_success(api_key, probe)
+                return result
+        finally:
+            # A probe which ended without a verdict (e.g. an unexpected
+            # exception) must not keep the circuit half-open for others
+            if probe:
+                cache.delete(_circuit_keys(api_key)[2])
+
+
+def _batch_setting(name, default):
+    return getattr(settings, 'MAILINGLISTS_MAILCHIMP_BATCH_%s' % name, default)
+
+
+def fetch_batch_results(url):
+    '''
+    Download the results of a finished batch: a gzipped tar archive of JSON
+    files, each one holding a list of operation results
+    '''
+    r = requests.get(url, timeout=60)
+    r.raise_for_status()
+
+    return parse_batch_results(r.content)
+
+
+def parse_batch_results(content):
+    '''
+    Return a dictionary mapping the operation ids to the status code and
+    response (decoded JSON) of the operations in a batch result archive
+    '''
+    results = {}
+    with tarfile.open(fileobj=io.BytesIO(content), mode='r:gz') as archive:
+        for member in archive.getmembers():
+            if not member.isfile() or not member.name.endswith('.json'):
+                continue
+
+            data = json.loads(archive.extractfile(member).read().decode('utf-8'))
+            for result in data:
+                try:
+                    response = json.loads(result['response'])
+                except (TypeError, ValueError):
+                    response = {}
+                results[result['operation_id']] = (result['status_code'], response)
+
+    return results
+
+
+def run_batch(api_key, operations):
+    '''
+    Run the operations (dictionaries with method, path, body and
+    operation_id) through the /batches endpoint, and return a dictionary
+    mapping the operation ids to the status code and response (decoded
+    JSON) of the operations.
+    '''
+    size = _batch_setting('SIZE', 500)
+    interval = _batch_setting('POLL_INTERVAL', 5)
+    timeout = _batch_setting('TIMEOUT', 60 * 60)
+
+    batch_ids = []
+    for i in range(0, len(operations), size):
+        response = call(api_key, 'batches.create',
+            {'operations': operations[i:i + size]})
+        logger.debug('Created batch %s with %d operations', response['id'],
+            len(operations[i:i + size]))
+        batch_ids.append(response['id'])
+
+    results = {}
+    started = time.time()
+
+    # MailChimp processes the batches one at a time, wait for each in turn
+    for batch_id in batch_ids:
+        while True:
+            response = call(api_key, 'batches.get', batch_id)
+            if response['status'] == 'finished':
+                break
+
+            if time.time() - started > timeout:
+                raise Exception('MailChimp batch %s not finished after %ds'
+                    % (batch_id, timeout))
+
+            time.sleep(interval)
+
+        logger.info('Batch %s finished: %d operations, %d errors', batch_id,
+            response['total_operations'], response['errored_operations'])
+
+        if response['total_operations']:
+            results.update(fetch_batch_results(response['response_body_url']))
+
+    return results
@@ -30,7 +30,30 @@
 # POSSIBILITY OF SUCH DAMAGE
 
 from builtins import object
-from django_mailman.models import List as OriginalMailmanList
+from multiprocessing.pool import ThreadPool
+import logging
+import re
+import threading
+
+from django_mailman.models import List as OriginalMailmanList, \
+    NON_MEMBER_MSG, SUBSCRIBE_MSG, UNSUBSCRIBE_MSG
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT = 120
+
+# Results of the admin forms, e.g. <h5>Successfully subscribed:</h5>
+# followed by a list of addresses
+RESULT_RE = re.compile(r'<h5>(.+?):\s*</h5>\s*<ul>(.*?)</ul>', re.DOTALL)
+
+
+class MassOperationError(Exception):
+    '''
+    The response of a Mailman admin form could not be understood
+    '''
+    pass
 
 
 class MailmanList( object ):
@@ -50,3 +73,111 @@ class MailmanList( object ):
     def get_admin_url( self ):
         """ Get mailman admin URL """
         return "%s/admin/%s/?adminpw=%s" % ( self.main_url, self.name, self.password )
+
+    def login( self ):
+        """
+        Return a session logged in to the admin interface of the list (Mailman
+        keeps the login in a cookie).
+        """
+        session = requests.Session()
+        r = session.post( '%s/admin/%s' % ( self.main_url, self.name ),
+            data={ 'adminpw': self.password }, timeout=TIMEOUT )
+        r.raise_for_status()
+        return session
+
+    def _post_form( self, session, operation, emails ):
+        """
+        Post the emails to the mass subscription or removal form, and return
+        the set of emails which were subscribed/removed and a dictionary of
+        failed emails with the reason. Emails which already were members (or
+        weren't, when removing) are reported as failed by Mailman, with a
+        translated reason (see List.push).
+        """
+        if operation == 'subscribe':
+            url = '%s/admin/%s/members/add' % ( self.main_url, self.name )
+            data = {
+                'subscribe_or_invite': '0',
+                'send_welcome_msg_to_this_batch': '0',
+                'send_notifications_to_list_owner': '0',
+                'subscribees': '\n'.join( emails ),
+            }
+            done_msgs = SUBSCRIBE_MSG
+        else:
+            url = '%s/admin/%s/members/remove' % ( self.main_url, self.name )
+            data = {
+                'send_unsub_ack_to_this_batch': '0',
+                'send_unsub_notifications_to_list_owner': '0',
+                'unsubscribees': '\n'.join( emails ),
+            }
+            done_msgs = UNSUBSCRIBE_MSG + NON_MEMBER_MSG
+
+        # Some of the messages have trailing spaces (e.g. the French
+        # NON_MEMBER_MSG), compare them stripped
+        done_msgs = set( m.strip() for m in done_msgs )
+
+        r = session.post( url, data=data, timeout=TIMEOUT )
+        r.raise_for_status()
+
+        results = RESULT_RE.findall( r.text )
+        if not results:
+            raise MassOperationError( 'Could not find status message' )
+
+        done = set()
+        failed = {}
+        for msg, items in results:
+            for item in re.split( r'<li>', items )[1:]:
+                item = item.strip()
+                email, _sep, reason = item.partition( ' -- ' )
+                email = email.strip()
+                if msg.strip() in done_msgs:
+                    done.add( email )
+                else:
+                    failed[email] = '%s: %s' % ( msg.strip(), reason ) if reason else msg.strip()
+
+        # Addresses Mailman didn't report on
+        for email in emails:
+            if email not in done and email not in failed:
+                failed[email] = 'No status'
+
+        return ( done, failed )
+
+    def push_chunk( self, session, operation, emails, concurrency=4 ):
+        """
+        Subscribe (operation 'subscribe') or remove (operation 'unsubscribe')
+        the emails with one post of the mass subscription/removal form.
+        If the mass operation fails, the emails are posted one by one by a
+        pool of ``concurrency'' threads, each with its own logged in session
+        (sessions can't be shared between threads).
+
+        Return the set of done emails and a dictionary of the failed ones
+        with the reason.
+        """
+        try:
+            return self._post_form( session, operation, emails )
+        except ( requests.RequestException, MassOperationError ) as e:
+            logger.warning( 'Mass %s of %d emails on %s failed (%s), '
+                'falling back to single posts', operation, len( emails ),
+                self.name, e )
+
+        local = threading.local()
+
+        def post( email ):
+            try:
+                if getattr( local, 'session', None ) is None:
+                    local.session = self.login()
+                return self._post_form( local.session, operation, [email] )
+            except ( requests.RequestException, MassOperationError ) as e:
+                return ( set(), { email: str( e ) } )
+
+        done = set()
+        failed = {}
+        pool = ThreadPool( min( concurrency, len( emails ) ) or 1 )
+        try:
+            for d, f in pool.map( post, emails ):
+                done.update( d )
+                failed.update( f )
+        finally:
+            pool.close()
+            pool.join()
+
+        return ( done, failed )
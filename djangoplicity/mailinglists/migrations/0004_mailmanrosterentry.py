@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 16:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailinglists', '0003_auto_20170906_1557'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailmanRosterEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=255)),
+                ('list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='roster', to='mailinglists.List')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='mailmanrosterentry',
+            unique_together=set([('list', 'email')]),
+        ),
+    ]
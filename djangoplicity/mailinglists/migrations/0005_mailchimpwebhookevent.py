@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mailinglists', '0004_mailmanrosterentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailChimpWebhookEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=20)),
+                ('fired_at', models.CharField(blank=True, max_length=20)),
+                ('params', models.TextField(blank=True)),
+                ('ip', models.CharField(blank=True, max_length=50)),
+                ('user_agent', models.CharField(blank=True, max_length=255)),
+                ('list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='mailinglists.MailChimpList')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
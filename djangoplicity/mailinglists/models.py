@@ -35,27 +35,33 @@ from builtins import str
 from builtins import zip
 from builtins import range
 from future.utils import python_2_unicode_compatible
+from collections import defaultdict
 import hashlib
+import json
 import logging
+import time
 import uuid as uuidmod
 from datetime import datetime, timedelta
 from urllib.parse import urlencode
 from requests.exceptions import HTTPError
 
-from mailchimp3 import MailChimp
 from mailchimp3.mailchimpclient import MailChimpError
 
 from django.apps import apps
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.core.validators import validate_email
-from django.db import models
-from django.db.models.signals import post_save
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
 from django.utils.encoding import smart_text
 
 from djangoplicity.actions.models import EventAction  # pylint: disable=no-name-in-module
+from djangoplicity.mailinglists import mailchimp
 from djangoplicity.mailinglists.mailman import MailmanList
+from djangoplicity.mailinglists.utils import BloomFilter
 import django
 if django.VERSION >= (2, 0):
     from django.urls import reverse
@@ -72,6 +78,35 @@ uuidmod._uuid_generate_random = None
 # Settings
 NEWSLETTERS_MAILCHIMP_APIKEY = settings.NEWSLETTERS_MAILCHIMP_APIKEY if hasattr(settings, 'NEWSLETTERS_MAILCHIMP_APIKEY') else ''
 
+BULK_IGNORE_CONFLICTS = {'ignore_conflicts': True} if django.VERSION >= (2, 2) else {}
+
+MAPPING_PLAN_EXPIRE = 60 * 60 * 24
+
+# Mapping plans of the lists in this process: list pk -> (version, plan)
+_mapping_plans = {}
+
+BAD_EMAIL_FILTER_KEY = 'mailinglists_bad_email_filter'
+BAD_EMAIL_FILTER_VERSION_KEY = 'mailinglists_bad_email_filter_version'
+BAD_EMAIL_FILTER_LOCK_KEY = 'mailinglists_bad_email_filter_lock'
+BAD_EMAIL_FILTER_DELTA_KEY = 'mailinglists_bad_email_filter_delta'
+BAD_EMAIL_FILTER_DELTA_LOCK_KEY = 'mailinglists_bad_email_filter_delta_lock'
+BAD_EMAIL_FILTER_DELTA_MAX = 1000
+BAD_EMAIL_FILTER_EXPIRE = 60 * 60 * 24
+
+# Bad email address filter of this process: (version, filter)
+_bad_email_filter = None
+
+WEBHOOK_TOKENS_VERSION_KEY = 'mailinglists_webhook_tokens_version'
+WEBHOOK_TOKENS_EXPIRE = 60 * 60 * 24
+
+WEBHOOK_EVENTS_SCHEDULED_KEY = 'mailinglists_webhook_events_scheduled'
+WEBHOOK_EVENTS_COUNT_KEY = 'mailinglists_webhook_events_count'
+WEBHOOK_EVENTS_LOCK_KEY = 'mailinglists_webhook_events_lock'
+
+# Valid webhook tokens seen by this process:
+# (version, {token: (list pk, list id, valid until)})
+_webhook_tokens = (None, {})
+
 
 def _object_identifier(obj):
     '''
@@ -98,6 +133,175 @@ class BadEmailAddress(models.Model):
     def __str__(self):
         return self.email
 
+    @classmethod
+    def get_filter(cls):
+        '''
+        Get the filter of the bad email addresses: a Bloom filter of the
+        addresses in the database (the base), and the addresses added since
+        it was built (the delta). Both are shared through the Django cache,
+        the base is kept in each process until its version changes.
+
+        When the base is missing, the process getting the lock builds it from
+        the database. The others get None, i.e. must query the database.
+        '''
+        global _bad_email_filter
+
+        cached = cache.get_many([BAD_EMAIL_FILTER_VERSION_KEY, BAD_EMAIL_FILTER_DELTA_KEY])
+        version = cached.get(BAD_EMAIL_FILTER_VERSION_KEY)
+        delta = cached.get(BAD_EMAIL_FILTER_DELTA_KEY)
+
+        # The base is only complete with the delta of its version (i.e. the
+        # delta wasn't evicted from the cache)
+        if version is not None and delta is not None and delta['version'] == version:
+            if _bad_email_filter is not None and _bad_email_filter[0] == version:
+                return _bad_email_filter[1], delta['emails']
+
+            base = cache.get(BAD_EMAIL_FILTER_KEY)
+            if base is not None and base[0] == version:
+                _bad_email_filter = base
+                return base[1], delta['emails']
+
+        if not cache.add(BAD_EMAIL_FILTER_LOCK_KEY, True, 60 * 10):
+            return None
+
+        try:
+            started = time.time()
+            emails = cls.objects.values_list('email', flat=True)
+            bloom = BloomFilter(max(2 * emails.count(), 10000))
+            for email in emails.iterator():
+                bloom.add(email)
+
+            delta = cls._store_filter(bloom, started)
+        finally:
+            cache.delete(BAD_EMAIL_FILTER_LOCK_KEY)
+
+        return bloom, delta['emails']
+
+    @classmethod
+    def _lock_delta(cls):
+        '''
+        Wait for the lock of the delta, it is only held while reading and
+        writing the delta
+        '''
+        for dummy in range(100):
+            if cache.add(BAD_EMAIL_FILTER_DELTA_LOCK_KEY, True, 10):
+                return True
+            time.sleep(0.01)
+        return False
+
+    @classmethod
+    def _store_filter(cls, bloom, started):
+        '''
+        Share a new base built from the database read at ``started'', and
+        return the delta of its version
+        '''
+        global _bad_email_filter
+
+        version = uuidmod.uuid4().hex
+
+        if not cls._lock_delta():
+            return {'version': None, 'emails': {}}
+
+        try:
+            delta = cache.get(BAD_EMAIL_FILTER_DELTA_KEY) or {'emails': {}}
+            # Keep the addresses which may have been committed after the
+            # database was read
+            delta = {
+                'version': version,
+                'emails': dict((email, added) for email, added in
+                    delta['emails'].items() if added >= started - 60),
+            }
+            cache.set_many({
+                BAD_EMAIL_FILTER_VERSION_KEY: version,
+                BAD_EMAIL_FILTER_KEY: (version, bloom),
+                BAD_EMAIL_FILTER_DELTA_KEY: delta,
+            }, BAD_EMAIL_FILTER_EXPIRE)
+        finally:
+            cache.delete(BAD_EMAIL_FILTER_DELTA_LOCK_KEY)
+
+        _bad_email_filter = (version, bloom)
+        return delta
+
+    @classmethod
+    def invalidate_filter(cls):
+        '''
+        Drop the base, it is rebuilt on next use. The delta is kept so that
+        addresses added meanwhile aren't lost.
+        '''
+        global _bad_email_filter
+
+        cache.delete_many([BAD_EMAIL_FILTER_VERSION_KEY, BAD_EMAIL_FILTER_KEY])
+        _bad_email_filter = None
+
+    @classmethod
+    def add_to_filter(cls, *emails):
+        '''
+        Add the email addresses to the delta of the shared filter. The base
+        is rebuilt once the delta holds BAD_EMAIL_FILTER_DELTA_MAX addresses.
+        '''
+        if not emails:
+            return
+
+        if not cls._lock_delta():
+            # Rather rebuild the filter than miss the addresses
+            cls.invalidate_filter()
+            return
+
+        try:
+            delta = cache.get(BAD_EMAIL_FILTER_DELTA_KEY) or {'version': None, 'emails': {}}
+            now = time.time()
+            for email in emails:
+                delta['emails'][email] = now
+            cache.set(BAD_EMAIL_FILTER_DELTA_KEY, delta, BAD_EMAIL_FILTER_EXPIRE)
+        finally:
+            cache.delete(BAD_EMAIL_FILTER_DELTA_LOCK_KEY)
+
+        if len(delta['emails']) >= BAD_EMAIL_FILTER_DELTA_MAX:
+            cls.invalidate_filter()
+
+    @classmethod
+    def _candidates(cls, emails):
+        '''
+        Return the email addresses which may be bad according to the filter
+        (all of them if the filter isn't available)
+        '''
+        bad_filter = cls.get_filter()
+        if bad_filter is None:
+            return list(emails)
+
+        bloom, delta = bad_filter
+        return [email for email in emails if email in delta or email in bloom]
+
+    @classmethod
+    def is_bad(cls, email):
+        '''
+        Check if the email address is a known bad address. Only addresses
+        matched by the filter need a database query.
+        '''
+        if not cls._candidates([email]):
+            return False
+        return cls.objects.filter(email=email).exists()
+
+    @classmethod
+    def filter_bad(cls, emails):
+        '''
+        Return the set of known bad addresses among the email addresses
+        '''
+        candidates = cls._candidates(emails)
+        if not candidates:
+            return set()
+        return set(cls.objects.filter(email__in=candidates).values_list('email', flat=True))
+
+    @classmethod
+    def post_save_handler(cls, sender=None, instance=None, created=False,
+            raw=False, **kwargs):
+        '''
+        Add new bad addresses to the filter. Deleted (or rolled back)
+        addresses are left in the filter, the database query rules them out.
+        '''
+        if created:
+            cls.add_to_filter(instance.email)
+
     class Meta:
         ordering = ('email', )
         verbose_name_plural = 'bad email addresses'
@@ -141,11 +345,8 @@ class List(models.Model):
         """
         if not subscriber:
             if email:
-                try:
-                    BadEmailAddress.objects.get(email=email)
+                if BadEmailAddress.is_bad(email):
                     raise Exception("%s is a known bad email address" % email)
-                except BadEmailAddress.DoesNotExist:
-                    pass
 
                 (subscriber, dummy_created) = Subscriber.objects.get_or_create(email=email)
             else:
@@ -194,6 +395,7 @@ class List(models.Model):
             # already exists so we check the exception message:
             if e.message.lower() != 'error subscribing: %s -- already a member' % email.lower():
                 raise e
+        self.update_roster(added=[email])
 
     def _unsubscribe(self, email):
         """
@@ -201,11 +403,22 @@ class List(models.Model):
         a background task.
         """
         self.mailman.unsubscribe(email)
+        self.update_roster(removed=[email])
 
-    def get_mailman_emails(self):
+    def get_mailman_emails(self, refresh=False):
         """
         Get all current mailman subscribers.
+
+        The roster is downloaded from Mailman and stored as a snapshot when
+        it is older than MAILINGLISTS_MAILMAN_ROSTER_TTL seconds (default
+        one day, see ``last_sync''), otherwise it is read from the snapshot.
+        Changes made through this list keep the snapshot up to date.
         """
+        ttl = getattr(settings, 'MAILINGLISTS_MAILMAN_ROSTER_TTL', 60 * 60 * 24)
+        if not refresh and self.pk and self.last_sync and \
+                self.last_sync > datetime.now() - timedelta(seconds=ttl):
+            return set(self.roster.values_list('email', flat=True))
+
         mailman_members = self.mailman.get_members()
 
         if mailman_members:
@@ -214,46 +427,160 @@ class List(models.Model):
         else:
             mailman_emails = set()
 
+        if self.pk:
+            self.store_roster(mailman_emails)
+
         return mailman_emails
 
+    def store_roster(self, emails):
+        """
+        Replace the roster snapshot with the given emails.
+        """
+        with transaction.atomic():
+            snapshot = set(self.roster.values_list('email', flat=True))
+            self.update_roster(added=emails - snapshot, removed=snapshot - emails)
+
+            self.last_sync = datetime.now()
+            List.objects.filter(pk=self.pk).update(last_sync=self.last_sync)
+
+    def update_roster(self, added=(), removed=()):
+        """
+        Record emails added to or removed from the Mailman list in the
+        roster snapshot.
+        """
+        if not self.pk:
+            return
+
+        if removed:
+            MailmanRosterEntry.objects.filter(list=self, email__in=list(removed)).delete()
+        if added:
+            if not BULK_IGNORE_CONFLICTS:
+                added = set(added) - set(MailmanRosterEntry.objects.filter(
+                    list=self, email__in=list(added)).values_list('email', flat=True))
+            MailmanRosterEntry.objects.bulk_create(
+                [MailmanRosterEntry(list=self, email=email) for email in added],
+                **BULK_IGNORE_CONFLICTS
+            )
+
     def update_subscribers(self, emails):
         """
-        Update the list of subscribers to match a list of emails.
+        Update the list of subscribers to match a list of emails. Known bad
+        email addresses are not added.
+
+        Return a dictionary with the number of subscriptions added and
+        removed and the number of subscribers created.
         """
-        emails = dict([(x, 1) for x in emails])  # Remove duplicates
+        emails = set(emails)
+
+        with transaction.atomic():
+            subscriptions = dict(Subscription.objects.filter(list=self).values_list(
+                'subscriber__email', 'pk'))
+
+            # Delete all subscriptions not in the list
+            remove = [pk for email, pk in subscriptions.items() if email not in emails]
+            Subscription.objects.filter(pk__in=remove).delete()
+
+            # Subscribe all emails not in subscribers.
+            add = emails - set(subscriptions)
+            add -= BadEmailAddress.filter_bad(add)
+            existing = set(Subscriber.objects.filter(email__in=add).values_list(
+                'email', flat=True))
+            Subscriber.objects.bulk_create(
+                [Subscriber(email=email) for email in add - existing],
+                **BULK_IGNORE_CONFLICTS
+            )
 
-        for sub in Subscription.objects.filter(list=self).select_related('subscriber', 'list'):
-            if sub.subscriber.email in emails:
-                del emails[sub.subscriber.email]
-            else:
-                # Delete all subscribers not in the list
-                sub.delete()
+            Subscription.objects.bulk_create(
+                [Subscription(list=self, subscriber_id=pk) for pk in
+                    Subscriber.objects.filter(email__in=add).values_list('pk', flat=True)],
+                **BULK_IGNORE_CONFLICTS
+            )
 
-        bad_emails = set(BadEmailAddress.objects.all().values_list('email', flat=True))
-        emails = set(emails.keys())  # pylint: disable=redefined-variable-type
+        return {
+            'added': len(add),
+            'removed': len(remove),
+            'created_subscribers': len(add - existing),
+        }
 
-        # Subscribe all emails not in subscribers.
-        for email in emails - bad_emails:
-            (subscriber, dummy_created) = Subscriber.objects.get_or_create(email=email)
-            sub = Subscription(list=self, subscriber=subscriber)
-            sub.save()
+    def _push_status_key(self):
+        return 'mailinglists_push_status_%s' % self.pk
+
+    def push_status(self):
+        """
+        Progress of the current (or last) push: the number of emails to
+        subscribe and unsubscribe, the number done so far and the failed
+        emails with the reason.
+        """
+        return cache.get(self._push_status_key())
 
     def push(self, remove_existing=True):
         """
         Push entire list of subscribers to mailman (will overwrite anything in Mailman)
+
+        Only the differences are pushed, in chunks of
+        MAILINGLISTS_MAILMAN_CHUNK_SIZE emails (default 500) posted to
+        Mailman's mass subscription and removal forms with a single
+        logged in session. Progress is recorded after each chunk (see
+        ``push_status'') and returned at the end.
+
+        Mailman reports emails which already are (or aren't) members as
+        failed, with a translated reason, so failed emails are checked
+        against a fresh roster at the end.
         """
         mailman_emails = self.get_mailman_emails()
         django_emails = set(self.subscribers.all().values_list('email', flat=True))
 
-        subscribe = django_emails - mailman_emails
-        unsubscribe = mailman_emails - django_emails
-
-        for e in subscribe:
-            self._subscribe(e)
+        subscribe = sorted(django_emails - mailman_emails)
+        unsubscribe = sorted(mailman_emails - django_emails) if remove_existing else []
+
+        chunk_size = getattr(settings, 'MAILINGLISTS_MAILMAN_CHUNK_SIZE', 500)
+        concurrency = getattr(settings, 'MAILINGLISTS_MAILMAN_CONCURRENCY', 4)
+
+        status = {
+            'subscribe': len(subscribe),
+            'unsubscribe': len(unsubscribe),
+            'done': 0,
+            'failed': {},
+        }
+        cache.set(self._push_status_key(), status, 60 * 60 * 24)
+
+        if not subscribe and not unsubscribe:
+            return status
+
+        mailman = self.mailman
+        session = mailman.login()
+        failed_operations = {}
+
+        for operation, emails in (('subscribe', subscribe), ('unsubscribe', unsubscribe)):
+            for i in range(0, len(emails), chunk_size):
+                chunk = emails[i:i + chunk_size]
+                done, failed = mailman.push_chunk(session, operation, chunk,
+                    concurrency=concurrency)
+                if operation == 'subscribe':
+                    self.update_roster(added=done)
+                else:
+                    self.update_roster(removed=done)
+
+                status['done'] += len(done)
+                status['failed'].update(failed)
+                failed_operations.update((email, operation) for email in failed)
+                cache.set(self._push_status_key(), status, 60 * 60 * 24)
+
+                logger.info('Mailman list %s: %s chunk %d: %d done, %d failed',
+                    self.name, operation, i // chunk_size + 1, len(done), len(failed))
+
+        if failed_operations:
+            members = self.get_mailman_emails(refresh=True)
+            for email, operation in failed_operations.items():
+                if (email in members) == (operation == 'subscribe'):
+                    del status['failed'][email]
+                    status['done'] += 1
+                else:
+                    logger.warning('Mailman list %s: could not %s %s: %s',
+                        self.name, operation, email, status['failed'][email])
+            cache.set(self._push_status_key(), status, 60 * 60 * 24)
 
-        if remove_existing:
-            for e in unsubscribe:
-                self._unsubscribe(e)
+        return status
 
     def __str__(self):
         return self.name
@@ -262,6 +589,21 @@ class List(models.Model):
         ordering = ('name',)
 
 
+@python_2_unicode_compatible
+class MailmanRosterEntry(models.Model):
+    """
+    Snapshot of the members of a Mailman list (see List.get_mailman_emails).
+    """
+    list = models.ForeignKey(List, related_name='roster', on_delete=models.CASCADE)
+    email = models.CharField(max_length=255)
+
+    def __str__(self):
+        return "%s member of %s" % (self.email, self.list)
+
+    class Meta:
+        unique_together = ('list', 'email')
+
+
 @python_2_unicode_compatible
 class Subscription(models.Model):
     """
@@ -352,10 +694,9 @@ class MailChimpList(models.Model):
 
     def connection(self, path, *args, **kwargs):
         '''
-        Randomly the API Throws an HTTPError: 500 Server Error
-        Mailchimp support can't seem to help and I suspect it's related
-        to the firewall which randomly messes up SSL packets
-        So we wrap the connection and catch these error and retry
+        Call the MailChimp API, retrying transient errors (HTTP 429 and 5xx,
+        connection errors) with backoff and respecting the API key's rate
+        limit - see djangoplicity.mailinglists.mailchimp.
         Usage:
         Instead of:
             ml.connection.campaigns.update(campaign_id, data)
@@ -366,28 +707,7 @@ class MailChimpList(models.Model):
                 data,
             )
         '''
-        method = MailChimp(mc_api=self.api_key, mc_user='USER')
-
-        # Extract the final method from the path
-        for name in path.split('.'):
-            method = getattr(method, name)
-
-        for i in range(1, 21):
-            # Try the API call up to 20 times
-            try:
-                return method(*args, **kwargs)
-            except HTTPError as e:
-                if e.response.status_code != 500:
-                    logger.warning('%s: %s', path, e.response.text)
-                    raise e
-
-                logger.debug('Oops! Caught error 500 (%d), retrying: %s', i,
-                    path)
-
-                if i == 20:
-                    # Log the error
-                    logger.error('%s: %s', path, e.response.text)
-                    raise e
+        return mailchimp.call(self.api_key, path, *args, **kwargs)
 
     def get_merge_fields(self):
         '''
@@ -413,6 +733,56 @@ class MailChimpList(models.Model):
 
         return mapping
 
+    @staticmethod
+    def _mapping_plan_keys(list_pk):
+        return (
+            'mailchimp_mapping_plan_version_%s' % list_pk,
+            'mailchimp_mapping_plan_%s' % list_pk,
+        )
+
+    def get_mapping_plan(self):
+        '''
+        Get the compiled merge field and group mappings of the list (see
+        MappingPlan). Plans are cached in the process and in the Django
+        cache, and are invalidated when the list or its mappings change.
+        '''
+        if self.pk is None:
+            return MappingPlan(self)
+
+        version_key, plan_key = self._mapping_plan_keys(self.pk)
+        version = cache.get(version_key)
+
+        if version is not None:
+            local = _mapping_plans.get(self.pk)
+            if local is not None and local[0] == version:
+                return local[1]
+
+            cached = cache.get(plan_key)
+            if cached is not None and cached[0] == version:
+                _mapping_plans[self.pk] = cached
+                return cached[1]
+
+        cached = (uuidmod.uuid4().hex, MappingPlan(self))
+        cache.set_many({version_key: cached[0], plan_key: cached},
+            MAPPING_PLAN_EXPIRE)
+        _mapping_plans[self.pk] = cached
+
+        return cached[1]
+
+    @classmethod
+    def invalidate_mapping_plan(cls, list_pk):
+        cache.delete_many(cls._mapping_plan_keys(list_pk))
+        _mapping_plans.pop(list_pk, None)
+
+    @classmethod
+    def mapping_changed_handler(cls, sender=None, instance=None, **kwargs):
+        '''
+        Invalidate the mapping plan of the list when the list, its merge
+        fields, groups or mappings are changed.
+        '''
+        cls.invalidate_mapping_plan(
+            instance.pk if isinstance(instance, MailChimpList) else instance.list_id)
+
     def create_merge_fields(self, obj, changes=None):
         '''
         Create a MERGE FIELDS dictionary from a model object. The model object
@@ -433,28 +803,7 @@ class MailChimpList(models.Model):
         The changes dictionary can easily be created with django-dirtyfields app.
         See http://pypi.python.org/pypi/django-dirtyfields
         '''
-        merge_fields = {}
-        if self.content_type and self.primary_key_field and isinstance(obj, self.content_type.model_class()):
-            if changes is None:
-                merge_fields[self.primary_key_field.tag] = "%s:%s" % (smart_text(obj._meta), smart_text(obj.pk, strings_only=True))
-
-            for m in MergeVarMapping.objects.filter(list=self).select_related(
-                'list', 'merge_var'):
-                (tag, val) = m.create_merge_field(obj, changes=changes)
-                if val and tag != self.primary_key_field.tag:
-                    merge_fields[tag] = val
-
-            interests = {}
-            for g in GroupMapping.objects.filter(list=self).select_related(
-                'list', 'group'):
-                interest = g.create_interests(obj, changes=changes)
-                if interest:
-                    interests.update(interest)
-
-            if interests:
-                merge_fields['INTERESTS'] = interests
-
-        return merge_fields
+        return self.get_mapping_plan().create_merge_fields(obj, changes=changes)
 
     def get_modelpk_from_identifier(self, object_identifier):
         model_identifier, pk = object_identifier.split(":")
@@ -498,11 +847,8 @@ class MailChimpList(models.Model):
         # validate email address
         validate_email(email)
 
-        try:
-            BadEmailAddress.objects.get(email=email)
+        if BadEmailAddress.is_bad(email):
             raise Exception('%s is a known bad email address' % email)
-        except BadEmailAddress.DoesNotExist:
-            pass
 
         # validate email_type
         if email_type not in ['html', 'text', 'mobile']:
@@ -524,34 +870,25 @@ class MailChimpList(models.Model):
         else:
             interests = {}
 
-        # Check if the email is already subscribed:
-        email_hash = hashlib.md5(str(email).encode("utf-8")).hexdigest()
-        logger.debug('Will run lists.members.get for email "%s"', email)
+        # Add the member. MailChimp answers "Member Exists" for existing
+        # members, which are left untouched (their status, email type,
+        # merge fields and interests are kept), so no lookup is needed first.
+        logger.debug('Will run lists.members.create for email "%s"', email)
         try:
             self.connection(
-                'lists.members.get',
-                self.list_id,
-                email_hash,
+                'lists.members.create',
+                self.list_id, {
+                    'email_address': email,
+                    'status': 'pending' if double_optin else 'subscribed',
+                    'email_type': email_type,
+                    'merge_fields': merge_fields,
+                    'interests': interests,
+                },
             )
-            # If we get a response then subscriber already exists
-            return True
         except MailChimpError as e:
-            if e.args[0]['status'] != 404:
+            if e.args[0].get('title') != 'Member Exists':
                 raise e
-            # We got a 404 indicating that the address is not already a
-            # member, all good
-
-        logger.debug('Will run lists.members.create for email "%s"', email)
-        self.connection(
-            'lists.members.create',
-            self.list_id, {
-                'email_address': email,
-                'email_type': email_type,
-                'status': 'pending' if double_optin else 'subscribed',
-                'merge_fields': merge_fields,
-                'interests': interests,
-            },
-        )
+            # The member is already in the list
 
         return True
 
@@ -563,32 +900,21 @@ class MailChimpList(models.Model):
         # validate email address
         validate_email(email)
 
-        # Make sure that the email is actually already subscribed
+        # Mark the member as unsubscribed
         email_hash = hashlib.md5(str(email).encode("utf-8")).hexdigest()
-        logger.debug('Will run lists.members.get for email "%s"', email)
+        logger.debug('Will run lists.members.update for email "%s"', email)
         try:
             self.connection(
-                'lists.members.get',
+                'lists.members.update',
                 self.list_id,
-                email_hash,
+                email_hash, {
+                    'status': 'unsubscribed',
+                },
             )
-            # If we get a response then subscriber does exists
         except MailChimpError as e:
             if e.args[0]['status'] != 404:
                 raise e
-
             # We got a 404, so the subscribers doesn't exist
-            return True
-
-        # Mark the member as unsubscribed
-        logger.debug('Will run lists.members.update for email "%s"', email)
-        self.connection(
-            'lists.members.update',
-            self.list_id,
-            email_hash, {
-                'status': 'unsubscribed',
-            },
-        )
 
         return True
 
@@ -608,11 +934,8 @@ class MailChimpList(models.Model):
         validate_email(email)
         validate_email(new_email)
 
-        try:
-            BadEmailAddress.objects.get(email=new_email)
+        if BadEmailAddress.is_bad(new_email):
             raise Exception('%s is a known bad email address' % new_email)
-        except BadEmailAddress.DoesNotExist:
-            pass
 
         # Validate email_type
         if email_type not in ['html', 'text', 'mobile', None]:
@@ -641,34 +964,123 @@ class MailChimpList(models.Model):
         if 'NEW_EMAIL' in merge_fields:
             del merge_fields['NEW_EMAIL']
 
-        # Make sure that the email is actually already subscribed
+        # Send update_member, the member must already be subscribed
         email_hash = hashlib.md5(str(email).encode("utf-8")).hexdigest()
-        logger.debug('Will run lists.members.get for email "%s"', email)
+        logger.debug('Will run lists.members.update for email "%s"', email)
         try:
             self.connection(
-                'lists.members.get',
+                'lists.members.update',
                 self.list_id,
-                email_hash,
+                email_hash, {
+                    'merge_fields': merge_fields,
+                    'interests': interests,
+                },
             )
-            # If we get a response then subscriber does exists
         except MailChimpError as e:
             if e.args[0]['status'] != 404:
                 raise e
             return False  # TODO: Should we send an action back?
 
-        # Send update_member
-        logger.debug('Will run lists.members.update for email "%s"', email)
-        self.connection(
-            'lists.members.update',
-            self.list_id,
-            email_hash, {
-                'merge_fields': merge_fields,
-                'interests': interests,
-            },
-        )
-
         return True
 
+    def bulk_upsert(self, objects, email_type='html', double_optin=True):
+        '''
+        Subscribe the objects (with the list's content type) or update the
+        merge fields of the ones already members, through MailChimp batch
+        operations. New members are pending if ``double_optin'' is set.
+
+        Return a dictionary mapping the objects which could not be
+        subscribed or updated to the error message.
+        '''
+        if email_type not in ['html', 'text', 'mobile']:
+            raise Exception('Invalid email type %s - options are html, text, '
+                'or mobile.' % email_type)
+
+        errors = {}
+        objects = list(objects)
+        bad_emails = BadEmailAddress.filter_bad(
+            [obj.email for obj in objects if obj.email])
+        plan = self.get_mapping_plan()
+
+        operations = []
+        operation_objects = {}
+
+        for obj in objects:
+            if not obj.email:
+                errors[obj] = 'No email address'
+                continue
+
+            if obj.email in bad_emails:
+                errors[obj] = '%s is a known bad email address' % obj.email
+                continue
+
+            try:
+                validate_email(obj.email)
+            except ValidationError as e:
+                errors[obj] = ' '.join(e.messages)
+                continue
+
+            merge_fields = plan.create_merge_fields(obj)
+            interests = merge_fields.pop('INTERESTS', {})
+            email_hash = hashlib.md5(str(obj.email).encode("utf-8")).hexdigest()
+
+            operation_id = str(len(operations))
+            operations.append({
+                'method': 'PUT',
+                'path': 'lists/%s/members/%s' % (self.list_id, email_hash),
+                'operation_id': operation_id,
+                'body': json.dumps({
+                    'email_address': obj.email,
+                    'email_type': email_type,
+                    'status_if_new': 'pending' if double_optin else 'subscribed',
+                    'merge_fields': merge_fields,
+                    'interests': interests,
+                }),
+            })
+            operation_objects[operation_id] = obj
+
+        logger.debug('Will run batch of %d lists.members.create_or_update',
+            len(operations))
+        results = mailchimp.run_batch(self.api_key, operations)
+
+        for operation_id, obj in operation_objects.items():
+            status, response = results.get(operation_id, (None, {}))
+            if status != 200:
+                errors[obj] = response.get('detail', 'No result for operation')
+
+        return errors
+
+    def bulk_unsubscribe(self, emails):
+        '''
+        Unsubscribe the email addresses through MailChimp batch operations.
+        Addresses which are not members are ignored.
+
+        Return a dictionary mapping the email addresses which could not be
+        unsubscribed to the error message.
+        '''
+        operations = []
+        for email in emails:
+            email_hash = hashlib.md5(str(email).encode("utf-8")).hexdigest()
+            operations.append({
+                'method': 'PATCH',
+                'path': 'lists/%s/members/%s' % (self.list_id, email_hash),
+                'operation_id': email,
+                'body': json.dumps({'status': 'unsubscribed'}),
+            })
+
+        logger.debug('Will run batch of %d lists.members.update',
+            len(operations))
+        results = mailchimp.run_batch(self.api_key, operations)
+
+        errors = {}
+        for email in emails:
+            status, response = results.get(email, (None, {}))
+            # 404: the subscribers doesn't exist
+            if status not in (200, 404):
+                errors[email] = response.get('detail', 'No result for operation')
+
+        return errors
+
     def save(self, *args, **kwargs):
         '''
         Save instance (and sync info from MailChimp if it hasn't been done before).
@@ -798,6 +1210,38 @@ class MailChimpList(models.Model):
 
         return response
 
+    def get_members_merge_fields(self, emails):
+        '''
+        Retrieve the merge fields of the members with the given email
+        addresses through MailChimp batch operations. Return a dictionary
+        mapping the email addresses to their merge fields, addresses which
+        are not members are left out.
+        '''
+        operations = []
+        for email in set(emails):
+            email_hash = hashlib.md5(str(email).encode("utf-8")).hexdigest()
+            operations.append({
+                'method': 'GET',
+                'path': 'lists/%s/members/%s' % (self.list_id, email_hash),
+                'operation_id': email,
+                'params': {'fields': 'merge_fields'},
+            })
+
+        if not operations:
+            return {}
+
+        logger.debug('Will run batch of %d lists.members.get',
+            len(operations))
+        results = mailchimp.run_batch(self.api_key, operations)
+
+        merge_fields = {}
+        for email in set(emails):
+            status, response = results.get(email, (None, {}))
+            if status == 200:
+                merge_fields[email] = response.get('merge_fields', {})
+
+        return merge_fields
+
     @classmethod
     def post_save_handler(cls, sender=None, instance=None, created=False,
             raw=False, **kwargs):
@@ -817,6 +1261,7 @@ class MailChimpList(models.Model):
 
 
 # Connect signal handlers
+post_save.connect(BadEmailAddress.post_save_handler, sender=BadEmailAddress)
 post_save.connect(MailChimpList.post_save_handler, sender=MailChimpList)
 
 MERGEFIELD_DATATYPES = [
@@ -909,10 +1354,11 @@ class GroupMapping(models.Model):
             return (self.field, interest['groups'])
         return [None, None]
 
-    def create_interests(self, obj, changes=None):
+    def create_interests(self, obj, changes=None, groupings=None):
         '''
         Return a dict of form {'grouping_id': True_false, ...} for each ID
-        in the group
+        in the group. The (interest_id, option) pairs of the group are
+        fetched unless given as ``groupings''.
         '''
         val = None
 
@@ -926,10 +1372,13 @@ class GroupMapping(models.Model):
         except AttributeError:
             pass
 
+        if groupings is None:
+            groupings = MailChimpGrouping.objects.filter(
+                group_id=self.group.group_id).values_list('interest_id', 'option')
+
         interests = {}
-        for interest in MailChimpGrouping.objects.filter(
-                group_id=self.group.group_id):
-            interests[interest.interest_id] = interest.option == val
+        for interest_id, option in groupings:
+            interests[interest_id] = option == val
 
         return interests
 
@@ -1027,6 +1476,117 @@ class MergeVarMapping(models.Model):
         return '%s -> %s' % (self.merge_var, self.field)
 
 
+class MappingPlan(object):
+    '''
+    Merge field and group mappings of a list, with everything needed to
+    create the merge fields of an object loaded up front so that no database
+    query is needed. Plans can be pickled, see
+    MailChimpList.get_mapping_plan().
+    '''
+    def __init__(self, mlist):
+        self.content_type = None
+        self.pk_tag = None
+        self.merge_var_mappings = []
+        self.group_mappings = []
+
+        if not (mlist.content_type and mlist.primary_key_field):
+            return
+
+        self.content_type = mlist.content_type
+        self.pk_tag = mlist.primary_key_field.tag
+        self.merge_var_mappings = list(MergeVarMapping.objects.filter(
+            list=mlist).select_related('merge_var'))
+
+        group_mappings = list(GroupMapping.objects.filter(
+            list=mlist).select_related('group'))
+
+        groupings = defaultdict(list)
+        for group_id, interest_id, option in MailChimpGrouping.objects.filter(
+                group_id__in=[g.group.group_id for g in group_mappings]
+                ).values_list('group_id', 'interest_id', 'option'):
+            groupings[group_id].append((interest_id, option))
+
+        self.group_mappings = [(g, groupings[g.group.group_id])
+            for g in group_mappings]
+
+    def create_merge_fields(self, obj, changes=None):
+        '''
+        See MailChimpList.create_merge_fields()
+        '''
+        merge_fields = {}
+        if self.content_type and isinstance(obj, self.content_type.model_class()):
+            if changes is None:
+                merge_fields[self.pk_tag] = "%s:%s" % (smart_text(obj._meta), smart_text(obj.pk, strings_only=True))
+
+            for m in self.merge_var_mappings:
+                (tag, val) = m.create_merge_field(obj, changes=changes)
+                if val and tag != self.pk_tag:
+                    merge_fields[tag] = val
+
+            interests = {}
+            for g, groupings in self.group_mappings:
+                interest = g.create_interests(obj, changes=changes,
+                    groupings=groupings)
+                if interest:
+                    interests.update(interest)
+
+            if interests:
+                merge_fields['INTERESTS'] = interests
+
+        return merge_fields
+
+    def parse_merge_fields(self, params):
+        '''
+        See MailChimpList.parse_merge_fields()
+        '''
+        mapping = {}
+
+        if self.content_type:
+            for m in self.merge_var_mappings:
+                mapping.update(dict(m.parse_merge_field(params)))
+
+            if 'GROUPINGS' in params:
+                for g, dummy in self.group_mappings:
+                    key, value = g.parse_interests(params['GROUPINGS'])
+                    if key:
+                        mapping[key] = value
+
+        return mapping
+
+    def get_objects(self, merge_fields_list):
+        '''
+        Bulk version of MailChimpList.get_object_from_mergefields(). Return
+        the model objects of a list of MERGE FIELDS dictionaries, in the same
+        order and with None for the objects not found, using one query.
+        '''
+        pks = [None] * len(merge_fields_list)
+
+        if self.content_type:
+            model_identifier = '%s.%s' % (self.content_type.app_label,
+                self.content_type.model)
+            for i, params in enumerate(merge_fields_list):
+                identifier = params.get(self.pk_tag)
+                if identifier:
+                    model, pk = identifier.split(':')
+                    if model == model_identifier:
+                        pks[i] = pk
+
+        if not any(pks):
+            return pks
+
+        Model = self.content_type.model_class()
+        objects = dict((smart_text(pk, strings_only=True), obj) for pk, obj in
+            Model.objects.in_bulk(set(pk for pk in pks if pk)).items())
+
+        return [objects.get(pk) if pk else None for pk in pks]
+
+
+for sender in (MailChimpList, MailChimpMergeVar, MailChimpGroup,
+        MailChimpGrouping, GroupMapping, MergeVarMapping):
+    post_save.connect(MailChimpList.mapping_changed_handler, sender=sender)
+    post_delete.connect(MailChimpList.mapping_changed_handler, sender=sender)
+
+
 class MailChimpListToken(models.Model):
     '''
     Tokens used in get parameters to secure webhook requests
@@ -1096,6 +1656,60 @@ class MailChimpListToken(models.Model):
         except cls.DoesNotExist:
             return None
 
+    @classmethod
+    def lookup(cls, token):
+        '''
+        Find the list a valid token belongs to, and return it as a
+        (list pk, list id) tuple or None. Valid tokens are kept in the
+        process until they expire or the tokens are changed, so checking a
+        known token doesn't query the database.
+        '''
+        global _webhook_tokens
+
+        cache.add(WEBHOOK_TOKENS_VERSION_KEY, uuidmod.uuid4().hex,
+            WEBHOOK_TOKENS_EXPIRE)
+        version = cache.get(WEBHOOK_TOKENS_VERSION_KEY)
+
+        if _webhook_tokens[0] != version:
+            _webhook_tokens = (version, {})
+        tokens = _webhook_tokens[1]
+
+        now = datetime.now()
+        entry = tokens.get(token)
+
+        if entry is None:
+            row = cls.objects.filter(token=token).values_list(
+                'list', 'list__list_id', 'expired').first()
+            if row is None:
+                return None
+
+            list_pk, list_id, expired = row
+            valid_until = expired + timedelta(minutes=10) if expired else None
+            entry = (list_pk, list_id, valid_until)
+            tokens[token] = entry
+
+        if entry[2] is not None and entry[2] < now:
+            return None
+
+        return entry[:2]
+
+    @classmethod
+    def invalidate_tokens(cls):
+        '''
+        Drop the valid tokens kept by the processes (see lookup).
+        '''
+        global _webhook_tokens
+
+        cache.delete(WEBHOOK_TOKENS_VERSION_KEY)
+        _webhook_tokens = (None, {})
+
+    @classmethod
+    def tokens_changed_handler(cls, sender=None, **kwargs):
+        '''
+        Invalidate the valid tokens when a token or a list is changed.
+        '''
+        cls.invalidate_tokens()
+
     def validate_token(self, l):
         '''
         Validate input parameters
@@ -1109,6 +1723,65 @@ class MailChimpListToken(models.Model):
         return {'token': self.token}
 
 
+@python_2_unicode_compatible
+class MailChimpWebhookEvent(models.Model):
+    '''
+    Journal of the webhook events received from MailChimp. Events are only
+    appended by the webhook view, and processed in batches grouped by list
+    and event type by the mailchimp_webhook_events task.
+    '''
+    list = models.ForeignKey(MailChimpList, on_delete=models.CASCADE)
+    type = models.CharField(max_length=20)
+    fired_at = models.CharField(max_length=20, blank=True)
+    params = models.TextField(blank=True)
+    ip = models.CharField(max_length=50, blank=True)
+    user_agent = models.CharField(max_length=255, blank=True)
+
+    @classmethod
+    def append(cls, list_pk, type, fired_at, params, ip='', user_agent=''):
+        '''
+        Add an event to the journal and make sure it will be processed:
+        within MAILINGLISTS_WEBHOOK_EVENTS_WINDOW seconds, or right away once
+        MAILINGLISTS_WEBHOOK_EVENTS_BATCH_SIZE events are waiting.
+        '''
+        from djangoplicity.mailinglists.tasks import mailchimp_webhook_events
+
+        cls.objects.create(list_id=list_pk, type=type, fired_at=fired_at or '',
+            params=json.dumps(params), ip=ip or '', user_agent=user_agent or '')
+
+        window = getattr(settings, 'MAILINGLISTS_WEBHOOK_EVENTS_WINDOW', 30)
+        batch_size = getattr(settings, 'MAILINGLISTS_WEBHOOK_EVENTS_BATCH_SIZE', 500)
+
+        # Both keys are reset by the task when it starts, and expire in case
+        # the task is lost.
+        if cache.add(WEBHOOK_EVENTS_SCHEDULED_KEY, True, window * 10):
+            cache.set(WEBHOOK_EVENTS_COUNT_KEY, 0, window * 10)
+            transaction.on_commit(lambda: mailchimp_webhook_events.apply_async(
+                countdown=window))
+
+        try:
+            count = cache.incr(WEBHOOK_EVENTS_COUNT_KEY)
+        except ValueError:
+            count = None
+
+        if count == batch_size:
+            transaction.on_commit(mailchimp_webhook_events.delay)
+
+    def get_params(self):
+        return json.loads(self.params) if self.params else {}
+
+    def __str__(self):
+        return '%s: %s' % (self.list_id, self.type)
+
+    class Meta:
+        ordering = ('id', )
+
+
+for sender in (MailChimpListToken, MailChimpList):
+    post_save.connect(MailChimpListToken.tokens_changed_handler, sender=sender)
+    post_delete.connect(MailChimpListToken.tokens_changed_handler, sender=sender)
+
+
 #
 # More advanced stuff - configurable actions to be execute once
 # contacts are added/removed from groups (e.g subscribe to mailman).
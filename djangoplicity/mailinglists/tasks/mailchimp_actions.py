@@ -29,12 +29,18 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE
 
+import time
+
+from celery.task import task
 from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.db.models.fields import FieldDoesNotExist
 from django.utils.encoding import smart_text
 
 from djangoplicity.actions.plugins import ActionPlugin  # pylint: disable=E0611
+from djangoplicity.mailinglists.mailchimp import CircuitOpenError, requeue_on_open_circuit
 
 
 class MailChimpAction(ActionPlugin):
@@ -68,7 +74,8 @@ class MailChimpAction(ActionPlugin):
 
         return ([], result)
 
-    def _get_object(self, model_identifier, pk):
+    @classmethod
+    def _get_object(cls, model_identifier, pk):
         """
         Helper method to get the object being linked to.
         """
@@ -76,7 +83,8 @@ class MailChimpAction(ActionPlugin):
         Model = apps.get_model(*model_identifier.split("."))
         return Model.objects.get(pk=pk)
 
-    def _get_list(self, list_id):
+    @classmethod
+    def _get_list(cls, list_id):
         from djangoplicity.mailinglists.models import MailChimpList
         return MailChimpList.objects.get(list_id=list_id)
 
@@ -92,6 +100,7 @@ class MailChimpSubscribeAction(MailChimpAction):
             'true, this has no effect. defaults to false.', 'bool'),
     ]
 
+    @requeue_on_open_circuit
     def run(self, conf, model_identifier=None, pk=None):
         '''
         Subscribe to MailChimp list
@@ -132,6 +141,7 @@ class MailChimpUnsubscribeAction(MailChimpAction):
         ('send_goodbye', 'Flag to send the goodbye email to the email address, defaults to true.', 'bool'),
     ]
 
+    @requeue_on_open_circuit
     def run(self, conf, model_identifier=None, pk=None, email=None):
         """
         Unsubscribe from MailChimp list
@@ -169,52 +179,172 @@ class MailChimpUpdateAction(MailChimpAction):
 
         return ([], {'model_identifier': None, 'pk': None, 'changes': {}})
 
+    @requeue_on_open_circuit
     def run(self, conf, model_identifier=None, pk=None, changes=None):
         """
-        Email address was updated so change subscriber
+        Queue the changes in the update buffer of the object, to be sent
+        to MailChimp at the end of the update window.
         """
         if changes is None:
             changes = {}
 
-        if model_identifier and pk:
-            obj = self._get_object(model_identifier, pk)
-            list = self._get_list(conf['list_id'])
+        if not (model_identifier and pk):
+            return
 
-            # We use get_language instead of language to get the full
-            # name for the language. In order to match 'language' in the
-            # changes we use a bit of a hack:
-            if 'language' in changes:
-                changes['get_language'] = changes['language']
+        window = getattr(settings, 'MAILINGLISTS_MAILCHIMP_UPDATE_WINDOW', 60)
+        if not window:
+            self.update(conf, model_identifier, pk, changes, self.get_logger())
+            return
 
-            # Email changed
-            try:
-                (before, after) = changes['email']
-            except KeyError:
-                (before, after) = '', ''
-
-            before = before.strip()
-            after = after.strip()
-            if before != after:
-                if before == '':
-                    # No email before, so wasn't subscribed.
-                    merge_fields = list.create_merge_fields(obj)
-                    list.subscribe(after, merge_fields=merge_fields, double_optin=conf['double_optin'], send_welcome=conf['send_welcome'], is_async=False)
-                    self.get_logger().info("Subscribed email address '%s' to MailChimp list %s" % (after, list.name))
-                else:
-                    if after.strip() == '':
-                        # Unsubscribe email, since new email is empty
-                        list.unsubscribe(before, delete_member=conf['delete_member'], send_goodbye=conf['send_goodbye'], is_async=False)
-                        self.get_logger().info("Unsubscribed email address '%s' from MailChimp list %s" % (before, list.name))
-                    else:
-
-                        merge_fields = list.create_merge_fields(obj, changes=changes)
-                        list.update_profile(before, after, merge_fields=merge_fields, is_async=False)
-                        self.get_logger().info("Changed email address from '%s' to '%s' on MailChimp list %s" % (before, after, list.name))
+        if buffer_update(conf, model_identifier, pk, changes, window):
+            # First update in this window
+            mailchimp_flush_update.apply_async(
+                args=[conf['list_id'], model_identifier, pk],
+                countdown=window,
+            )
+
+    @classmethod
+    def update(cls, conf, model_identifier, pk, changes, logger):
+        """
+        Email address was updated so change subscriber
+        """
+        obj = cls._get_object(model_identifier, pk)
+        list = cls._get_list(conf['list_id'])
+
+        # We use get_language instead of language to get the full
+        # name for the language. In order to match 'language' in the
+        # changes we use a bit of a hack:
+        if 'language' in changes:
+            changes['get_language'] = changes['language']
+
+        # Email changed
+        try:
+            (before, after) = changes['email']
+        except KeyError:
+            (before, after) = '', ''
+
+        before = before.strip()
+        after = after.strip()
+        if before != after:
+            if before == '':
+                # No email before, so wasn't subscribed.
+                merge_fields = list.create_merge_fields(obj)
+                list.subscribe(after, merge_fields=merge_fields, double_optin=conf['double_optin'], send_welcome=conf['send_welcome'], is_async=False)
+                logger.info("Subscribed email address '%s' to MailChimp list %s" % (after, list.name))
             else:
-                # Email was not updated - other parts was changed
-                merge_fields = list.create_merge_fields(obj, changes=changes)
-                list.update_profile(obj.email, obj.email, merge_fields=merge_fields, is_async=False)
-                self.get_logger().info("Updated profile of subscriber with email address '%s' on MailChimp list %s" % (obj.email, list.name))
+                if after.strip() == '':
+                    # Unsubscribe email, since new email is empty
+                    list.unsubscribe(before, delete_member=conf['delete_member'], send_goodbye=conf['send_goodbye'], is_async=False)
+                    logger.info("Unsubscribed email address '%s' from MailChimp list %s" % (before, list.name))
+                else:
+
+                    merge_fields = list.create_merge_fields(obj, changes=changes)
+                    list.update_profile(before, after, merge_fields=merge_fields, is_async=False)
+                    logger.info("Changed email address from '%s' to '%s' on MailChimp list %s" % (before, after, list.name))
+        else:
+            # Email was not updated - other parts was changed
+            merge_fields = list.create_merge_fields(obj, changes=changes)
+            list.update_profile(obj.email, obj.email, merge_fields=merge_fields, is_async=False)
+            logger.info("Updated profile of subscriber with email address '%s' on MailChimp list %s" % (obj.email, list.name))
+
+
+# =======================================
+# Update buffer for MailChimpUpdateAction
+# =======================================
+
+def _buffer_key(list_id, model_identifier, pk):
+    return 'mailchimp_update_%s_%s_%s' % (list_id, model_identifier, pk)
+
+
+def _lock_buffer(key):
+    '''
+    Wait for the lock of the buffer, other workers only hold it while
+    reading and writing the buffer
+    '''
+    for dummy in range(100):
+        if cache.add('%s_lock' % key, True, 10):
+            return
+        time.sleep(0.05)
+    raise Exception('Could not lock update buffer %s' % key)
+
+
+def _unlock_buffer(key):
+    cache.delete('%s_lock' % key)
+
+
+def merge_changes(changes, new_changes):
+    '''
+    Merge two changes dictionaries (field name to (before, after) tuples),
+    keeping the first before value and the last after value of each field
+    '''
+    merged = dict(changes)
+    for field, (before, after) in new_changes.items():
+        if field in merged:
+            before = merged[field][0]
+        merged[field] = (before, after)
+    return merged
+
+
+def buffer_update(conf, model_identifier, pk, changes, window, older=False):
+    '''
+    Add the changes to the object's update buffer (before the ones already
+    buffered if ``older'' is set). Return True if the buffer was empty, i.e.
+    a flush must be scheduled.
+    '''
+    key = _buffer_key(conf['list_id'], model_identifier, pk)
+
+    _lock_buffer(key)
+    try:
+        buffered = cache.get(key)
+        if buffered is not None and older:
+            changes = merge_changes(changes, buffered['changes'])
+        elif buffered is not None:
+            changes = merge_changes(buffered['changes'], changes)
+        # Keep the buffer for a while after the window, in case the flush
+        # task is delayed
+        cache.set(key, {'conf': conf, 'changes': changes}, window * 10)
+    finally:
+        _unlock_buffer(key)
+
+    return buffered is None
+
+
+def pop_update(list_id, model_identifier, pk):
+    '''
+    Remove and return the buffered update (conf and changes) of the object
+    '''
+    key = _buffer_key(list_id, model_identifier, pk)
+
+    _lock_buffer(key)
+    try:
+        buffered = cache.get(key)
+        cache.delete(key)
+    finally:
+        _unlock_buffer(key)
+
+    return buffered
+
+
+@task(name='mailinglists.mailchimp_flush_update', ignore_result=True)
+@requeue_on_open_circuit
+def mailchimp_flush_update(list_id, model_identifier, pk):
+    '''
+    Send the updates buffered for the object during the update window
+    '''
+    buffered = pop_update(list_id, model_identifier, pk)
+    if buffered is None:
+        return
+
+    try:
+        MailChimpUpdateAction.update(buffered['conf'], model_identifier, pk,
+            buffered['changes'], mailchimp_flush_update.get_logger())
+    except CircuitOpenError:
+        # The task will be re-queued: put the changes back, before the ones
+        # buffered in the meantime
+        buffer_update(buffered['conf'], model_identifier, pk,
+            buffered['changes'], getattr(settings, 'MAILINGLISTS_MAILCHIMP_UPDATE_WINDOW', 60),
+            older=True)
+        raise
 
 
 MailChimpSubscribeAction.register()
@@ -33,15 +33,22 @@
 from future import standard_library
 standard_library.install_aliases()
 from builtins import str
+from builtins import zip
 from celery.task import task
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.sites.models import Site
-from django.db import models, transaction
+from django.core.cache import cache
+from django.db import InterfaceError, OperationalError, models, transaction
 from django.utils.encoding import smart_text
 from urllib.parse import urlencode
-from djangoplicity.mailinglists.models import MailChimpList, MailChimpListToken
+from djangoplicity.mailinglists.mailchimp import CircuitOpenError, \
+    is_transient_error, requeue_on_open_circuit
+from djangoplicity.mailinglists.models import MailChimpList, \
+    MailChimpListToken, MailChimpWebhookEvent, WEBHOOK_EVENTS_COUNT_KEY, \
+    WEBHOOK_EVENTS_LOCK_KEY, WEBHOOK_EVENTS_SCHEDULED_KEY
 import django
+import json
 if django.VERSION >= (2, 0):
     from django.urls import reverse
 else:
@@ -51,7 +58,8 @@ else:
 __all__ = [
     'mailchimp_subscribe', 'mailchimp_unsubscribe', 'mailchimp_upemail',
     'mailchimp_cleaned', 'mailchimp_profile', 'mailchimp_campaign',
-    'webhooks', 'clean_tokens', 'mailchimplist_fetch_info',
+    'mailchimp_webhook_events', 'webhooks', 'clean_tokens',
+    'mailchimplist_fetch_info',
 ]
 
 
@@ -98,36 +106,9 @@ def mailchimp_subscribe(list_pk=None, fired_at=None, params=None, ip=None,
     User subscribed via MailChimp.
     Remove from bad address if on the list and dispatch actions.
     '''
-    if params is None:
-        params = {}
-
     logger = mailchimp_subscribe.get_logger()
     _log_webhook_action(logger, ip, user_agent, 'subscribe', list_pk)
-
-    #
-    # Deregister bad email address if exists.
-    #
-    from djangoplicity.mailinglists.models import BadEmailAddress
-    email = params.get('email', '')
-
-    if email:
-        try:
-            BadEmailAddress.objects.get(email=email).delete()
-        except BadEmailAddress.DoesNotExist:
-            pass
-
-    from djangoplicity.mailinglists.models import MailChimpEventAction
-
-    mlist = _get_list(list_pk)
-
-    if 'merges' in params:
-        obj = mlist.get_object_from_mergefields(params['merges'])
-        kwargs = mlist.parse_merge_fields(params['merges'])
-        if obj:
-            kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
-
-        for a in MailChimpEventAction.get_actions(list_pk, on_event='on_subscribed'):
-            a.dispatch(**keys2str(kwargs))
+    process_events(list_pk, 'subscribe', [params or {}])
 
 
 @task(name='mailinglists.mailchimp_unsubscribe', ignore_result=True)
@@ -136,24 +117,13 @@ def mailchimp_unsubscribe(list_pk=None, fired_at=None, params=None, ip=None,
     '''
     Email was unsubscribed from list.
     '''
-    if params is None:
-        params = {}
-
     logger = mailchimp_unsubscribe.get_logger()
     _log_webhook_action(logger, ip, user_agent, 'unsubscribe', list_pk)
-
-    from djangoplicity.mailinglists.models import MailChimpEventAction
-
-    mlist = _get_list(list_pk)
-    obj = mlist.get_object_from_mergefields(params['merges'])
-    kwargs = mlist.parse_merge_fields(params['merges'])
-    kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
-
-    for a in MailChimpEventAction.get_actions(list_pk, on_event='on_unsubscribe'):
-        a.dispatch(**keys2str(kwargs))
+    process_events(list_pk, 'unsubscribe', [params or {}])
 
 
 @task(name='mailinglists.mailchimp_cleaned', ignore_result=True)
+@requeue_on_open_circuit
 def mailchimp_cleaned(list_pk=None, fired_at=None, params=None, ip=None,
     user_agent=None):
     '''
@@ -161,100 +131,294 @@ def mailchimp_cleaned(list_pk=None, fired_at=None, params=None, ip=None,
     Register bad email address and dispatch actions
     If list is linked, then get the object
     '''
-    if params is None:
-        params = {}
-
     logger = mailchimp_cleaned.get_logger()
     _log_webhook_action(logger, ip, user_agent, 'cleaned', list_pk)
+    process_events(list_pk, 'cleaned', [params or {}])
+
+
+@task(name='mailinglists.mailchimp_upemail', ignore_result=True)
+def mailchimp_upemail(list_pk=None, fired_at=None, params=None, ip=None,
+    user_agent=None):
+    '''
+    User updated their email address.
+    '''
+    logger = mailchimp_upemail.get_logger()
+    _log_webhook_action(logger, ip, user_agent, 'upemail', list_pk)
+    process_events(list_pk, 'upemail', [params or {}])
+
+
+@task(name='mailinglists.mailchimp_profile', ignore_result=True)
+def mailchimp_profile(list_pk=None, fired_at=None, params=None, ip=None,
+    user_agent=None ):
+    '''
+    User updated his profile
+    '''
+    logger = mailchimp_profile.get_logger()
+    _log_webhook_action(logger, ip, user_agent, 'profile', list_pk)
+    process_events(list_pk, 'profile', [params or {}])
+
+
+@task(name='mailinglists.mailchimp_campaign', ignore_result=True)
+def mailchimp_campaign(list_pk=None, fired_at=None, params=None, ip=None,
+    user_agent=None):
+    '''
+    Sent when a campaign is sent or cancelled
+    '''
+    logger = mailchimp_campaign.get_logger()
+    _log_webhook_action(logger, ip, user_agent, 'campaign', list_pk)
+    process_events(list_pk, 'campaign', [params or {}])
+
+
+# ====================
+# Webhook events batch
+# ====================
+
+def _get_actions(list_pk, on_event):
+    from djangoplicity.mailinglists.models import MailChimpEventAction
+    return list(MailChimpEventAction.get_actions(list_pk, on_event=on_event))
+
+
+def _dispatch(actions, kwargs_list):
+    '''
+    Dispatch the actions once for each distinct set of arguments
+    '''
+    seen = set()
+    for kwargs in kwargs_list:
+        kwargs = keys2str(kwargs)
+        key = json.dumps(kwargs, sort_keys=True, default=str)
+        if key in seen:
+            continue
+        seen.add(key)
+
+        for a in actions:
+            a.dispatch(**kwargs)
+
+
+def _dispatch_merge_fields(list_pk, events, on_event, identify_missing=True):
+    '''
+    Dispatch the actions for events with merge fields. The objects of the
+    events are fetched with one query.
+    '''
+    events = [params for params in events if 'merges' in params]
+    actions = _get_actions(list_pk, on_event)
+    if not (events and actions):
+        return
+
+    plan = _get_list(list_pk).get_mapping_plan()
+    merges = [params['merges'] for params in events]
 
-    # Register bad email address
+    kwargs_list = []
+    for params, obj in zip(merges, plan.get_objects(merges)):
+        kwargs = plan.parse_merge_fields(params)
+        if obj or identify_missing:
+            kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
+        kwargs_list.append(kwargs)
+
+    _dispatch(actions, kwargs_list)
+
+
+def _subscribe_events(list_pk, events):
+    '''
+    Users subscribed via MailChimp.
+    Remove from bad addresses if on the list and dispatch actions.
+    '''
     from djangoplicity.mailinglists.models import BadEmailAddress
 
-    email = params.get('email', '')
+    bad = BadEmailAddress.filter_bad([params.get('email', '') for params in events])
+    if bad:
+        BadEmailAddress.objects.filter(email__in=bad).delete()
+
+    _dispatch_merge_fields(list_pk, events, 'on_subscribed',
+        identify_missing=False)
+
+
+def _unsubscribe_events(list_pk, events):
+    '''
+    Emails were unsubscribed from list.
+    '''
+    _dispatch_merge_fields(list_pk, events, 'on_unsubscribe')
+
+
+def _cleaned_events(list_pk, events):
+    '''
+    Emails were removed from MailChimp list because they were invalid.
+    Register bad email addresses and dispatch actions.
+    If list is linked, then get the objects
+    '''
+    from djangoplicity.mailinglists.models import BadEmailAddress, \
+        BULK_IGNORE_CONFLICTS
+
+    emails = [params['email'] for params in events if params.get('email')]
 
-    # Prevent subscriber from being put any list again, unless explicitly
+    # Prevent subscribers from being put any list again, unless explicitly
     # subscribing again.
-    if email:
-        BadEmailAddress.objects.get_or_create(email=email)
+    new = set(emails) - BadEmailAddress.filter_bad(emails)
+    BadEmailAddress.objects.bulk_create(
+        [BadEmailAddress(email=email) for email in new], **BULK_IGNORE_CONFLICTS)
+    BadEmailAddress.add_to_filter(*new)
 
     # Dispatch actions
-    from djangoplicity.mailinglists.models import MailChimpEventAction
+    actions = _get_actions(list_pk, 'on_cleaned')
+    if not (emails and actions):
+        return
 
     mlist = _get_list(list_pk)
-    kwargs = {'email': email}
+    plan = mlist.get_mapping_plan()
 
-    if mlist.content_type and mlist.primary_key_field:
-        # List is connected, so retrieve member info via email address so we
-        # can determine the object id
-        obj = mlist.get_object_from_mergefields(
-            mlist.get_member_info(email=email)['merge_fields']
-        )
-        if not obj:
-            return
+    if not plan.content_type:
+        _dispatch(actions, [{'email': email} for email in emails])
+        return
 
-        kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
+    # List is connected, so retrieve member info via email address so we
+    # can determine the object id
+    members = mlist.get_members_merge_fields(emails)
+    merges = [members.get(email, {}) for email in emails]
 
-    for a in MailChimpEventAction.get_actions(list_pk, on_event='on_cleaned'):
-        a.dispatch(**keys2str(kwargs))
+    kwargs_list = []
+    for email, obj in zip(emails, plan.get_objects(merges)):
+        if obj:
+            kwargs = {'email': email}
+            kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
+            kwargs_list.append(kwargs)
 
+    _dispatch(actions, kwargs_list)
 
-@task(name='mailinglists.mailchimp_upemail', ignore_result=True)
-def mailchimp_upemail(list_pk=None, fired_at=None, params=None, ip=None,
-    user_agent=None):
+
+def _upemail_events(list_pk, events):
     '''
-    User updated their email address.
+    Users updated their email address.
     '''
-    if params is None:
-        params = {}
+    _dispatch(_get_actions(list_pk, 'on_upemail'), events)
 
-    logger = mailchimp_upemail.get_logger()
-    _log_webhook_action(logger, ip, user_agent, 'upemail', list_pk)
 
-    from djangoplicity.mailinglists.models import MailChimpEventAction
+def _profile_events(list_pk, events):
+    '''
+    Users updated their profile
+    '''
+    _dispatch_merge_fields(list_pk, events, 'on_profile')
 
-    for a in MailChimpEventAction.get_actions(list_pk, on_event='on_upemail'):
-        a.dispatch(**keys2str(params))
 
+def _campaign_events(list_pk, events):
+    '''
+    Sent when a campaign is sent or cancelled
+    '''
+    _dispatch(_get_actions(list_pk, 'on_campaign'), events)
 
-@task(name='mailinglists.mailchimp_profile', ignore_result=True)
-def mailchimp_profile(list_pk=None, fired_at=None, params=None, ip=None,
-    user_agent=None ):
+
+EVENT_PROCESSORS = {
+    'subscribe': _subscribe_events,
+    'unsubscribe': _unsubscribe_events,
+    'cleaned': _cleaned_events,
+    'upemail': _upemail_events,
+    'profile': _profile_events,
+    'campaign': _campaign_events,
+}
+
+
+def process_events(list_pk, event_type, events):
     '''
-    User updated his profile
+    Process the parameters of a batch of webhook events of the same type for
+    a list. The list, its actions and the objects are fetched once for the
+    batch.
     '''
-    if params is None:
-        params = {}
+    EVENT_PROCESSORS[event_type](list_pk, events)
 
-    logger = mailchimp_profile.get_logger()
-    _log_webhook_action(logger, ip, user_agent, 'profile', list_pk)
 
-    from djangoplicity.mailinglists.models import MailChimpEventAction
+def _event_emails(params):
+    return [params[k] for k in ('email', 'old_email', 'new_email') if params.get(k)]
 
-    mlist = _get_list(list_pk)
-    obj = mlist.get_object_from_mergefields(params['merges'])
-    kwargs = mlist.parse_merge_fields(params['merges'])
-    kwargs['model_identifier'], kwargs['pk'] = _object_identifier(obj)
 
-    for a in MailChimpEventAction.get_actions(list_pk, on_event='on_profile'):
-        a.dispatch(**keys2str(kwargs))
+def group_events(events):
+    '''
+    Group journal events in runs of events of the same list and type, to be
+    processed together. An event joins the latest run of its list and type,
+    unless a later run holds an event for one of its email addresses: the
+    events of an address are always processed in journal order.
+
+    Return a list of ((list pk, type), events) tuples in processing order.
+    '''
+    runs = []
+    latest_run = {}
+    email_run = {}
 
+    for e in events:
+        key = (e.list_id, e.type)
+        emails = _event_emails(e.get_params())
 
-@task(name='mailinglists.mailchimp_campaign', ignore_result=True)
-def mailchimp_campaign(list_pk=None, fired_at=None, params=None, ip=None,
-    user_agent=None):
+        i = latest_run.get(key)
+        if i is None or any(email_run.get(email, -1) > i for email in emails):
+            runs.append((key, []))
+            i = latest_run[key] = len(runs) - 1
+
+        runs[i][1].append(e)
+        for email in emails:
+            email_run[email] = max(email_run.get(email, -1), i)
+
+    return runs
+
+
+def _is_transient(e):
     '''
-    Sent when a campaign is sent or cancelled
+    Errors after which the events are kept in the journal to be tried again
     '''
-    if params is None:
-        params = {}
+    return is_transient_error(e) or isinstance(e, (OperationalError, InterfaceError))
 
-    logger = mailchimp_campaign.get_logger()
-    _log_webhook_action(logger, ip, user_agent, 'campaign', list_pk)
 
-    from djangoplicity.mailinglists.models import MailChimpEventAction
+@task(name='mailinglists.mailchimp_webhook_events', ignore_result=True)
+def mailchimp_webhook_events():
+    '''
+    Process the journal of webhook events (see MailChimpWebhookEvent), in
+    batches grouped by list and event type (see group_events). Events which
+    failed because of a transient error (e.g. the MailChimp circuit is open)
+    are kept in the journal and tried again later, other failures are logged
+    and the events dropped.
+    '''
+    logger = mailchimp_webhook_events.get_logger()
+    window = getattr(settings, 'MAILINGLISTS_WEBHOOK_EVENTS_WINDOW', 30)
+    batch_size = getattr(settings, 'MAILINGLISTS_WEBHOOK_EVENTS_BATCH_SIZE', 500)
+
+    if not cache.add(WEBHOOK_EVENTS_LOCK_KEY, True, 60 * 60):
+        # Another worker is processing the journal, check again later in
+        # case it missed the latest events
+        mailchimp_webhook_events.apply_async(countdown=window)
+        return
 
-    for a in MailChimpEventAction.get_actions(list_pk, on_event='on_campaign'):
-        a.dispatch(**keys2str(params))
+    try:
+        # Events appended from now on will schedule another run
+        cache.delete_many([WEBHOOK_EVENTS_SCHEDULED_KEY, WEBHOOK_EVENTS_COUNT_KEY])
+
+        while True:
+            events = list(MailChimpWebhookEvent.objects.all()[:batch_size])
+            if not events:
+                break
+
+            done = []
+            try:
+                for (list_pk, event_type), group in group_events(events):
+                    logger.info('Webhook %s action; list %s: %d events' %
+                        (event_type, list_pk, len(group)))
+                    try:
+                        process_events(list_pk, event_type,
+                            [e.get_params() for e in group])
+                    except Exception as e:
+                        if _is_transient(e):
+                            raise
+                        logger.exception('Could not process %s events of list %s'
+                            % (event_type, list_pk))
+                    done.extend(e.pk for e in group)
+            finally:
+                MailChimpWebhookEvent.objects.filter(pk__in=done).delete()
+    except Exception as e:
+        if not _is_transient(e):
+            raise
+
+        # The remaining events are kept in the journal
+        countdown = e.retry_in if isinstance(e, CircuitOpenError) else window
+        logger.warning('Webhook events processing interrupted, retrying in '
+            '%ds: %s' % (countdown, e))
+        mailchimp_webhook_events.apply_async(countdown=countdown)
+    finally:
+        cache.delete(WEBHOOK_EVENTS_LOCK_KEY)
 
 
 # =============
@@ -272,6 +436,7 @@ def clean_tokens():
 
 
 @task(name='mailinglists.webhooks', ignore_result=True)
+@requeue_on_open_circuit
 def webhooks(list_id=None):
     '''
     Celery task for installing webhooks for lists in MailChimp. If ``list_id``
@@ -348,6 +513,7 @@ def webhooks(list_id=None):
         MailChimpListToken.objects.exclude(pk=token.pk).filter(
             list=l, expired__isnull=True
         ).update(expired=datetime.now())
+        MailChimpListToken.invalidate_tokens()
 
         # Get list of all webhooks for the list
         logger.info('Will run lists.webhooks.all for list %s' % l.list_id)
@@ -369,6 +535,7 @@ def webhooks(list_id=None):
 
 
 @task(name='mailinglists.mailchimplist_fetch_info', ignore_result=True)
+@requeue_on_open_circuit
 def mailchimplist_fetch_info(list_id=None):
     '''
     Celery task to fetch info from MailChimp and store it locally.
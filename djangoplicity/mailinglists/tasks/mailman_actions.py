@@ -31,7 +31,8 @@
 #
 
 from django.apps import apps
-from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.core.cache import cache
 from django.db import models
 from django.utils.encoding import smart_text
 
@@ -40,6 +41,9 @@ from djangoplicity.actions.plugins import ActionPlugin  # pylint: disable=E0611
 from djangoplicity.utils.history import add_admin_history  # pylint: disable=E0611
 
 
+CHECKPOINT_EXPIRE = 60 * 60 * 24
+
+
 class MailmanAction(ActionPlugin):
     """
     An action plugin is a configureable celery task,
@@ -159,46 +163,98 @@ class MailmanSyncAction( MailmanAction ):
         obj = cls.objects.get( pk=pk )
         return obj, obj.get_emails()
 
+    def _checkpoint_key( self, conf, model_identifier, pk ):
+        return 'mailman_sync_%s_%s_%s' % ( conf['list_name'], model_identifier, pk )
+
+    def _get_unsub_group( self, obj, model_identifier ):
+        """
+        Get the group to move the contacts unsubscribed from Mailman to
+        """
+        cls = apps.get_model( *model_identifier.split( "." ) )
+        l, _created = cls.objects.get_or_create( name='unsub_%s' % obj.name )
+        return l
+
+    def _log_moved( self, conf, contacts, obj, l ):
+        for c in contacts:
+            add_admin_history( c,
+                'Mailman Sync (%s): Removed from %s' %
+                ( conf['list_name'], obj )
+            )
+            add_admin_history( c,
+                'Mailman Sync (%s): Added to group %s' %
+                ( conf['list_name'], l )
+            )
+
     def run( self, conf, model_identifier=None, pk=None ):
         """
+        Synchronize the list with the emails of the object in three stages:
+
+        1. Contacts unsubscribed from the Mailman list are moved from the
+           object to its 'unsub_' group, in chunks.
+        2. The subscribers of the list are updated.
+        3. The subscribers are pushed to Mailman.
+
+        The progress is checkpointed in the cache after each chunk and stage,
+        so a killed or retried task resumes where it stopped. The checkpoint
+        belongs to the task which wrote it: any other run of the action
+        starts over.
         """
-        if model_identifier and pk:
-            obj, emails = self._get_emails( model_identifier, pk )
-            mlist = self._get_list( conf['list_name'] )
-
-            # Convert from ValuesListQuerySet to list:
-            emails = list(emails)
-
-            mailman_emails = mlist.get_mailman_emails()
-            for email in set(emails) - mailman_emails:
-                # Remove contact from the group
-                try:
-                    c = obj.contact_set.get(email=email)
-                except ObjectDoesNotExist:
-                    continue
-
-                obj.contact_set.remove(c)
-                emails.remove(email)
-                self.get_logger().info(u'Removed %s from %s' % (c, obj))
-                add_admin_history(c,
-                    'Mailman Sync (%s): Removed from %s' %
-                    (conf['list_name'], obj)
-                )
-
-                # Add contact to 'unsub' group (create group if it doesn't exist)
-                cls = apps.get_model(*model_identifier.split( "." ))
-                l, _created = cls.objects.get_or_create(name='unsub_%s' % obj.name)
-
-                c.groups.add(l)
-                self.get_logger().info(u'Added %s to %s' % (c, l))
-                add_admin_history(c,
-                    'Mailman Sync (%s): Added to group %s' %
-                    (conf['list_name'], l)
-                )
-
-            mlist.update_subscribers( emails )
-            mlist.push( remove_existing=conf['remove_existing'] )
+        if not ( model_identifier and pk ):
+            return
+
+        obj, emails = self._get_emails( model_identifier, pk )
+        mlist = self._get_list( conf['list_name'] )
+        logger = self.get_logger()
+
+        key = self._checkpoint_key( conf, model_identifier, pk )
+        task_id = self.request.id
+        checkpoint = cache.get( key )
+        if checkpoint is None or task_id is None or checkpoint['task_id'] != task_id:
+            checkpoint = { 'task_id': task_id, 'stage': 'unsubscribed', 'last_email': None }
+        chunk_size = getattr( settings, 'MAILINGLISTS_MAILMAN_SYNC_CHUNK_SIZE', 500 )
+
+        emails = set( emails )
+
+        if checkpoint['stage'] == 'unsubscribed':
+            # Sorted so that a resumed run can skip the emails already done
+            unsubscribed = sorted( emails - mlist.get_mailman_emails() )
+            if checkpoint['last_email'] is not None:
+                unsubscribed = [e for e in unsubscribed if e > checkpoint['last_email']]
+
+            if unsubscribed:
+                l = self._get_unsub_group( obj, model_identifier )
+
+            for i in range( 0, len( unsubscribed ), chunk_size ):
+                chunk = unsubscribed[i:i + chunk_size]
+                contacts = list( obj.contact_set.filter( email__in=chunk ) )
+
+                # Bulk removal and addition, the m2m_changed signals are
+                # still sent (once per chunk)
+                obj.contact_set.remove( *contacts )
+                l.contact_set.add( *contacts )
+                self._log_moved( conf, contacts, obj, l )
+
+                emails.difference_update( c.email for c in contacts )
+                logger.info( u'Moved %d contacts from %s to %s' % ( len( contacts ), obj, l ) )
+
+                checkpoint['last_email'] = chunk[-1]
+                cache.set( key, checkpoint, CHECKPOINT_EXPIRE )
+
+            checkpoint = { 'task_id': task_id, 'stage': 'subscribers' }
+            cache.set( key, checkpoint, CHECKPOINT_EXPIRE )
+
+        if checkpoint['stage'] == 'subscribers':
+            # Contacts moved in earlier runs are no longer in the emails
+            summary = mlist.update_subscribers( emails )
+            logger.info( u'Updated subscribers of %s: %s' % ( mlist.name, summary ) )
+
+            checkpoint = { 'task_id': task_id, 'stage': 'push' }
+            cache.set( key, checkpoint, CHECKPOINT_EXPIRE )
 
+        # The push only sends what differs from the roster snapshot, so a
+        # resumed push continues with the remaining emails
+        mlist.push( remove_existing=conf['remove_existing'] )
+        cache.delete( key )
 
 MailmanSubscribeAction.register()
 MailmanUnsubscribeAction.register()
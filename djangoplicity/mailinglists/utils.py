@@ -31,6 +31,9 @@
 
 
 from builtins import object
+from builtins import range
+import hashlib
+import math
 import re
 
 
@@ -108,3 +111,43 @@ class DataQueryParser(object):
                         qdict.insert(idx, {})
 
                 DataQueryParser._set_value(qdict[idx], trail[1:], val)
+
+
+class BloomFilter(object):
+    '''
+    Set of strings which can answer membership tests with false positives
+    (at the given error rate when holding ``capacity'' items) but no false
+    negatives, in much less memory than a set.
+
+    >>> f = BloomFilter(1000)
+    >>> f.add('a@example.com')
+    >>> 'a@example.com' in f
+    True
+    '''
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = max(8, int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(
+            self.size / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _indexes(self, item):
+        # Double hashing: derive all the indexes from one digest
+        digest = hashlib.md5(item.encode('utf-8')).hexdigest()
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:], 16) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for i in self._indexes(item):
+            self.bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[i >> 3] & (1 << (i & 7))
+            for i in self._indexes(item))
+
+    def __len__(self):
+        return self.count
@@ -31,10 +31,8 @@
 
 from django.http import HttpResponse
 
-from djangoplicity.mailinglists.models import MailChimpListToken, MailChimpList
-from djangoplicity.mailinglists.tasks import mailchimp_subscribe, \
-    mailchimp_unsubscribe, mailchimp_upemail, mailchimp_cleaned, \
-    mailchimp_profile, mailchimp_campaign
+from djangoplicity.mailinglists.models import MailChimpListToken, \
+    MailChimpWebhookEvent
 from djangoplicity.mailinglists.utils import DataQueryParser
 
 import logging
@@ -53,7 +51,7 @@ def _get_parameters(request):
     return DataQueryParser.parse(request.POST)
 
 
-def subscribe_event(request, mlist, fired_at, **kwargs):
+def subscribe_event(request, list_pk, fired_at, **kwargs):
     '''
     "type": "subscribe",
     "fired_at": "2009-03-26 21:35:57",
@@ -68,8 +66,9 @@ def subscribe_event(request, mlist, fired_at, **kwargs):
     "data[ip_opt]": "10.20.10.30",
     "data[ip_signup]": "10.20.10.30"
     '''
-    mailchimp_subscribe.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='subscribe',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -77,7 +76,7 @@ def subscribe_event(request, mlist, fired_at, **kwargs):
     return HttpResponse('')
 
 
-def unsubscribe_event(request, mlist, fired_at, **kwargs):
+def unsubscribe_event(request, list_pk, fired_at, **kwargs):
     '''
     "type": "unsubscribe",
     "fired_at": "2009-03-26 21:40:57",
@@ -93,8 +92,9 @@ def unsubscribe_event(request, mlist, fired_at, **kwargs):
     "data[campaign_id]": "cb398d21d2",
     "data[reason]": "hard"
     '''
-    mailchimp_unsubscribe.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='unsubscribe',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -102,7 +102,7 @@ def unsubscribe_event(request, mlist, fired_at, **kwargs):
     return HttpResponse('')
 
 
-def profile_event(request, mlist, fired_at, **kwargs):
+def profile_event(request, list_pk, fired_at, **kwargs):
     '''
     "type": "profile",
     "fired_at": "2009-03-26 21:31:21",
@@ -116,8 +116,9 @@ def profile_event(request, mlist, fired_at, **kwargs):
     "data[merges][INTERESTS]": "Group1,Group2",
     "data[ip_opt]": "10.20.10.30"
     '''
-    mailchimp_profile.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='profile',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -125,7 +126,7 @@ def profile_event(request, mlist, fired_at, **kwargs):
     return HttpResponse('')
 
 
-def upemail_event(request, mlist, fired_at, **kwargs):
+def upemail_event(request, list_pk, fired_at, **kwargs):
     '''
     "type": "upemail",
     "fired_at": "2009-03-26 22:15:09",
@@ -134,8 +135,9 @@ def upemail_event(request, mlist, fired_at, **kwargs):
     "data[new_email]": "api+new@mailchimp.com",
     "data[old_email]": "api+old@mailchimp.com"
     '''
-    mailchimp_upemail.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='upemail',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -143,7 +145,7 @@ def upemail_event(request, mlist, fired_at, **kwargs):
     return HttpResponse('')
 
 
-def cleaned_event(request, mlist, fired_at, **kwargs):
+def cleaned_event(request, list_pk, fired_at, **kwargs):
     '''
     "type": "cleaned",
     "fired_at": "2009-03-26 22:01:00",
@@ -152,8 +154,9 @@ def cleaned_event(request, mlist, fired_at, **kwargs):
     "data[reason]": "hard",
     "data[email]": "api+cleaned@mailchimp.com"
     '''
-    mailchimp_cleaned.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='cleaned',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -161,7 +164,7 @@ def cleaned_event(request, mlist, fired_at, **kwargs):
     return HttpResponse('')
 
 
-def campaign_event(request, mlist, fired_at, **kwargs):
+def campaign_event(request, list_pk, fired_at, **kwargs):
     '''
     Example:
     "type": "campaign",
@@ -172,8 +175,9 @@ def campaign_event(request, mlist, fired_at, **kwargs):
     "data[reason]": "",
     "data[list_id]": "a6b5da105
     '''
-    mailchimp_campaign.delay(
-        list_pk=mlist.pk,
+    MailChimpWebhookEvent.append(
+        list_pk=list_pk,
+        type='campaign',
         fired_at=fired_at,
         params=_get_parameters(request),
         **kwargs
@@ -202,11 +206,10 @@ def mailchimp_webhook(request, require_secure=False):
       * POST request
       * HTTPS request
       * Validate token (not expired, and belongs to list being updated)
-      * Validate that list exists
 
     A request to mailchimp_webook must be completed within 15 seconds, thus
-    event handlers should only gather the data they need, and send the rest
-    for background processing.
+    event handlers should only gather the data they need, and append the
+    event to the journal for background processing.
     '''
     if not request.is_secure():
         if require_secure:
@@ -221,7 +224,7 @@ def mailchimp_webhook(request, require_secure=False):
         return HttpResponse('')
 
     # Check token
-    t = MailChimpListToken.get_token(token)
+    t = MailChimpListToken.lookup(token)
 
     if t is None:
         logger.error('[Webhook] Token %s not found', token)
@@ -259,14 +262,9 @@ def mailchimp_webhook(request, require_secure=False):
         'cleaned', 'campaign'):
         raise WebHookError('Unknown webhook type %s' % event_type)
 
-    # Check if list exists
-    try:
-        mlist = MailChimpList.objects.get(list_id=list_id)
-    except MailChimpList.DoesNotExist:
-        raise WebHookError('List %s does not exists' % list_id)
-
     # Validate token for list
-    if not t.validate_token(mlist):
+    list_pk, token_list_id = t
+    if list_id != token_list_id:
         raise WebHookError('Token invalid')
 
     # Get event handler
@@ -278,4 +276,4 @@ def mailchimp_webhook(request, require_secure=False):
 
     # Pass to event handler for processing.
     logger.info('[Webhook] Request accepted: %s', event_type)
-    return view(request, mlist, fired_at, ip=ip, user_agent=user_agent)
+    return view(request, list_pk, fired_at, ip=ip, user_agent=user_agent)
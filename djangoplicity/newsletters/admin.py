@@ -40,7 +40,8 @@ Administration interface for Newsletters. The major extra views includes:
 from datetime import datetime, timedelta
 from django.conf.urls import url
 from django.contrib import admin
-from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseRedirect, \
+    JsonResponse
 from django.shortcuts import get_object_or_404, render
 from django.utils.encoding import force_text
 from django.utils.translation import ugettext as _
@@ -164,6 +165,7 @@ class NewsletterAdmin( dpadmin.DjangoplicityModelAdmin, NewsletterDisplaysAdmin,
         extra_urls = [
             url( r'^(?P<pk>[-a-z0-9]+)/html/$', self.admin_site.admin_view( NewsletterAdmin.html_newsletter_view ), name='html_newsletter_view' ),
             url( r'^(?P<pk>[-a-z0-9]+)/text/$', self.admin_site.admin_view( NewsletterAdmin.text_newsletter_view ), name='text_newsletter_view' ),
+            url( r'^(?P<pk>[-a-z0-9]+)/render_status/$', self.admin_site.admin_view( NewsletterAdmin.render_status_view ), name='render_status_newsletter_view' ),
             url( r'^(?P<pk>[0-9]+)/send_test/$', self.admin_site.admin_view( self.send_newsletter_test_view ), name='send_newsletter_test_view' ),
             url( r'^(?P<pk>[0-9]+)/send_now/$', self.admin_site.admin_view( self.send_newsletter_view ), name='send_newsletter_view' ),
             url( r'^(?P<pk>[0-9]+)/schedule/$', self.admin_site.admin_view( self.schedule_newsletter_view ), name='schedule_newsletter_view' ),
@@ -177,9 +179,7 @@ class NewsletterAdmin( dpadmin.DjangoplicityModelAdmin, NewsletterDisplaysAdmin,
         Refresh the feed data for the selected newsletter and their translations
         '''
         for n in queryset:
-            n.get_feed_data(refresh=True)
-            for local in n.translations.all():
-                local.get_feed_data(refresh=True)
+            Newsletter.fetch_feed_data([n] + list(n.translations.all()), refresh=True)
 
     refresh_feed_data.short_description = 'Refresh remote feeds'
 
@@ -219,6 +219,14 @@ class NewsletterAdmin( dpadmin.DjangoplicityModelAdmin, NewsletterDisplaysAdmin,
         response["Content-Type"] = "text/plain; charset=utf-8"
         return response
 
+    @classmethod
+    def render_status_view( cls, request, pk=None ):
+        """
+        Progress of the re-rendering of the translations (JSON)
+        """
+        newsletter = get_object_or_404( Newsletter, pk=pk )
+        return JsonResponse( newsletter.render_status() )
+
     def generate_newsletter_view( self, request ):
         """
         Generate a new newsletter
@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+#
+# djangoplicity-newsletters
+# Copyright (c) 2007-2011, European Southern Observatory (ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#
+#    * Neither the name of the European Southern Observatory nor the names
+#      of its contributors may be used to endorse or promote products derived
+#      from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+
+'''
+Fetching of the JSON feeds used by NewsletterFeedDataSource.
+
+All requests go through a shared ``requests.Session'', so connections to the
+feed servers are pooled and reused. ``fetch_all'' fetches several feeds
+concurrently with a bounded number of threads, so that one slow feed only
+delays the newsletter by its own timeout.
+
+Responses are kept in the Django cache, keyed on the URL and parameters
+(i.e. the language), together with their ETag and Last-Modified headers:
+
+    * within ``ttl'' seconds of the last fetch the cached data is used,
+    * within ``stale_ttl'' more seconds the cached data is used and the feed
+      is revalidated in the background (stale-while-revalidate),
+    * otherwise the feed is fetched with a conditional request, and the
+      cached data is used if the feed hasn't changed (or can't be fetched).
+
+If only the first ``max_items'' items of a feed are needed (top-level JSON
+array), the response body is streamed and parsed incrementally with
+``iter_json_array'', and the download stops as soon as enough items have
+been read.
+
+Settings:
+
+    * NEWSLETTERS_FEED_CONCURRENCY: maximum number of concurrent requests
+      (default 8).
+'''
+
+from multiprocessing.pool import ThreadPool
+import codecs
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+import requests
+from requests.adapters import HTTPAdapter
+
+from djangoplicity.newsletters.tasks import acquire_lock, revalidate_feed
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10
+
+CHUNK_SIZE = 8192
+
+# Cached responses are kept longer than their TTL, so they can be
+# revalidated with a conditional request
+CACHE_EXPIRE = 60 * 60 * 24 * 7
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_concurrency():
+    return getattr(settings, 'NEWSLETTERS_FEED_CONCURRENCY', 8)
+
+
+def get_session():
+    '''
+    Return the shared session used to fetch feeds
+    '''
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=get_concurrency())
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+
+    return _session
+
+
+def _cache_key(url, params, max_items=None):
+    key = json.dumps([url, params, max_items], sort_keys=True).encode('utf-8')
+    return 'newsletters_feed_%s' % hashlib.md5(key).hexdigest()
+
+
+def fetch_json(url, params=None, timeout=DEFAULT_TIMEOUT, ttl=0, stale_ttl=0, refresh=False,
+        max_items=None):
+    '''
+    Fetch and decode a JSON feed, using the cached response if possible (see
+    above). If refresh is True the feed is always revalidated. If max_items
+    is given the feed must be a JSON array, and only its first max_items
+    items are read.
+
+    Returns None if the feed can't be fetched or isn't valid JSON and there
+    is no cached response.
+    '''
+    key = _cache_key(url, params, max_items)
+    entry = cache.get(key)
+
+    if entry is not None and not refresh:
+        age = time.time() - entry['fetched']
+        if age < ttl:
+            return entry['data']
+        if age < ttl + stale_ttl:
+            if acquire_lock('%s_revalidate' % key):
+                revalidate_feed.delay(url, params, timeout, max_items)
+            return entry['data']
+
+    return _fetch(url, params, timeout, key, entry, max_items)
+
+
+def revalidate(url, params=None, timeout=DEFAULT_TIMEOUT, max_items=None):
+    '''
+    Revalidate the cached response of a feed
+    '''
+    key = _cache_key(url, params, max_items)
+    return _fetch(url, params, timeout, key, cache.get(key), max_items)
+
+
+def _fetch(url, params, timeout, key, entry, max_items):
+    stale = entry['data'] if entry is not None else None
+
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+
+    try:
+        r = get_session().get(url, params=params, timeout=timeout, headers=headers,
+            stream=max_items is not None)
+    except (requests.ConnectionError, requests.Timeout) as e:
+        logger.warning('Can\'t fetch feed: %s (%s)', url, e)
+        return stale
+
+    try:
+        if r.status_code == requests.codes.not_modified and entry is not None:
+            entry['fetched'] = time.time()
+            cache.set(key, entry, CACHE_EXPIRE)
+            return entry['data']
+
+        if r.status_code != requests.codes.ok:
+            logger.warning('Can\'t fetch feed: %s (%d)', url, r.status_code)
+            return stale
+
+        try:
+            data = _read_json(r, max_items)
+        except ValueError:
+            logger.warning('Invalid JSON for: %s', url)
+            return stale
+        except (requests.ConnectionError, requests.Timeout) as e:
+            logger.warning('Can\'t fetch feed: %s (%s)', url, e)
+            return stale
+    finally:
+        # Releases the connection, or discards it if the body wasn't read
+        r.close()
+
+    cache.set(key, {
+        'data': data,
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+        'fetched': time.time(),
+    }, CACHE_EXPIRE)
+
+    return data
+
+
+def _read_json(r, max_items):
+    '''
+    Decode the JSON body of a response, reading only the first max_items
+    items of the top-level array if max_items is not None.
+    '''
+    if max_items is None:
+        return r.json()
+
+    decoder = codecs.getincrementaldecoder(r.encoding or 'utf-8')()
+    chunks = (decoder.decode(chunk) for chunk in r.iter_content(CHUNK_SIZE))
+
+    items = []
+    if max_items > 0:
+        for item in iter_json_array(chunks):
+            items.append(item)
+            if len(items) >= max_items:
+                break
+
+    return items
+
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER_CHARS = '0123456789+-.eE'
+
+
+def iter_json_array(chunks):
+    '''
+    Incrementally parse a top-level JSON array from an iterable of text
+    chunks, yielding its items one at a time. Only the current item is kept
+    in memory, and no more chunks are read than needed for the items
+    consumed.
+
+    Raises ValueError if the input isn't a valid JSON array.
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = u''
+    pos = 0
+    exhausted = False
+    state = 'start'  # start, first (item or ']'), item, next (',' or ']')
+
+    while True:
+        pos = _WHITESPACE.match(buf, pos).end()
+
+        if pos < len(buf):
+            c = buf[pos]
+            if state == 'start':
+                if c != '[':
+                    raise ValueError('Not a JSON array')
+                pos += 1
+                state = 'first'
+                continue
+            if state in ('first', 'next') and c == ']':
+                return
+            if state == 'next':
+                if c != ',':
+                    raise ValueError('Expecting \',\' delimiter at %d' % pos)
+                pos += 1
+                state = 'item'
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if exhausted:
+                    raise
+            else:
+                # A number ending with the buffer (or with a character
+                # which could be part of it, e.g. '1.' in '1.5') might
+                # continue in the next chunk
+                if exhausted or (end < len(buf) and buf[end] not in _NUMBER_CHARS):
+                    yield item
+                    pos = end
+                    state = 'next'
+                    continue
+        elif exhausted:
+            raise ValueError('Unexpected end of JSON array')
+
+        # Need more data
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            exhausted = True
+        else:
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def fetch_all(jobs, concurrency=None):
+    '''
+    Run several fetch jobs (callables without arguments) concurrently, with
+    at most ``concurrency'' jobs at a time. Returns the results in the same
+    order as the jobs.
+    '''
+    jobs = list(jobs)
+    if concurrency is None:
+        concurrency = get_concurrency()
+
+    if len(jobs) <= 1 or concurrency <= 1:
+        return [job() for job in jobs]
+
+    pool = ThreadPool(min(concurrency, len(jobs)))
+    try:
+        return pool.map(lambda job: job(), jobs)
+    finally:
+        pool.close()
+        pool.join()
@@ -62,6 +62,10 @@ are available:
 Each mailer plugin can override the ``get_mailer_context'' to provide their own context
 variables for the templates.
 
+Mailers should render the newsletter with ``Newsletter.render_for_mailer'', which renders
+each language only once and fills in the links of each mailer afterwards. A full render is
+done automatically if the templates depend on the mailer in any other way.
+
 The MailerPlugin should also specify names and types of any parameters that an admin
 user may need to specify - e.g. the Mailman plugin needs the list's info URL to be specified.
 The parameters are stored in MailerParameter, and are automatically created by the Mailer model.
@@ -72,10 +76,15 @@ The parameters are stored in MailerParameter, and are automatically created by t
 from builtins import str
 import logging
 from email import charset as Charset
+from multiprocessing.pool import ThreadPool
 from requests.exceptions import HTTPError
 
+from django.conf import settings
 from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
+
+from djangoplicity.mailinglists.mailchimp import CircuitOpenError
 
 
 logger = logging.getLogger(__name__)
@@ -168,7 +177,7 @@ class EmailMailerPlugin(MailerPlugin):
         """
         Send combined HTML and plain text email.
         """
-        data = newsletter.render(self.get_mailer_context(), store=False)
+        data = newsletter.render_for_mailer(self.get_mailer_context(), store=False)
 
         from_email = '%s <%s>' % (newsletter.from_name, newsletter.from_email)
 
@@ -322,29 +331,12 @@ class MailChimpMailerPlugin(MailerPlugin):
             }],
         }
 
-    def _update_campaign(self, nl, campaign_id, language, languages):
+    def _render_version(self, nl, language):
         '''
-        Update an existing campaign in MailChimp.
-        Returns:
-         - campaign_id
-         - touched: whether the campaign_id has changed
+        Render the newsletter (or its local version for the given language)
+        with the mailer context.
+        Returns a tuple (subject, from_email, from_name, html, text)
         '''
-
-        self._check_languages(nl)
-
-        # Make sure that we actually have the campaign in Mailchimp,
-        # otherwise create it (for example if it was manually deleted)
-        logger.debug('Will run campaigns.get with ID "%s"', campaign_id)
-        try:
-            self.ml.connection(
-                'campaigns.get',
-                campaign_id,
-            )
-        except HTTPError:
-            logger.warning('Campaign %s not found in Mailchimp for NL "%s" '
-                'lang: %s creating a new one.', campaign_id, language, nl.pk)
-            return (self._create_campaign(nl, language, languages), True)
-
         if language:
             # Fetch the local version of the newsletter
             # for the given language
@@ -354,110 +346,96 @@ class MailChimpMailerPlugin(MailerPlugin):
                     '%d for language "%s"' % (nl.id, language))
 
             #  Add the mailer_context to the newsletter:
-            local.render(self.get_mailer_context())
+            data = local.render_for_mailer(self.get_mailer_context())
 
             # Set the variables accordingly:
-            subject = local.subject
             from_email = local.from_email if local.from_email else local.source.from_email
             from_name = local.from_name if local.from_name else local.source.from_name
-            html = local.html
-            text = local.text
         else:
             #  Add the mailer_context to the newsletter:
-            nl.render(self.get_mailer_context())
+            data = nl.render_for_mailer(self.get_mailer_context())
 
-            subject = nl.subject
             from_email = nl.from_email
             from_name = nl.from_name
-            html = nl.html
-            text = nl.text
 
-        data = {
-            'recipients': {
-                'list_id': self.ml.list_id,
-            },
+        return (data['subject'], from_email, from_name, data['html'], data['text'])
+
+    def _prepare_campaign(self, nl, language, languages):
+        '''
+        Render the version of the newsletter for the given language and
+        build the campaign data to upload to MailChimp.
+        '''
+        (subject, from_email, from_name, html, text) = \
+            self._render_version(nl, language)
+
+        recipients = {
+            'list_id': self.ml.list_id,
+        }
+
+        segment_opts = self._get_segment_opts(language, languages)
+        if segment_opts:
+            recipients['segment_opts'] = segment_opts
+
+        return {
+            'recipients': recipients,
             'settings': {
                 'subject_line': self._chop(subject, 150),
                 'title': self._chop(subject, 100),
                 'from_name': from_name,
                 'reply_to': from_email,
-            }
+            },
+            'content': {
+                'plain_text': text,
+                'html': html,
+            },
         }
 
-        segment_opts = self._get_segment_opts(language, languages)
-        if segment_opts:
-            data['recipients']['segment_opts'] = segment_opts
+    def _update_campaign(self, nl, campaign_id, language, campaign):
+        '''
+        Update the recipients and settings of an existing campaign in
+        MailChimp. Returns False if the campaign doesn't exist anymore (for
+        example if it was manually deleted).
+        '''
+        # Make sure that we actually have the campaign in Mailchimp
+        logger.debug('Will run campaigns.get with ID "%s"', campaign_id)
+        try:
+            self.ml.connection(
+                'campaigns.get',
+                campaign_id,
+            )
+        except HTTPError:
+            logger.warning('Campaign %s not found in Mailchimp for NL "%s" '
+                'lang: %s creating a new one.', campaign_id, nl.pk, language)
+            return False
 
         # Update the campaign
         logger.debug('Will run campaigns.update with lang "%s"', language)
         self.ml.connection(
             'campaigns.update',
-            campaign_id,
-            data,
-        )
-
-        # Update the content
-        logger.debug('Will run campaigns.content.update with lang "%s"',
-            language)
-        self.ml.connection(
-            'campaigns.content.update',
             campaign_id, {
-                'plain_text': text,
-                'html': html,
+                'recipients': campaign['recipients'],
+                'settings': campaign['settings'],
             }
         )
 
-        return (campaign_id, False)
+        return True
 
-    def _create_campaign(self, nl, language, languages):
+    def _create_campaign(self, nl, language, campaign):
         '''
-        Create a new campaign in MailChimp
+        Create a new campaign in MailChimp, and return its id
         '''
-
-        self._check_languages(nl)
-
-        if language:
-            # Fetch the local version of the newsletter
-            # for the given language
-            local = nl.get_local_version(language)
-            if not local:
-                raise Exception('Can\'t find Local newsletter for Newsletter'
-                    '%d for language "%s"' % (nl.id, language))
-
-            #  Add the mailer_context to the newsletter:
-            local.render(self.get_mailer_context())
-
-            # Set the variables accordingly:
-            subject = local.subject
-            from_email = local.from_email if local.from_email else local.source.from_email
-            from_name = local.from_name if local.from_name else local.source.from_name
-            html = local.html
-            text = local.text
-        else:
-            #  Add the mailer_context to the newsletter:
-            nl.render(self.get_mailer_context())
-
-            subject = nl.subject
-            from_email = nl.from_email
-            from_name = nl.from_name
-            html = nl.html
-            text = nl.text
+        campaign_settings = dict(campaign['settings'])
+        campaign_settings.update({
+            'authenticate': True,
+            'auto_footer': False,
+            'inline_css': True,
+            'fb_comments': True,
+        })
 
         data = {
             'type': 'regular',
-            'recipients': {
-                'list_id': self.ml.list_id,
-            },
-            'settings': {
-                'subject_line': self._chop(subject, 150),
-                'title': self._chop(subject, 100),
-                'from_name': from_name,
-                'reply_to': from_email,
-                'authenticate': True,
-                'auto_footer': False,
-                'inline_css': True,
-                'fb_comments': True,
-            },
+            'recipients': campaign['recipients'],
+            'settings': campaign_settings,
             'tracking': {
                 'opens': True,
                 'html_clicks': True,
@@ -465,10 +443,6 @@ class MailChimpMailerPlugin(MailerPlugin):
             },
         }
 
-        segment_opts = self._get_segment_opts(language, languages)
-        if segment_opts:
-            data['recipients']['segment_opts'] = segment_opts
-
         # Create the campaign
         logger.debug('Will run campaigns.create for NL %s, %s', nl.pk,
             language)
@@ -480,23 +454,54 @@ class MailChimpMailerPlugin(MailerPlugin):
         campaign_id = response['id']
         logger.debug('Got campaign_id: %s', campaign_id)
 
-        logger.debug('Will run campaigns.content.create for NL %s, %s', nl.pk,
-            language)
-        self.ml.connection(
-            'campaigns.content.update',
-            campaign_id,
-            {
-                'plain_text': text,
-                'html': html,
-            }
-        )
-
         return campaign_id
 
+    def _upload_campaign(self, nl, language, campaign_id, campaign):
+        '''
+        Upload the campaign for one language, creating it if there is no
+        campaign_id yet. Runs in a worker thread, so no database access.
+        Returns a tuple (campaign_id, created, error). If the upload failed
+        after the campaign was created, the new campaign_id is still
+        returned so that it can be recorded.
+        '''
+        created = False
+        try:
+            if campaign_id and not self._update_campaign(nl, campaign_id,
+                    language, campaign):
+                campaign_id = ''
+
+            if not campaign_id:
+                campaign_id = self._create_campaign(nl, language, campaign)
+                created = True
+
+            # Update the content
+            logger.debug('Will run campaigns.content.update for NL %s, %s',
+                nl.pk, language)
+            self.ml.connection(
+                'campaigns.content.update',
+                campaign_id,
+                campaign['content'],
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception('Upload of NL %s, lang "%s" to MailChimp failed',
+                nl.pk, language)
+            return (campaign_id, created, e)
+
+        return (campaign_id, created, None)
+
     def _upload_newsletter(self, newsletter):
         '''
         Upload a newsletter (and localised version if any) into MailChimp, and
         record the MailChimp campaign id.
+
+        All versions are rendered first, then uploaded concurrently (at most
+        NEWSLETTERS_MAILCHIMP_UPLOAD_CONCURRENCY at a time, default 5), and
+        the campaign ids are recorded in one transaction at the end.
+
+        Returns a dictionary {language: outcome}, where outcome is 'created',
+        'updated' or the exception raised by the upload. If any upload failed
+        an exception is raised once the other campaigns have been recorded
+        (the CircuitOpenError if the MailChimp circuit was open).
         '''
         from djangoplicity.newsletters.models import MailChimpCampaign
 
@@ -507,6 +512,14 @@ class MailChimpMailerPlugin(MailerPlugin):
         languages = ['']
         languages.extend(newsletter.type.languages.values_list('lang', flat=True))
 
+        existing = dict(
+            (info.lang, info.campaign_id) for info in MailChimpCampaign.objects.filter(
+                newsletter=newsletter,
+                list_id=self.ml.list_id,
+            )
+        )
+
+        jobs = []
         for language in languages:
             # Only upload ready translations
             if language:
@@ -519,29 +532,54 @@ class MailChimpMailerPlugin(MailerPlugin):
                 if not local.translation_ready:
                     continue
 
-            (info, created) = MailChimpCampaign.objects.get_or_create(
-                newsletter=newsletter,
-                list_id=self.ml.list_id,
-                lang=language,
-            )
+            campaign = self._prepare_campaign(newsletter, language, languages)
+            jobs.append((language, existing.get(language, ''), campaign))
 
-            logger.debug('MailchChimpCampaign, created: %s', created)
-            if not created and info.campaign_id:
-                (info.campaign_id, touched) = self._update_campaign(
-                    newsletter,
-                    info.campaign_id,
-                    language,
-                    languages,
-                )
-                if touched:
-                    info.save()
-            else:
-                info.campaign_id = self._create_campaign(
-                    newsletter,
-                    language,
-                    languages,
-                )
-                info.save()
+        concurrency = getattr(settings, 'NEWSLETTERS_MAILCHIMP_UPLOAD_CONCURRENCY', 5)
+        pool = ThreadPool(max(1, min(concurrency, len(jobs))))
+        try:
+            results = pool.map(
+                lambda job: self._upload_campaign(newsletter, *job),
+                jobs
+            )
+        finally:
+            pool.close()
+            pool.join()
+
+        outcomes = {}
+        with transaction.atomic():
+            for (language, campaign_id, _), (new_campaign_id, created, error) in zip(jobs, results):
+                # New campaigns are recorded even if the upload failed
+                # afterwards, so that the next upload updates them
+                if new_campaign_id and new_campaign_id != campaign_id:
+                    MailChimpCampaign.objects.update_or_create(
+                        newsletter=newsletter,
+                        list_id=self.ml.list_id,
+                        lang=language,
+                        defaults={'campaign_id': new_campaign_id},
+                    )
+
+                if error is not None:
+                    outcomes[language] = error
+                else:
+                    outcomes[language] = 'created' if created else 'updated'
+
+        for language, outcome in outcomes.items():
+            logger.info('MailChimp upload of NL %s, lang "%s": %s',
+                newsletter.pk, language, outcome)
+
+        failed = [language for language, outcome in outcomes.items()
+            if isinstance(outcome, Exception)]
+        for language in failed:
+            if isinstance(outcomes[language], CircuitOpenError):
+                # Let the task re-queue itself once the circuit closes
+                raise outcomes[language]
+        if failed:
+            raise Exception('Upload of Newsletter %s to MailChimp failed for '
+                'languages: %s' % (newsletter.pk, ', '.join(
+                    '"%s"' % language for language in sorted(failed))))
+
+        return outcomes
 
     def _get_languages(self):
         '''
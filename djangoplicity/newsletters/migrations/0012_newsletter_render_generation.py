@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0011_auto_20201016_0554'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='render_generation',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0012_newsletter_render_generation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletterfeeddatasource',
+            name='timeout',
+            field=models.PositiveIntegerField(default=10, help_text='Timeout in seconds when fetching the feed'),
+        ),
+    ]
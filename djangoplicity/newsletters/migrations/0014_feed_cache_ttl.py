@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0013_newsletterfeeddatasource_timeout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletterfeeddatasource',
+            name='cache_ttl',
+            field=models.PositiveIntegerField(default=3600, help_text='Time in seconds during which a fetched feed is reused without checking for changes'),
+        ),
+        migrations.AddField(
+            model_name='newsletterfeeddatasource',
+            name='stale_ttl',
+            field=models.PositiveIntegerField(default=86400, help_text='Time in seconds after the cache TTL during which the previously fetched feed is used while checking for changes in the background'),
+        ),
+    ]
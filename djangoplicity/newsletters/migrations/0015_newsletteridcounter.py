@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:25
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def seed_counter(apps, schema_editor):
+    Newsletter = apps.get_model('newsletters', 'Newsletter')
+    NewsletterIdCounter = apps.get_model('newsletters', 'NewsletterIdCounter')
+
+    max_id = 0
+    for pk in Newsletter.objects.filter(id__regex=r'^[0-9]+$').values_list('id', flat=True):
+        max_id = max(max_id, int(pk))
+
+    NewsletterIdCounter.objects.update_or_create(pk=1, defaults={'value': max_id})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0014_feed_cache_ttl'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NewsletterIdCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counter, migrations.RunPython.noop),
+    ]
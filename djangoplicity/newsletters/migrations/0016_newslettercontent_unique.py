@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 19:10
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+def remove_duplicate_content(apps, schema_editor):
+    NewsletterContent = apps.get_model('newsletters', 'NewsletterContent')
+
+    seen = set()
+    duplicates = []
+    for pk, newsletter_id, data_source_id, object_id in NewsletterContent.objects.order_by('pk').values_list(
+            'pk', 'newsletter_id', 'data_source_id', 'object_id'):
+        key = (newsletter_id, data_source_id, object_id)
+        if key in seen:
+            duplicates.append(pk)
+        seen.add(key)
+
+    NewsletterContent.objects.filter(pk__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletters', '0015_newsletteridcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_content, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='newslettercontent',
+            unique_together=set([('newsletter', 'data_source', 'object_id')]),
+        ),
+    ]
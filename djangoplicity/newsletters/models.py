@@ -49,8 +49,10 @@ The newsletter system consists of the following components:
 from builtins import str
 from builtins import object
 from future.utils import python_2_unicode_compatible
+from contextlib import contextmanager
+from functools import partial
+import hashlib
 import logging
-import requests
 import traceback
 from datetime import datetime, timedelta
 
@@ -59,8 +61,10 @@ from django.contrib.admin.models import LogEntry, CHANGE
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.postgres.fields import JSONField
 from django.contrib.sites.models import Site
-from django.db import models
-from django.db.models.signals import post_save
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
 from django.template import Context, Template, defaultfilters
 from django.utils import translation
 from django.utils.html import format_html
@@ -71,11 +75,13 @@ from djangoplicity.archives.base import ArchiveModel
 from djangoplicity.archives.contrib import types
 from djangoplicity.archives.resources import ImageResourceManager
 from djangoplicity.archives.translation import TranslationProxyMixin
+from djangoplicity.newsletters import feeds
 from djangoplicity.newsletters.mailers import EmailMailerPlugin, MailerPlugin, \
     MailmanMailerPlugin
+from djangoplicity.newsletters.rendering import MailerRendering
 from djangoplicity.newsletters.tasks import send_newsletter, \
     send_newsletter_test, schedule_newsletter, unschedule_newsletter, \
-    send_scheduled_newsletter
+    send_scheduled_newsletter, render_translations
 from djangoplicity.translation.fields import LanguageField
 from djangoplicity.translation.models import TranslationModel, \
     translation_reverse
@@ -90,11 +96,49 @@ logger = logging.getLogger(__name__)
 
 SUBJECT_MAX_LENGTH = 500
 
+# bulk_create( ignore_conflicts=True ) is only available from Django 2.2
+BULK_IGNORE_CONFLICTS = { 'ignore_conflicts': True } if django.VERSION >= (2, 2) else {}
+
 
 def make_nl_id():
     '''
-    Create a new Unique ID for the newsletter based on the largest
-    existing ID so far
+    Create a new Unique ID for the newsletter from the NewsletterIdCounter.
+    The counter row is locked until the end of the transaction, so
+    concurrent allocations are serialised. IDs assigned manually move the
+    counter forward (see bump_nl_id), so no lookup of existing IDs is needed.
+    '''
+    with transaction.atomic():
+        try:
+            counter = NewsletterIdCounter.objects.select_for_update().get(pk=1)
+        except NewsletterIdCounter.DoesNotExist:
+            # The row is seeded by a migration, only scan the IDs if it is
+            # missing (e.g. after a flush)
+            counter, _ = NewsletterIdCounter.objects.select_for_update().get_or_create(
+                pk=1, defaults={'value': _max_nl_id()}
+            )
+
+        value = counter.value + 1
+        counter.value = value
+        counter.save(update_fields=['value'])
+
+    return str(value)
+
+
+def bump_nl_id(pk):
+    '''
+    Make sure the NewsletterIdCounter won't allocate a manually assigned ID
+    '''
+    try:
+        value = int(pk)
+    except ValueError:
+        return
+
+    NewsletterIdCounter.objects.filter(pk=1, value__lt=value).update(value=value)
+
+
+def _max_nl_id():
+    '''
+    Largest existing integer ID so far
     '''
     max_id = 0
     for pk in Newsletter.objects.values_list('id', flat=True):
@@ -106,7 +150,14 @@ def make_nl_id():
         if pk > max_id:
             max_id = pk
 
-    return str(max_id + 1)
+    return max_id
+
+
+class NewsletterIdCounter( models.Model ):
+    """
+    Single row table holding the last allocated newsletter ID (see make_nl_id)
+    """
+    value = models.PositiveIntegerField( default=0 )
 
 
 @python_2_unicode_compatible
@@ -377,6 +428,75 @@ class NewsletterType( models.Model ):
     #
     languages = models.ManyToManyField( Language, blank=True, through='NewsletterLanguage' )
 
+    # Process-level cache of compiled templates: pk -> (content hash, templates)
+    _template_cache = {}
+    _template_cache_stats = { 'hits': 0, 'misses': 0 }
+
+    def _templates_hash( self ):
+        """
+        Hash of the subject, text and HTML templates of this type
+        """
+        m = hashlib.md5()
+        for tpl in ( self.subject_template, self.text_template, self.html_template ):
+            m.update( str( tpl or '' ).encode( 'utf-8' ) )
+            m.update( b'\0' )
+        return m.hexdigest()
+
+    def get_templates( self ):
+        """
+        Return a dictionary with the compiled html, text and subject
+        templates (subject is None if no subject template is defined).
+
+        Compiled templates are cached per process, so the same template is
+        only parsed once no matter how many languages and mailers it is
+        rendered for.
+        """
+        digest = self._templates_hash()
+        cached_digest, templates = self._template_cache.get( self.pk, ( None, None ) )
+        if templates is not None and cached_digest == digest:
+            self._template_cache_stats['hits'] += 1
+            return templates
+
+        templates = {
+            'html': Template( self.html_template ),
+            'text': Template( self.text_template ),
+            'subject': Template( self.subject_template ) if self.subject_template else None,
+        }
+        self._template_cache_stats['misses'] += 1
+        if self.pk is not None:
+            # Replaces the templates of an older version of this type, so
+            # the cache holds at most one entry per newsletter type
+            self._template_cache[self.pk] = ( digest, templates )
+        return templates
+
+    @classmethod
+    def template_cache_info( cls ):
+        """
+        Return hit/miss counters and current size of the template cache
+        """
+        info = dict( cls._template_cache_stats )
+        info['size'] = len( cls._template_cache )
+        return info
+
+    @classmethod
+    def clear_template_cache( cls, pk=None ):
+        """
+        Remove the compiled templates of the given newsletter type (or of
+        all types if pk is None) from the cache.
+        """
+        if pk is None:
+            cls._template_cache.clear()
+        else:
+            cls._template_cache.pop( pk, None )
+
+    @classmethod
+    def post_save_handler( cls, sender=None, instance=None, **kwargs ):
+        """
+        Callback to invalidate the compiled templates of a newsletter type
+        """
+        if instance:
+            cls.clear_template_cache( instance.pk )
+
     def get_generator( self ):
         return NewsletterGenerator( typ=self )
 
@@ -391,6 +511,11 @@ class NewsletterType( models.Model ):
         ordering = ['name']
 
 
+# Connect signal handlers
+post_save.connect( NewsletterType.post_save_handler, sender=NewsletterType )
+post_delete.connect( NewsletterType.post_save_handler, sender=NewsletterType )
+
+
 @python_2_unicode_compatible
 class NewsletterLanguage( models.Model ):
     """
@@ -447,6 +572,10 @@ class Newsletter( ArchiveModel, TranslationModel ):
     # Feed Data "cache"
     feed_data = JSONField(default=dict)
 
+    # Incremented each time the source newsletter is saved, and set on the
+    # translations once they have been re-rendered for that generation.
+    render_generation = models.PositiveIntegerField( default=0, editable=False )
+
     # Editorial if needed
     editorial_subject = models.CharField( max_length=255, blank=True )
     editorial = models.TextField( blank=True )
@@ -464,8 +593,9 @@ class Newsletter( ArchiveModel, TranslationModel ):
             self.scheduled_status = 'ONGOING'
             self.save()
 
-            for m in self.type.mailers.all():
-                m.on_scheduled( self )
+            with self._reuse_renderings():
+                for m in self.type.mailers.all():
+                    m.on_scheduled( self )
 #           try:
 #               for m in self.type.mailers.all():
 #                   m.on_scheduled( self )
@@ -546,14 +676,17 @@ class Newsletter( ArchiveModel, TranslationModel ):
         if check_scheduled and self.scheduled_status != 'ON':
             raise Exception( 'Won\'t send Newsletter: Scheduling status is "%s"' % self.scheduled_status)
 
-        for m in self.type.mailers.all():
-            logger.info('Starting sending with mailer "%s"', m)
-            res = m.send_now( self )
-            if res:
-                raise Exception(res)
+        with self._reuse_renderings():
+            for m in self.type.mailers.all():
+                logger.info('Starting sending with mailer "%s"', m)
+                res = m.send_now( self )
+                if res:
+                    raise Exception(res)
 
-        # Save before frozen to render and save translations
+        # Save before frozen to render the newsletter, and render the
+        # translations right away: once frozen, renderings are not updated
         self.save()
+        self.render_translations( None )
         # Freeze it and save again
         self.frozen = True
         self.save()
@@ -563,10 +696,25 @@ class Newsletter( ArchiveModel, TranslationModel ):
         Function that does the actual work. Is called from
         the task send_newsletter_test
         """
-        for m in self.type.mailers.all():
-            res = m.send_test( self, emails )
-            if res:
-                raise Exception(res)
+        with self._reuse_renderings():
+            for m in self.type.mailers.all():
+                res = m.send_test( self, emails )
+                if res:
+                    raise Exception(res)
+
+    @contextmanager
+    def _reuse_renderings( self ):
+        """
+        Keep the local versions (and their renderings) on the instance while
+        the mailers send the newsletter, so they are fetched and rendered once
+        for all mailers. They are dropped afterwards as they would go stale.
+        """
+        self._local_versions = {}
+        try:
+            yield
+        finally:
+            self._local_versions = None
+            self._mailer_rendering = None
 
     def schedule(self, user_pk):
         """
@@ -614,18 +762,16 @@ class Newsletter( ArchiveModel, TranslationModel ):
         else:
             return None
 
-    def render( self, extra_ctx, store=True ):
+    def _is_frozen( self ):
+        return self.is_source() and self.frozen or \
+            self.is_translation() and self.source.frozen
+
+    def _render_defaults( self, content=None ):
         """
-        Render the newsletter
+        Build the default template context for rendering the newsletter.
+        content is an optional NewsletterData snapshot of the source
+        newsletter's content, shared between the translations.
         """
-        if self.is_source() and self.frozen or \
-            self.is_translation() and self.source.frozen:
-            return {
-                'html': self.html,
-                'text': self.text,
-                'subject': self.subject,
-            }
-
         # Flag to check if we have a custom editorial
         custom_editorial = False
         if self.is_translation():
@@ -638,13 +784,16 @@ class Newsletter( ArchiveModel, TranslationModel ):
                 # is no longer configured so we can just ignore it
                 pass
 
+        if content is None:
+            content = NewsletterData( self )
+
         data = {}
-        data.update(NewsletterContent.data_context(self, lang=self.lang))
+        data.update(content.data_context(lang=self.lang))
 
         # Include the data from Feed Data Sources
         data.update(self.get_feed_data())
 
-        defaults = {
+        return {
             'base_url': "{}://{}".format(getattr(settings, "URLS_SCHEME", "https"), Site.objects.get_current().domain),
             'MEDIA_URL': settings.MEDIA_URL,
             'STATIC_URL': settings.STATIC_URL,
@@ -668,14 +817,17 @@ class Newsletter( ArchiveModel, TranslationModel ):
             'now': datetime.now(),
             'newsletter_id': self.id,
         }
-        defaults.update( extra_ctx )
-        ctx = Context( defaults )
 
+    def _render_templates( self, ctx ):
+        """
+        Render the newsletter type's templates with the given context
+        """
         translation.activate(self.lang)
 
-        t_html = Template( self.type.html_template )
-        t_text = Template( self.type.text_template )
-        t_subject = Template( self.type.subject_template ) if self.type.subject_template else None
+        templates = self.type.get_templates()
+        t_html = templates['html']
+        t_text = templates['text']
+        t_subject = templates['subject']
 
         data = {
             'html': t_html.render( ctx ),
@@ -684,16 +836,75 @@ class Newsletter( ArchiveModel, TranslationModel ):
         }
         translation.deactivate()
 
+        return data
+
+    def _store_rendering( self, data ):
+        self.html = data['html']
+        self.text = data['text']
+        self.subject = data['subject']
+
+    def render( self, extra_ctx, store=True, content=None ):
+        """
+        Render the newsletter
+        """
+        if self._is_frozen():
+            return {
+                'html': self.html,
+                'text': self.text,
+                'subject': self.subject,
+            }
+
+        defaults = self._render_defaults( content=content )
+        defaults.update( extra_ctx )
+
+        data = self._render_templates( Context( defaults ) )
+
+        if store:
+            self._store_rendering( data )
+
+        return data
+
+    def render_for_mailer( self, mailer_context, store=True ):
+        """
+        Render the newsletter for a mailer.
+
+        The newsletter is rendered once with placeholders for the mailer
+        links, and the version for each mailer is made by replacing the
+        placeholders (see djangoplicity.newsletters.rendering). If the
+        templates depend on the mailer in any other way we fall back to
+        a full render.
+        """
+        if self._is_frozen():
+            return self.render( mailer_context, store=store )
+
+        rendering = getattr( self, '_mailer_rendering', None )
+        if rendering is None:
+            rendering = MailerRendering()
+            ctx = rendering.get_context( self._render_defaults() )
+            rendering.set_result( ctx, self._render_templates( ctx ), list( self.type.get_templates().values() ) )
+            self._mailer_rendering = rendering
+
+        data = rendering.specialise( mailer_context )
+        if data is None:
+            return self.render( mailer_context, store=store )
+
         if store:
-            self.html = data['html']
-            self.text = data['text']
-            self.subject = data['subject']
+            self._store_rendering( data )
 
         return data
 
     def save( self, *args, **kwargs ):
+        allocated = False
         if not self.pk:  # pylint: disable=E0203
             self.pk = make_nl_id()
+            allocated = True
+        elif self._state.adding:
+            bump_nl_id( self.pk )
+
+        # Content may have changed, so drop any cached rendering
+        self._mailer_rendering = None
+        if getattr( self, '_local_versions', None ) is not None:
+            self._local_versions = {}
 
         if not self.created:  # pylint: disable=E0203
             self.created = datetime.today()
@@ -713,31 +924,120 @@ class Newsletter( ArchiveModel, TranslationModel ):
 
             self.render( {} )
 
-            for local in self.translations.all():
-                local.render( {} )
-                local.save()
+            # Translations are re-rendered asynchronously once the
+            # newsletter has been committed. The generation is incremented
+            # in the database, so concurrent saves get distinct generations.
+            if self._state.adding:
+                self.render_generation += 1
+            else:
+                self.render_generation = F( 'render_generation' ) + 1
+            transaction.on_commit( self._dispatch_render_translations )
+
+        elif self.is_source() and not self._state.adding:
+            # Don't write back an outdated generation
+            self.render_generation = F( 'render_generation' )
 
         elif self.is_translation():
             try:
                 language = NewsletterLanguage.objects.get(language__lang=self.lang, newsletter_type=self.source.type)
-                if self.from_name == '' and language.default_from_name:
-                    self.from_name = language.default_from_name
-                if self.from_email == '' and language.default_from_email:
-                    self.from_email = language.default_from_email
-
-                if self.editorial == '' and language.default_editorial:
-                    self.editorial = language.default_editorial
-                if self.editorial_text == '' and language.default_editorial_text:
-                    self.editorial_text = language.default_editorial_text
-
-                if self.editorial_text == '' and self.editorial:
-                    self.editorial_text = defaultfilters.striptags( unescape( defaultfilters.safe( self.editorial ) ) )
+                self._set_translation_defaults( language )
             except NewsletterLanguage.DoesNotExist:
                 # This should only happen if we try to save a NL for which the
                 # NewsletterLanguage doesn't exist any longer
                 pass
 
-        return super( Newsletter, self ).save()
+            # Translations saved outside of a re-rendering (e.g. new or
+            # edited translations) are rendered for the current generation
+            source = self.source
+            if not source.frozen and self.render_generation != source.render_generation:
+                pk = self.pk
+                transaction.on_commit( lambda: render_translations.delay( source.pk, None, [pk] ) )
+
+        # An allocated ID is new, never update an existing newsletter with it
+        super( Newsletter, self ).save( force_insert=allocated )
+
+        if hasattr( self.render_generation, 'resolve_expression' ):
+            self.refresh_from_db( fields=['render_generation'] )
+
+    def _set_translation_defaults( self, language ):
+        """
+        Fill in empty sender and editorial fields of a translation from
+        the NewsletterLanguage defaults
+        """
+        if self.from_name == '' and language.default_from_name:
+            self.from_name = language.default_from_name
+        if self.from_email == '' and language.default_from_email:
+            self.from_email = language.default_from_email
+
+        if self.editorial == '' and language.default_editorial:
+            self.editorial = language.default_editorial
+        if self.editorial_text == '' and language.default_editorial_text:
+            self.editorial_text = language.default_editorial_text
+
+        if self.editorial_text == '' and self.editorial:
+            self.editorial_text = defaultfilters.striptags( unescape( defaultfilters.safe( self.editorial ) ) )
+
+    def _dispatch_render_translations( self ):
+        """
+        Queue the re-rendering of all translations for the current render
+        generation, in chunks of NEWSLETTERS_RENDER_CHUNK_SIZE translations
+        per task.
+        """
+        pks = list( self.translations.values_list( 'pk', flat=True ) )
+        size = getattr( settings, 'NEWSLETTERS_RENDER_CHUNK_SIZE', 5 )
+
+        for i in range( 0, len( pks ), size ):
+            render_translations.delay( self.pk, self.render_generation, pks[i:i + size] )
+
+    def render_translations( self, generation, translation_pks=None ):
+        """
+        Re-render and save the given translations (default all) for a
+        render generation (default the current one). The content objects
+        are fetched once and shared between the translations. Renderings
+        for an outdated generation are dropped.
+
+        Returns the number of translations saved.
+        """
+        if generation is None:
+            generation = self.render_generation
+        elif self.render_generation != generation:
+            return 0
+
+        translations = self.translations.all()
+        if translation_pks is not None:
+            translations = translations.filter( pk__in=translation_pks )
+        translations = list( translations )
+
+        content = NewsletterData( self )
+        content.prefetch_translations( [local.lang for local in translations] )
+        Newsletter.fetch_feed_data( translations )
+
+        saved = 0
+        for local in translations:
+            local.render( {}, content=content )
+
+            # The newsletter might have been saved again in the meantime
+            if not Newsletter.objects.filter( pk=self.pk, render_generation=generation ).exists():
+                logger.info( 'Dropping outdated rendering of newsletter %s (generation %s)', self.pk, generation )
+                break
+
+            local.render_generation = generation
+            local.save()
+            saved += 1
+
+        return saved
+
+    def render_status( self ):
+        """
+        Progress of the re-rendering of the translations for the current
+        render generation.
+        """
+        translations = self.translations.all()
+        return {
+            'generation': self.render_generation,
+            'total': translations.count(),
+            'done': translations.filter( render_generation=self.render_generation ).count(),
+        }
 
     def view_html(self):
         if self.pk:
@@ -773,12 +1073,25 @@ class Newsletter( ArchiveModel, TranslationModel ):
         """
         Return local version of the newsletter matching language
         or None
+
+        While the mailers send the newsletter the local versions are kept
+        on the instance, so that they can reuse their renderings (see
+        _reuse_renderings).
         """
+        local_versions = getattr( self, '_local_versions', None )
+        if local_versions is not None and language in local_versions:
+            return local_versions[language]
+
         try:
-            return self.translations.get( lang=language )
+            local = self.translations.get( lang=language )
         except Newsletter.DoesNotExist:
             return None
 
+        if local_versions is not None:
+            local_versions[language] = local
+
+        return local
+
     def get_feed_data(self, refresh=False):
         '''
         Returns the feed data if it has been fetched already otherwise
@@ -788,9 +1101,34 @@ class Newsletter( ArchiveModel, TranslationModel ):
         if self.frozen or (self.feed_data and not refresh):
             return self.feed_data
 
-        feed_data = {}
-        for src in self.type.newsletterfeeddatasource_set.all():
-            feed_data[src.name] = src.data_context(lang=self.lang)
+        Newsletter.fetch_feed_data([self], refresh=refresh)
+
+        return self.feed_data
+
+    @classmethod
+    def fetch_feed_data(cls, newsletters, refresh=False):
+        '''
+        Fetch the feed data of several newsletters (e.g. a newsletter and
+        its translations), with the feeds for all languages fetched
+        concurrently.
+        If refresh is True the data is fetched again
+        '''
+        by_type = {}
+        for nl in newsletters:
+            if nl.frozen or (nl.feed_data and not refresh):
+                continue
+            by_type.setdefault(nl.type_id, []).append(nl)
+
+        for newsletters in by_type.values():
+            sources = list(newsletters[0].type.newsletterfeeddatasource_set.all())
+            langs = set(nl.lang for nl in newsletters)
+            contexts = NewsletterFeedDataSource.data_contexts(sources, langs, refresh=refresh)
+
+            for nl in newsletters:
+                nl._store_feed_data(contexts[nl.lang])
+
+    def _store_feed_data(self, feed_data):
+        self.feed_data = feed_data
 
         if self.is_source():
             cls = Newsletter
@@ -798,8 +1136,6 @@ class Newsletter( ArchiveModel, TranslationModel ):
             cls = NewsletterProxy
         cls.objects.filter(pk=self.pk).update(feed_data=feed_data)
 
-        return self.feed_data
-
     def get_unpublished_content(self):
         '''
         Returns a list of all content which is not yet published or with a
@@ -914,48 +1250,199 @@ class NewsletterContent( models.Model ):
 
     class Meta:
         ordering = ['newsletter', 'data_source', 'object_id', ]
+        unique_together = ( 'newsletter', 'data_source', 'object_id' )
 
     @classmethod
     def data_context( cls, newsletter, lang=None ):
         """
         Generate a data context for a newsletter
         """
-        ctx = {}
+        return NewsletterData( newsletter ).data_context( lang=lang )
+
 
-        # If newsletter is a translation we use the data
-        # NewsletterContent from the source Newsletter
+class NewsletterData( object ):
+    """
+    Content objects of a newsletter, fetched in bulk:
+
+        * one query for the data sources of the newsletter type,
+        * one query for all NewsletterContent rows of the newsletter,
+        * one query per content model (with ``country'' pulled in by
+          select_related if the model has one), in the model's default
+          ordering,
+        * one query per content model and data source ordering, when the
+          ordering can't be reproduced in Python,
+        * one query per content model and language for translations (or
+          one query per content model for all languages, see
+          prefetch_translations()).
+
+    If the newsletter is a translation, the content of the source
+    newsletter is used, so the same instance can be used to render
+    the source newsletter and all its translations.
+    """
+    def __init__( self, newsletter ):
         if newsletter.is_translation():
             newsletter = newsletter.source
+        self.newsletter = newsletter
 
-        for datasrc in NewsletterDataSource.data_sources( newsletter.type ):
-            # For each data source - get object(s) for this newsletter.
-            modelcls = datasrc.content_type.model_class()
-            data = None
+        self.datasources = list(
+            NewsletterDataSource.data_sources( newsletter.type ).select_related( 'content_type', 'ordering' )
+        )
 
+        # All content rows of the newsletter, grouped by data source
+        self.pks = {}
+        for datasrc_id, object_id in NewsletterContent.objects.filter( newsletter=newsletter ).values_list( 'data_source_id', 'object_id' ):
+            self.pks.setdefault( datasrc_id, [] ).append( object_id )
+
+        # All content objects, grouped by model
+        model_pks = {}
+        for datasrc in self.datasources:
+            modelcls = datasrc.content_type.model_class()
             if modelcls is not None:
-                content_objects = cls.objects.filter( newsletter=newsletter, data_source=datasrc )
-                allpks = [obj.object_id for obj in content_objects]
+                model_pks.setdefault( modelcls, set() ).update( self._get_pks( datasrc, modelcls ) )
+
+        # All content objects, grouped by model. The positions of the objects
+        # in each known ordering are kept, so that data sources can be
+        # ordered without querying the database again.
+        self.objects = {}
+        self._positions = {}
+        for modelcls, pks in model_pks.items():
+            objects = []
+            if pks:
+                qs = modelcls.objects.filter( pk__in=list( pks ) )
+                if _has_country( modelcls ):
+                    qs = qs.select_related( 'country' )
+                if modelcls._meta.ordering:
+                    qs = qs.order_by( *modelcls._meta.ordering )
+                objects = list( qs )
+            self.objects[modelcls] = dict( ( obj.pk, obj ) for obj in objects )
+            self._set_positions( modelcls, modelcls._meta.ordering, [obj.pk for obj in objects] )
+
+        self._translations = {}
+
+    def _set_positions( self, modelcls, order_by, pks ):
+        key = ( modelcls, tuple( str( name ) for name in order_by ) )
+        self._positions[key] = dict( ( pk, i ) for i, pk in enumerate( pks ) )
+
+    def _get_positions( self, modelcls, order_by ):
+        key = ( modelcls, tuple( str( name ) for name in order_by ) )
+        return self._positions.get( key )
+
+    def _get_pks( self, datasrc, modelcls ):
+        """
+        Return the primary keys of the data source content, converted to
+        the model's primary key type (invalid keys are skipped).
+        """
+        pks = []
+        for object_id in self.pks.get( datasrc.pk, [] ):
+            try:
+                pk = modelcls._meta.pk.to_python( object_id )
+            except ValidationError:
+                continue
+            if pk not in pks:
+                pks.append( pk )
+        return pks
 
-                try:
-                    if datasrc.list:
-                        data = modelcls.objects.filter( pk__in=allpks )
-                        if datasrc.ordering:
-                            data = data.order_by( *datasrc.ordering.get_order_by() )
-                    else:
-                        if len( allpks ) > 0:
-                            data = modelcls.objects.get( pk=allpks[0] )
-                except (ValueError, modelcls.DoesNotExist):
-                    data = []
+    def get_objects( self, datasrc ):
+        """
+        Return the list of objects for a data source, ordered as defined by
+        the data source (or the model's default ordering).
+        """
+        modelcls = datasrc.content_type.model_class()
+        if modelcls is None:
+            return []
 
-            # Data can be either a list or a unique element
-            # so we turn it in a list:
-            if not datasrc.list:
-                data = [data, ]
+        objects = self.objects.get( modelcls, {} )
+        pks = self._get_pks( datasrc, modelcls )
+
+        if not datasrc.list:
+            # Only the first content object is used
+            if pks and pks[0] in objects:
+                return [objects[pks[0]]]
+            return []
+
+        data = [objects[pk] for pk in pks if pk in objects]
+
+        order_by = datasrc.ordering.get_order_by() if datasrc.ordering else modelcls._meta.ordering
+        if order_by and data:
+            positions = self._get_positions( modelcls, order_by )
+            if positions is None:
+                ordered = _sort_objects( modelcls, data, order_by )
+                if ordered is not None:
+                    return ordered
+
+                # Ordering can't be done in Python, let the database order
+                # all objects of the model once for all data sources.
+                self._set_positions( modelcls, order_by, modelcls.objects.filter(
+                    pk__in=list( objects.keys() ) ).order_by( *order_by ).values_list( 'pk', flat=True ) )
+                positions = self._get_positions( modelcls, order_by )
+
+            data.sort( key=lambda obj: positions.get( obj.pk, len( positions ) ) )
+
+        return data
+
+    def get_translation( self, obj, lang ):
+        """
+        Return the translation of obj in the given language, or obj itself
+        if there is none.
+        """
+        if not hasattr( obj, 'get_translations' ):
+            return obj
+
+        modelcls = obj.__class__
+        if not hasattr( modelcls, 'translation_objects' ):
+            try:
+                return obj.get_translations()['translations'][lang]
+            except KeyError:
+                return obj
+
+        key = ( modelcls, lang )
+        if key not in self._translations:
+            self._translations[key] = self._fetch_translations( modelcls, [lang] ).get( lang, {} )
 
+        return self._translations[key].get( obj.pk, obj )
+
+    def prefetch_translations( self, langs ):
+        """
+        Fetch the translations of all content objects in the given
+        languages, with one query per content model.
+        """
+        langs = [lang for lang in langs if lang]
+        if not langs:
+            return
+
+        for modelcls in self.objects:
+            if not hasattr( modelcls, 'get_translations' ) or not hasattr( modelcls, 'translation_objects' ):
+                continue
+            translations = self._fetch_translations( modelcls, langs )
+            for lang in langs:
+                self._translations[( modelcls, lang )] = translations.get( lang, {} )
+
+    def _fetch_translations( self, modelcls, langs ):
+        """
+        Fetch translations of all objects of modelcls in the given languages.
+        Returns a dictionary {lang: {source pk: translation}}
+        """
+        pks = list( self.objects.get( modelcls, {} ).keys() )
+        result = {}
+        if not pks:
+            return result
+
+        for t in modelcls.translation_objects.filter( source__in=pks, lang__in=langs ):
+            result.setdefault( t.lang, {} )[t.source_id] = t
+
+        return result
+
+    def data_context( self, lang=None ):
+        """
+        Generate a data context for the given language
+        """
+        ctx = {}
+
+        for datasrc in self.datasources:
             #  Some 'source' content is in a given language,
             #  we skip those unless they match the passed language
             tmpdata = []
-            for d in data:
+            for d in self.get_objects( datasrc ):
                 # Check if the data has a language:
                 if hasattr(d, 'lang'):
                     if d.lang == lang or d.lang == settings.LANGUAGE_CODE:
@@ -985,29 +1472,64 @@ class NewsletterContent( models.Model ):
                         tmpdata.append(d)
 
             # If a language is passed, fetch the translations (if any)
-            if not lang:
-                if datasrc.list:
-                    data = tmpdata
-                else:
-                    data = tmpdata.pop()
+            if lang:
+                tmpdata = [self.get_translation( d, lang ) for d in tmpdata]
+
+            if datasrc.list:
+                ctx[datasrc.name] = tmpdata
             else:
-                data = []
-                for d in tmpdata:
-                    try:
-                        if hasattr(d, 'get_translations'):
-                            d = d.get_translations()['translations'][lang]
-                    except KeyError:
-                        # No translation available, use original
-                        pass
-                    if datasrc.list:
-                        data.append(d)
-                    else:
-                        data = d
-            ctx[datasrc.name] = data
+                ctx[datasrc.name] = tmpdata[-1] if tmpdata else None
 
         return ctx
 
 
+def _has_country( modelcls ):
+    """
+    Check if a model has a ``country'' relation
+    """
+    try:
+        return modelcls._meta.get_field( 'country' ).is_relation
+    except FieldDoesNotExist:
+        return False
+
+
+def _sort_objects( modelcls, objects, order_by ):
+    """
+    Sort objects in Python the same way the database would for the given
+    order_by fields. Returns None if the ordering can't be reproduced in
+    Python (related lookups, text collation, random ordering etc.)
+    """
+    fields = []
+    for name in order_by:
+        if not isinstance( name, ( str, type( '' ) ) ):
+            return None
+        desc = name.startswith( '-' )
+        name = name.lstrip( '-' )
+        if name == 'pk':
+            name = modelcls._meta.pk.name
+        try:
+            field = modelcls._meta.get_field( name )
+        except FieldDoesNotExist:
+            return None
+        if field.is_relation or isinstance( field, ( models.CharField, models.TextField ) ):
+            return None
+        fields.append( ( field.attname, desc ) )
+
+    objects = list( objects )
+    # Sort by the least significant field first, as sorts are stable.
+    # Like PostgreSQL, NULL values come last in ascending order.
+    for attname, desc in reversed( fields ):
+        objects.sort( key=_sort_key( attname ), reverse=desc )
+    return objects
+
+
+def _sort_key( attname ):
+    def key( obj ):
+        value = getattr( obj, attname )
+        return ( value is None, value if value is not None else 0 )
+    return key
+
+
 @python_2_unicode_compatible
 class DataSourceSelector( models.Model ):
     """
@@ -1178,11 +1700,18 @@ class NewsletterFeedDataSource(models.Model):
     limit = models.CharField(max_length=255, blank=True)
     fetch_translations = models.BooleanField(default=True, help_text=_(
         'Fetch translated version of the feed if available'))
+    timeout = models.PositiveIntegerField(default=feeds.DEFAULT_TIMEOUT, help_text=_(
+        'Timeout in seconds when fetching the feed'))
+    cache_ttl = models.PositiveIntegerField(default=3600, help_text=_(
+        'Time in seconds during which a fetched feed is reused without checking for changes'))
+    stale_ttl = models.PositiveIntegerField(default=86400, help_text=_(
+        'Time in seconds after the cache TTL during which the previously fetched feed is '
+        'used while checking for changes in the background'))
 
     def __str__(self):
         return self.title
 
-    def _limit_data(self, data):
+    def _parse_limit(self):
         limits = self.limit.split(':')[:2]
         try:
             start = int(limits[0])
@@ -1194,6 +1723,11 @@ class NewsletterFeedDataSource(models.Model):
         except (ValueError, IndexError):
             end = None
 
+        return start, end
+
+    def _limit_data(self, data):
+        start, end = self._parse_limit()
+
         if end and end < len(data):
             data = data[:end]
 
@@ -1206,25 +1740,42 @@ class NewsletterFeedDataSource(models.Model):
     def data_sources(cls, typ):
         return cls.objects.filter(type=typ)
 
-    def data_context(self, lang):
+    @classmethod
+    def data_contexts(cls, sources, langs, refresh=False):
         '''
-        Returns a list of items from the feed
+        Fetch the given feed data sources for all the given languages
+        concurrently. Returns a dictionary {lang: {source name: data}}
         '''
-        url = '%s?lang=%s' % (self.url, lang)
+        jobs = [(src, lang) for lang in langs for src in sources]
+        results = feeds.fetch_all(
+            [partial(src.data_context, lang, refresh=refresh) for (src, lang) in jobs]
+        )
 
-        try:
-            r = requests.get(url)
-        except (requests.ConnectionError, requests.Timeout):
-            return []
+        contexts = dict((lang, {}) for lang in langs)
+        for (src, lang), data in zip(jobs, results):
+            contexts[lang][src.name] = data
 
-        if r.status_code != requests.codes.ok:
-            logger.warning('Can\'t fetch feed: %s (%d)', self.url, r.status_code)
-            return []
+        return contexts
 
-        try:
-            data = r.json()
-        except ValueError:
-            logger.warning('Invalid JSON for: %s', self.url)
+    def data_context(self, lang, refresh=False):
+        '''
+        Returns a list of items from the feed
+        If refresh is True cached responses are revalidated
+        '''
+        # Only read the items we need from the feed
+        end = self._parse_limit()[1] if self.limit else None
+
+        data = feeds.fetch_json(
+            self.url,
+            params={'lang': lang},
+            timeout=self.timeout,
+            ttl=self.cache_ttl,
+            stale_ttl=self.stale_ttl,
+            refresh=refresh,
+            max_items=end if end and end > 0 else None,
+        )
+        if data is None:
+            return []
 
         if self.limit:
             data = self._limit_data(data)
@@ -1284,17 +1835,50 @@ class NewsletterGenerator( object ):
             'release_date': nl.release_date,
         }
 
-        for src in NewsletterDataSource.data_sources( self.type ):
-            for obj in src.get_queryset( context ):
-                NewsletterContent.objects.get_or_create( newsletter=nl, data_source=src, object_id=obj.pk )
-
-        for language in self.type.languages.all():
-            NewsletterProxy.objects.get_or_create( id='%s-%s' % (nl.id, language.lang),
-                                        translation_ready=True, source=nl, lang=language.lang )
-
+        # Content: only create the rows which don't exist yet
+        existing = set( NewsletterContent.objects.filter( newsletter=nl ).values_list( 'data_source_id', 'object_id' ) )
+        contents = []
+        datasources = NewsletterDataSource.data_sources( self.type ).select_related( 'content_type', 'ordering' ).prefetch_related( 'selectors' )
+        for src in datasources:
+            for pk in src.get_queryset( context ).values_list( 'pk', flat=True ):
+                key = ( src.pk, str( pk ) )
+                if key not in existing:
+                    existing.add( key )
+                    contents.append( NewsletterContent( newsletter=nl, data_source=src, object_id=key[1] ) )
+        NewsletterContent.objects.bulk_create( contents, **BULK_IGNORE_CONFLICTS )
+
+        # Translations
+        existing = set( nl.translations.values_list( 'lang', flat=True ) )
+        translations = []
+        for language in NewsletterLanguage.objects.filter( newsletter_type=self.type ).select_related( 'language' ):
+            if language.language.lang not in existing:
+                translations.append( self._make_translation( nl, language ) )
+        NewsletterProxy.objects.bulk_create( translations, **BULK_IGNORE_CONFLICTS )
+
+        # Renders the newsletter and queues the rendering of the translations
         nl.save()
         return nl
 
+    def _make_translation( self, nl, language ):
+        """
+        Build (without saving) a translation of the newsletter for a
+        NewsletterLanguage, with the non-translated fields copied from the
+        newsletter as they would be when saving it.
+        """
+        local = NewsletterProxy( id='%s-%s' % ( nl.id, language.language.lang ), translation_ready=True,
+            source=nl, lang=language.language.lang )
+
+        skip = set( Newsletter.Translation.fields + Newsletter.Translation.excludes + [
+            'id', 'source', 'lang', 'translation_ready', 'render_generation',
+        ] )
+        for field in Newsletter._meta.concrete_fields:
+            if field.name not in skip:
+                setattr( local, field.attname, getattr( nl, field.attname ) )
+
+        local.created = datetime.today()
+        local._set_translation_defaults( language )
+        return local
+
 
 # ==========================================
 # Support models for MailChimpMailer plug-in
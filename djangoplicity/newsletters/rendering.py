@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+#
+# djangoplicity-newsletters
+# Copyright (c) 2007-2011, European Southern Observatory (ESO)
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+#    * Redistributions of source code must retain the above copyright
+#      notice, this list of conditions and the following disclaimer.
+#
+#    * Redistributions in binary form must reproduce the above copyright
+#      notice, this list of conditions and the following disclaimer in the
+#      documentation and/or other materials provided with the distribution.
+#
+#    * Neither the name of the European Southern Observatory nor the names
+#      of its contributors may be used to endorse or promote products derived
+#      from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY ESO ``AS IS'' AND ANY EXPRESS OR IMPLIED
+# WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO
+# EVENT SHALL ESO BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR
+# BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER
+# IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE
+
+
+'''
+Helpers for rendering a newsletter once and specialising the result for each
+mailer.
+
+Mailers only differ in the ``unsubscribe_link'', ``preferences_link'' and
+``browser_link'' context variables (plus an ``is_*_mailer'' flag). Instead of
+rendering the full newsletter templates for every mailer, the newsletter is
+rendered once with a unique placeholder for each link, and each mailer's
+version is produced by replacing the placeholders with the mailer's values.
+
+The shortcut is only taken when it gives exactly the same result as a full
+render, i.e. when the templates:
+
+    * never look up an ``is_*_mailer'' flag,
+    * never test the truth value of one of the links (e.g. ``{% if browser_link %}''),
+    * output each link unmodified each time they look it up (no filters
+      altering the placeholder, no comparisons, no ``|length'' etc.),
+    * never apply a filter other than HTML escaping to one of the links.
+
+The placeholders contain characters which filters such as ``urlencode'',
+``iriencode'' and ``escapejs'' alter, while HTML escaping leaves them alone.
+Filters which leave the placeholder unchanged may still alter the real link
+(e.g. ``cut'' or ``urlize''), so the compiled templates are checked for
+filtered links as well.
+
+Otherwise ``MailerRendering.specialise'' returns None and the caller must do
+a full render.
+'''
+
+from builtins import str
+import re
+import uuid
+
+from django.template import Context
+from django.template.base import FilterExpression, Node, Variable
+from django.template.loader_tags import ExtendsNode, IncludeNode
+from django.template.smartif import TokenBase
+from django.utils.html import conditional_escape
+
+
+MAILER_LINKS = ('unsubscribe_link', 'preferences_link', 'browser_link')
+
+MAILER_FLAG_RE = re.compile(r'^is_\w+_mailer$')
+
+# Filters which give the same result whether applied to the placeholder or
+# to the link (links needing HTML escaping are never substituted).
+SAFE_LINK_FILTERS = ('escape', 'force_escape', 'safe')
+
+
+def _filter_expressions(value):
+    '''
+    Yield the filter expressions held by a node attribute, including the
+    ones nested in ``{% if %}'' conditions.
+    '''
+    if isinstance(value, FilterExpression):
+        yield value
+    elif isinstance(value, TokenBase):
+        for item in vars(value).values():
+            for expr in _filter_expressions(item):
+                yield expr
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            if not isinstance(item, Node):
+                for expr in _filter_expressions(item):
+                    yield expr
+    elif isinstance(value, dict):
+        for item in value.values():
+            for expr in _filter_expressions(item):
+                yield expr
+
+
+def _filters_link(expr):
+    '''
+    Check if a filter expression alters a mailer link (by a filter or an
+    attribute lookup).
+    '''
+    var = expr.var
+    if not isinstance(var, Variable) or not var.lookups or var.lookups[0] not in MAILER_LINKS:
+        return False
+    if len(var.lookups) > 1:
+        return True
+    return any(
+        getattr(func, '_filter_name', func.__name__) not in SAFE_LINK_FILTERS
+        for func, args in expr.filters
+    )
+
+
+def links_filtered(template, _seen=None):
+    '''
+    Check if a compiled template (or the templates it extends or includes)
+    applies filters to a mailer link. Templates included by a name only
+    known at render time can't be checked, so they count as filtering.
+    '''
+    if _seen is None:
+        _seen = set()
+
+    for node in template.nodelist.get_nodes_by_type(Node):
+        for value in vars(node).values():
+            if any(_filters_link(expr) for expr in _filter_expressions(value)):
+                return True
+
+        if isinstance(node, (ExtendsNode, IncludeNode)):
+            name = node.parent_name if isinstance(node, ExtendsNode) else node.template
+            if not isinstance(name, FilterExpression) or not isinstance(name.var, str) or name.filters:
+                return True
+            if name.var not in _seen:
+                _seen.add(name.var)
+                if links_filtered(template.engine.get_template(name.var), _seen):
+                    return True
+
+    return False
+
+
+class MailerTrackingContext(Context):
+    '''
+    Template context which records lookups of ``is_*_mailer'' flags and
+    counts lookups of the mailer links.
+
+    The recorded flags and counts are shared with all copies of the context
+    (e.g. for included templates).
+    '''
+    def __init__(self, *args, **kwargs):
+        super(MailerTrackingContext, self).__init__(*args, **kwargs)
+        self.mailer_flags = set()
+        self.link_lookups = dict((name, 0) for name in MAILER_LINKS)
+
+    def _track(self, key, lookup=True):
+        if MAILER_FLAG_RE.match(str(key)):
+            self.mailer_flags.add(key)
+        elif lookup and key in self.link_lookups:
+            self.link_lookups[key] += 1
+
+    def __getitem__(self, key):
+        self._track(key)
+        return super(MailerTrackingContext, self).__getitem__(key)
+
+    def __contains__(self, key):
+        self._track(key, lookup=False)
+        return super(MailerTrackingContext, self).__contains__(key)
+
+    def get(self, key, otherwise=None):
+        self._track(key)
+        return super(MailerTrackingContext, self).get(key, otherwise)
+
+
+class MailerLinkPlaceholder(str):
+    '''
+    Placeholder value for a mailer link. Records if a template tests its
+    truth value, since the placeholder is always true while the real link
+    might be empty.
+    '''
+    def __new__(cls, value, rendering):
+        obj = super(MailerLinkPlaceholder, cls).__new__(cls, value)
+        obj.rendering = rendering
+        return obj
+
+    def __bool__(self):
+        self.rendering.truth_tested = True
+        return True
+    __nonzero__ = __bool__
+
+
+class MailerRendering(object):
+    '''
+    A rendering of a newsletter with placeholders instead of mailer links.
+    '''
+    def __init__(self):
+        self.prefix = 'NLMAILERLINK%s' % uuid.uuid4().hex
+        self.placeholders = dict(
+            (name, MailerLinkPlaceholder('%s%s -' % (self.prefix, name.replace('_', '').upper()), self))
+            for name in MAILER_LINKS
+        )
+        self.truth_tested = False
+        self.mailer_flags = set()
+        self.link_lookups = {}
+        self.filtered = False
+        self.data = None
+
+    def get_context(self, defaults):
+        '''
+        Return a tracking context for rendering the generic version
+        '''
+        ctx = dict(defaults)
+        ctx.update(self.placeholders)
+        return MailerTrackingContext(ctx)
+
+    def set_result(self, ctx, data, templates=()):
+        '''
+        Store the result of the generic render of the given compiled
+        templates
+        '''
+        self.mailer_flags = ctx.mailer_flags
+        self.link_lookups = ctx.link_lookups
+        self.filtered = any(links_filtered(t) for t in templates if t is not None)
+        self.data = data
+
+    def is_reusable(self):
+        '''
+        Check if the generic render can be specialised for mailers: no flag
+        branching, no truth tests or filters on links and each link was
+        output verbatim as many times as it was looked up.
+        '''
+        if self.data is None or self.mailer_flags or self.truth_tested or self.filtered:
+            return False
+
+        output = ''.join(str(value) for value in self.data.values() if value)
+        for name, placeholder in self.placeholders.items():
+            if output.count(placeholder) != self.link_lookups.get(name, 0):
+                # The link was altered by a filter, compared, measured...
+                return False
+
+        return True
+
+    def specialise(self, mailer_context):
+        '''
+        Return the html, text and subject for the given mailer context, or
+        None if a full render is needed.
+        '''
+        if not self.is_reusable():
+            return None
+
+        values = {}
+        for key, value in mailer_context.items():
+            if key in self.placeholders:
+                value = str(value)
+                if conditional_escape(value) != value:
+                    # The template may or may not escape the value, so we
+                    # can't know what to substitute.
+                    return None
+                values[key] = value
+            elif not MAILER_FLAG_RE.match(str(key)):
+                # Unknown context variable, only a full render will do
+                return None
+
+        data = {}
+        for k, v in self.data.items():
+            if v:
+                v = str(v)
+                for name, placeholder in self.placeholders.items():
+                    v = v.replace(placeholder, values.get(name, ''))
+            data[k] = v
+        return data
@@ -41,6 +41,8 @@ from celery.utils.log import get_task_logger
 from django.conf import settings
 from django.core.cache import cache
 
+from djangoplicity.mailinglists.mailchimp import requeue_on_open_circuit
+
 
 logger = get_task_logger(__name__)
 
@@ -57,6 +59,7 @@ def release_lock(lock_id):
 
 
 @task(name="newsletters.send_scheduled_newsletter", ignore_result=True)
+@requeue_on_open_circuit
 def send_scheduled_newsletter(newsletter_pk):
     """
     Task to start sending a scheduled newsletter - this task should normally
@@ -88,6 +91,7 @@ def send_scheduled_newsletter(newsletter_pk):
 
 
 @task(name="newsletters.send_newsletter", ignore_result=True)
+@requeue_on_open_circuit
 def send_newsletter(newsletter_pk):
     """
     Task to start sending a newsletter
@@ -109,6 +113,7 @@ def send_newsletter(newsletter_pk):
 
 
 @task(name="newsletters.send_newsletter_test", ignore_result=True)
+@requeue_on_open_circuit
 def send_newsletter_test(newsletter_pk, emails):
     """
     Task to start sending a newsletter
@@ -129,6 +134,7 @@ def send_newsletter_test(newsletter_pk, emails):
 
 
 @task(name="newsletters.schedule_newsletter", ignore_result=True)
+@requeue_on_open_circuit
 def schedule_newsletter(newsletter_pk, user_pk):
     """
     Task to schedule a newsletter for delivery.
@@ -150,6 +156,7 @@ def schedule_newsletter(newsletter_pk, user_pk):
 
 
 @task(name="newsletters.unschedule_newsletter", ignore_result=True)
+@requeue_on_open_circuit
 def unschedule_newsletter(newsletter_pk, user_pk):
     """
     Task to unschedule a newsletter for delivery.
@@ -170,7 +177,42 @@ def unschedule_newsletter(newsletter_pk, user_pk):
                     % newsletter_pk)
 
 
+@task(name="newsletters.render_translations", ignore_result=True)
+def render_translations(newsletter_pk, generation, translation_pks):
+    """
+    Task to re-render a chunk of translations of a newsletter for the given
+    render generation (None for the current one). Nothing is saved if the
+    newsletter has been saved again since the task was queued.
+    """
+    from djangoplicity.newsletters.models import Newsletter
+
+    try:
+        nl = Newsletter.objects.get(pk=newsletter_pk)
+    except Newsletter.DoesNotExist:
+        logger.info('Newsletter %s does not exist anymore' % newsletter_pk)
+        return
+
+    saved = nl.render_translations(generation, translation_pks)
+    logger.info('Rendered %d translations of newsletter %s (generation %s)'
+                % (saved, newsletter_pk, generation))
+
+
+@task(name="newsletters.revalidate_feed", ignore_result=True)
+def revalidate_feed(url, params, timeout, max_items=None):
+    """
+    Task to revalidate the cached response of a feed (the lock is acquired
+    by the caller, see djangoplicity.newsletters.feeds)
+    """
+    from djangoplicity.newsletters import feeds
+
+    try:
+        feeds.revalidate(url, params, timeout, max_items)
+    finally:
+        release_lock('%s_revalidate' % feeds._cache_key(url, params, max_items))
+
+
 @task(name="newsletters.abuse_reports", ignore_result=True)
+@requeue_on_open_circuit
 def abuse_reports():
     '''
     Generate a report for abuse reports for campaigns sent
@@ -24,4 +24,16 @@ class SimpleMailChimpMailerPlugin( MailChimpMailerPlugin ):
     abstract = True
 
     def __init__(self, parameters):
-        MailChimpMailerPlugin.__init__(self, parameters)
\ No newline at end of file
+        MailChimpMailerPlugin.__init__(self, parameters)
+
+class Country( models.Model ):
+    isocode = models.CharField( max_length=2 )
+    name = models.CharField( max_length=50 )
+
+
+class Exhibition( models.Model ):
+    """
+    Newsletter content with a country (see NewsletterData.data_context)
+    """
+    name = models.CharField( max_length=50 )
+    country = models.ForeignKey( Country, null=True, blank=True, on_delete=models.SET_NULL )
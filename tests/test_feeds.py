@@ -0,0 +1,151 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from djangoplicity.newsletters import feeds
+
+
+class FetchAllTestCase(SimpleTestCase):
+
+    def test_results_keep_job_order(self):
+        """Test that results are returned in the order of the jobs"""
+        def job(i):
+            return lambda: time.sleep(0.01 * (5 - i)) or i
+
+        self.assertEqual(feeds.fetch_all([job(i) for i in range(5)], concurrency=5), list(range(5)))
+
+    def test_concurrency_is_bounded(self):
+        """Test that no more than concurrency jobs run at the same time"""
+        lock = threading.Lock()
+        state = {'running': 0, 'max': 0}
+
+        def job():
+            with lock:
+                state['running'] += 1
+                state['max'] = max(state['max'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+
+        feeds.fetch_all([job] * 10, concurrency=3)
+        self.assertTrue(1 < state['max'] <= 3)
+
+    def test_session_is_shared(self):
+        """Test that all feeds are fetched with the same session"""
+        self.assertIs(feeds.get_session(), feeds.get_session())
+
+
+class IterJsonArrayTestCase(SimpleTestCase):
+
+    def _chunks(self, text, size):
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+    def test_items(self):
+        """Test that items split across chunks are parsed"""
+        text = ' [1, 23.5e1 ,"a,]b", {"c": [1, {"d": null}]}, true, [] ] '
+        for size in (1, 2, 3, 7, len(text)):
+            items = list(feeds.iter_json_array(self._chunks(text, size)))
+            self.assertEqual(items, [1, 235.0, 'a,]b', {'c': [1, {'d': None}]}, True, []])
+
+    def test_empty(self):
+        """Test that an empty array has no items"""
+        self.assertEqual(list(feeds.iter_json_array(['[', ' ]'])), [])
+
+    def test_stops_reading(self):
+        """Test that no more chunks are read than needed"""
+        read = []
+
+        def chunks():
+            for i in range(1000):
+                read.append(i)
+                yield '[' if i == 0 else '%d,' % i
+
+        for item in feeds.iter_json_array(chunks()):
+            if item == 3:
+                break
+        self.assertEqual(len(read), 4)
+
+    def test_invalid(self):
+        """Test that invalid input raises ValueError"""
+        for text in ('{"a": 1}', '[1, 2', '[1 2]', '[1, }]'):
+            with self.assertRaises(ValueError):
+                list(feeds.iter_json_array(self._chunks(text, 2)))
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, data=None, headers=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+    def close(self):
+        pass
+
+
+class FakeSession(object):
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, params=None, timeout=None, headers=None, stream=False):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class FeedCacheTestCase(SimpleTestCase):
+    url = 'https://www.example.com/feed/'
+
+    def setUp(self):
+        cache.clear()
+        self.session = feeds._session
+
+    def tearDown(self):
+        feeds._session = self.session
+        cache.clear()
+
+    def _fetch(self, *responses, **kwargs):
+        feeds._session = FakeSession(*responses)
+        data = feeds.fetch_json(self.url, params={'lang': 'en'}, **kwargs)
+        return data, feeds._session.requests
+
+    def test_fresh_response_is_reused(self):
+        """Test that a feed is only fetched once within its TTL"""
+        data, requests = self._fetch(FakeResponse(200, [1, 2]), ttl=60)
+        self.assertEqual(data, [1, 2])
+        self.assertEqual(len(requests), 1)
+
+        data, requests = self._fetch(ttl=60)
+        self.assertEqual(data, [1, 2])
+        self.assertEqual(requests, [])
+
+    def test_conditional_request(self):
+        """Test that an expired response is revalidated with its ETag/Last-Modified"""
+        headers = {'ETag': '"abc"', 'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+        self._fetch(FakeResponse(200, [1, 2], headers))
+
+        data, requests = self._fetch(FakeResponse(304))
+        self.assertEqual(data, [1, 2])
+        self.assertEqual(requests[0], {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT',
+        })
+
+    def test_stale_response_on_error(self):
+        """Test that the cached response is used if the feed can't be fetched"""
+        self._fetch(FakeResponse(200, [1, 2]))
+
+        data, _ = self._fetch(FakeResponse(500))
+        self.assertEqual(data, [1, 2])
+
+    def test_refresh(self):
+        """Test that refresh revalidates a fresh response"""
+        self._fetch(FakeResponse(200, [1, 2], {'ETag': '"abc"'}), ttl=60)
+
+        data, requests = self._fetch(FakeResponse(200, [3], {'ETag': '"def"'}), ttl=60, refresh=True)
+        self.assertEqual(data, [3])
+        self.assertEqual(requests[0], {'If-None-Match': '"abc"'})
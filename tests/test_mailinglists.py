@@ -1,12 +1,23 @@
 from future.standard_library import install_aliases
 install_aliases()
-from django.test import TestCase, RequestFactory
+import hashlib
+import io
+import json
+import tarfile
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase, RequestFactory, override_settings
 from django.utils import timezone
 from mailchimp3 import MailChimp
 from mailchimp3.mailchimpclient import MailChimpError
 
+from djangoplicity.mailinglists import mailchimp
+from djangoplicity.mailinglists.mailchimp import get_client
 from djangoplicity.mailinglists.mailman import MailmanList
-from djangoplicity.mailinglists.models import List, Subscriber, Subscription, BadEmailAddress, MailChimpList
+from djangoplicity.mailinglists.models import List, Subscriber, Subscription, BadEmailAddress, MailChimpList, \
+    MailChimpMergeVar, MergeVarMapping
 from test_project.settings import NEWSLETTERS_MAILCHIMP_API_KEY, NEWSLETTERS_MAILCHIMP_LIST_ID
 
 TEST_API_KEY = NEWSLETTERS_MAILCHIMP_API_KEY
@@ -84,6 +95,30 @@ class ListTest(TestCase):
             self.list.unsubscribe()
         self.assertEqual("Expected either subscriber or email keyword arguments to be provided.", str(context.exception))
 
+    def test_update_subscribers(self):
+        Subscriber.objects.create(email='existing@example.com')
+        BadEmailAddress.objects.create(email='bad@example.com')
+        self.list.update_subscribers(['old@example.com', 'kept@example.com'])
+
+        summary = self.list.update_subscribers(
+            ['kept@example.com', 'existing@example.com', 'new@example.com', 'bad@example.com'])
+
+        self.assertEqual(summary, {'added': 2, 'removed': 1, 'created_subscribers': 1})
+        self.assertEqual(
+            sorted(self.list.subscribers.values_list('email', flat=True)),
+            ['existing@example.com', 'kept@example.com', 'new@example.com'],
+        )
+
+    def test_roster_snapshot(self):
+        self.list.store_roster({'a@example.com', 'b@example.com'})
+        self.assertIsNotNone(self.list.last_sync)
+
+        # Fresh snapshot, Mailman is not queried
+        self.assertEqual(self.list.get_mailman_emails(), {'a@example.com', 'b@example.com'})
+
+        self.list.update_roster(added=['c@example.com'], removed=['a@example.com'])
+        self.assertEqual(self.list.get_mailman_emails(), {'b@example.com', 'c@example.com'})
+
     # def test_mailman_list(self):
     #     mailman_list = MailmanList(name=self.LIST_NAME, password=self.LIST_PASSWORD, main_url=self.LIST_BASEURL)
     #     self.assertEquals(
@@ -93,6 +128,107 @@ class ListTest(TestCase):
     #     self.assertEqual(mailman_list.get_members(), [])
 
 
+MASS_SUBSCRIBE_RESPONSE = """<h5>Successfully subscribed:</h5>
+<ul>
+<li>new@example.com
+</ul>
+<h5>Error subscribing:</h5>
+<ul>
+<li>member@example.com -- Already a member
+<li>invalid@example -- Bad/Invalid email address
+</ul>
+"""
+
+MASS_UNSUBSCRIBE_RESPONSE_FR = u"""<h5>R\xe9siliation r\xe9ussie:</h5>
+<ul>
+<li>member@example.com
+</ul>
+<h5>Ne peut r\xe9silier l'abonnement de non-abonn\xe9s :</h5>
+<ul>
+<li>missing@example.com
+</ul>
+"""
+
+
+class FakeMailmanSession(object):
+    def __init__(self, text):
+        self.text = text
+        self.posts = []
+
+    def post(self, url, data=None, timeout=None):
+        self.posts.append((url, data))
+        return self
+
+    def raise_for_status(self):
+        pass
+
+
+class MailmanPushTest(TestCase):
+
+    def setUp(self):
+        self.mailman = MailmanList(name='test', password='secret', main_url='http://www.example.com/lists')
+        self.logins = []
+        self.mailman.login = self._login
+
+    def _login(self, text=MASS_SUBSCRIBE_RESPONSE):
+        session = FakeMailmanSession(text)
+        self.logins.append(session)
+        return session
+
+    def test_push_chunk(self):
+        session = FakeMailmanSession(MASS_SUBSCRIBE_RESPONSE)
+        emails = ['new@example.com', 'member@example.com', 'invalid@example', 'missing@example.com']
+
+        done, failed = self.mailman.push_chunk(session, 'subscribe', emails)
+
+        self.assertEqual(len(session.posts), 1)
+        self.assertEqual(session.posts[0][0], 'http://www.example.com/lists/admin/test/members/add')
+        self.assertEqual(session.posts[0][1]['subscribees'], '\n'.join(emails))
+        self.assertEqual(done, {'new@example.com'})
+        self.assertEqual(sorted(failed), ['invalid@example', 'member@example.com', 'missing@example.com'])
+
+    def test_push_chunk_unsubscribe_non_members(self):
+        """Test that non-members are done when unsubscribing, whatever the list's language"""
+        session = FakeMailmanSession(MASS_UNSUBSCRIBE_RESPONSE_FR)
+
+        done, failed = self.mailman.push_chunk(session, 'unsubscribe', ['member@example.com', 'missing@example.com'])
+
+        self.assertEqual(done, {'member@example.com', 'missing@example.com'})
+        self.assertEqual(failed, {})
+
+    def test_push_chunk_falls_back(self):
+        self.mailman.login = lambda: self._login('<html>Unexpected</html>')
+        session = FakeMailmanSession('<html>Unexpected</html>')
+
+        done, failed = self.mailman.push_chunk(session, 'unsubscribe', ['a@example.com', 'b@example.com'])
+
+        # One mass post, then one post per email with a session per thread
+        self.assertEqual(len(session.posts), 1)
+        self.assertTrue(1 <= len(self.logins) <= 2)
+        self.assertEqual(sum(len(login.posts) for login in self.logins), 2)
+        self.assertEqual(done, set())
+        self.assertEqual(sorted(failed), ['a@example.com', 'b@example.com'])
+
+    def test_push_checks_failed_emails(self):
+        """Test that members reported as failed by Mailman are done"""
+        mlist = List.objects.create(name='push-test', password='secret', base_url='http://www.example.com/lists')
+        for email in ['new@example.com', 'member@example.com', 'invalid@example']:
+            Subscription.objects.create(list=mlist, subscriber=Subscriber.objects.create(email=email))
+        mlist.store_roster(set())
+
+        self.mailman.get_members = lambda: [('member@example.com', ''), ('new@example.com', '')]
+        mailman_property = List.mailman
+        List.mailman = property(lambda l: self.mailman)
+        try:
+            status = mlist.push()
+        finally:
+            List.mailman = mailman_property
+
+        self.assertEqual(status['done'], 2)
+        self.assertEqual(list(status['failed']), ['invalid@example'])
+        self.assertEqual(mlist.get_mailman_emails(), {'member@example.com', 'new@example.com'})
+
+
 class MailChimpListTest(TestCase):
     """
     To ensure that this test runs, you must first manually create
@@ -179,6 +315,12 @@ class MailChimpListTest(TestCase):
 
         self.assertEqual(client.ping.get()['health_status'], "Everything's Chimpy!")
 
+    def test_connection_client_is_reused(self):
+        client = get_client('5b9aa23a4e53e80db2de92975de8dd5b-us1')
+        self.assertIs(get_client('5b9aa23a4e53e80db2de92975de8dd5b-us1'), client)
+        self.assertIsNot(get_client('5b9aa23a4e53e80db2de92975de8dd5b-us2'), client)
+        self.assertEqual(client.base_url, 'https://us1.api.mailchimp.com/3.0/')
+
     def test_subscribe(self):
         # self.assertTrue(self.list.subscribe('test@eso.org', {'INTERESTS': {'id': True, 'name': True, }}, 'text'))
         self.assertTrue(self.list.subscribe('another@eso.org', None, 'text'))
@@ -209,6 +351,560 @@ class MailChimpListTest(TestCase):
         # to test that the subscriber doesn't exist
         self.assertTrue(self.list.unsubscribe('another@example.com'))
 
+    def test_bulk_unsubscribe(self):
+        # Members which don't exist are not errors
+        self.assertEqual(self.list.bulk_unsubscribe(['admin@example.com', 'another@example.com']), {})
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.text = ''
+
+
+class FakeClient(object):
+    """
+    Client for the 'ping.get' path, answering with the given responses (or
+    raising the given exceptions)
+    """
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.response = None
+        self.calls = 0
+        self.ping = self
+
+    def get(self):
+        self.calls += 1
+        self.response = self.responses.pop(0)
+        if isinstance(self.response, Exception):
+            error, self.response = self.response, None
+            raise error
+        if self.response.status_code >= 400:
+            raise MailChimpError({'status': self.response.status_code})
+        return {'health_status': "Everything's Chimpy!"}
+
+    def last_response(self):
+        return self.response
+
+    def clear_last_response(self):
+        self.response = None
+
+
+class RefusingCache(object):
+    '''
+    Cache refusing to add keys, like memcached during an outage
+    '''
+    def add(self, *args, **kwargs):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(cache, name)
+
+
+class MailChimpCallTestCase(TestCase):
+    API_KEY = '5b9aa23a4e53e80db2de92975de8dd5b-us9'
+
+    def setUp(self):
+        cache.clear()
+        self.base_delay = mailchimp.BASE_DELAY
+        mailchimp.BASE_DELAY = 0
+
+    def tearDown(self):
+        mailchimp.BASE_DELAY = self.base_delay
+        mailchimp._clients.pop(self.API_KEY, None)
+
+    def _call(self, *responses):
+        get_client(self.API_KEY)
+        client = mailchimp._clients[self.API_KEY] = FakeClient(*responses)
+        try:
+            return mailchimp.call(self.API_KEY, 'ping.get')
+        finally:
+            self.calls = client.calls
+
+
+class MailChimpRetryTest(MailChimpCallTestCase):
+
+    def test_backoff_delay(self):
+        mailchimp.BASE_DELAY = self.base_delay
+        for attempt in range(1, 10):
+            delay = mailchimp.backoff_delay(attempt)
+            self.assertTrue(0 <= delay <= min(mailchimp.MAX_DELAY, self.base_delay * 2 ** (attempt - 1)))
+        self.assertEqual(mailchimp.backoff_delay(1, retry_after=3), 3)
+        self.assertEqual(mailchimp.backoff_delay(1, retry_after=3600), mailchimp.MAX_DELAY)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(mailchimp.parse_retry_after(FakeResponse(429, {'Retry-After': '7'})), 7)
+        self.assertIsNone(mailchimp.parse_retry_after(FakeResponse(429)))
+        self.assertIsNone(mailchimp.parse_retry_after(FakeResponse(503, {'Retry-After': '7'})))
+
+    def test_retry_transient_errors(self):
+        response = self._call(FakeResponse(500), FakeResponse(429, {'Retry-After': '0'}), FakeResponse(200))
+        self.assertEqual(response['health_status'], "Everything's Chimpy!")
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(mailchimp.get_metrics('ping.get')['retries'], 2)
+
+    def test_no_retry_client_errors(self):
+        with self.assertRaises(MailChimpError):
+            self._call(FakeResponse(404))
+        self.assertEqual(self.calls, 1)
+
+    @override_settings(MAILINGLISTS_MAILCHIMP_RETRY_BUDGETS={'default': 5, 'ping.get': 1})
+    def test_retry_budget(self):
+        with self.assertRaises(MailChimpError):
+            self._call(FakeResponse(503), FakeResponse(503), FakeResponse(200))
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(mailchimp.get_metrics('ping.get')['giveups'], 1)
+
+
+@override_settings(MAILINGLISTS_MAILCHIMP_MAX_CONNECTIONS=2)
+class MailChimpSlotTest(MailChimpCallTestCase):
+
+    def _slots(self):
+        digest = mailchimp._api_key_digest(self.API_KEY)
+        return [cache.get('mailchimp_slot_%s_%d' % (digest, i)) for i in range(2)]
+
+    def test_slots(self):
+        first = mailchimp.acquire_slot(self.API_KEY)
+        second = mailchimp.acquire_slot(self.API_KEY)
+        self.assertNotEqual(first[0], second[0])
+        self.assertNotIn(None, self._slots())
+
+        # A free slot is taken again
+        mailchimp.release_slot(first)
+        self.assertEqual(mailchimp.acquire_slot(self.API_KEY)[0], first[0])
+
+    def test_release_expired_slot(self):
+        slot = mailchimp.acquire_slot(self.API_KEY)
+        cache.set(slot[0], 'another caller')
+        mailchimp.release_slot(slot)
+        self.assertEqual(cache.get(slot[0]), 'another caller')
+
+    def test_calls_release_slots(self):
+        self._call(FakeResponse(200))
+        self.assertEqual(self._slots(), [None, None])
+
+        with self.assertRaises(MailChimpError):
+            self._call(FakeResponse(503), FakeResponse(404))
+        self.assertEqual(self._slots(), [None, None])
+
+    def test_slot_wait_is_bounded(self):
+        slot_max_wait = mailchimp.SLOT_MAX_WAIT
+        mailchimp.SLOT_MAX_WAIT = 0
+        mailchimp.cache = RefusingCache()
+        try:
+            self.assertIsNone(mailchimp.acquire_slot(self.API_KEY))
+            mailchimp.release_slot(None)
+
+            # Calls go through without a slot
+            response = self._call(FakeResponse(200))
+            self.assertEqual(response['health_status'], "Everything's Chimpy!")
+        finally:
+            mailchimp.SLOT_MAX_WAIT = slot_max_wait
+            mailchimp.cache = cache
+
+
+@override_settings(
+    MAILINGLISTS_MAILCHIMP_RETRY_BUDGETS={'default': 0},
+    MAILINGLISTS_MAILCHIMP_CIRCUIT_THRESHOLD=2,
+)
+class MailChimpCircuitTest(MailChimpCallTestCase):
+
+    def test_circuit_opens(self):
+        for dummy in range(2):
+            with self.assertRaises(MailChimpError):
+                self._call(FakeResponse(503))
+        self.assertEqual(mailchimp.circuit_state(self.API_KEY), 'open')
+
+        # Fail fast without calling the API
+        with self.assertRaises(mailchimp.CircuitOpenError):
+            self._call(FakeResponse(200))
+        self.assertEqual(self.calls, 0)
+
+    def test_circuit_half_open(self):
+        opened_key = mailchimp._circuit_keys(self.API_KEY)[0]
+        cache.set(opened_key, time.time() - 3600, None)
+        self.assertEqual(mailchimp.circuit_state(self.API_KEY), 'half-open')
+
+        # A failed probe opens the circuit again
+        with self.assertRaises(MailChimpError):
+            self._call(FakeResponse(503))
+        self.assertEqual(mailchimp.circuit_state(self.API_KEY), 'open')
+
+        # A successful probe closes it
+        cache.set(opened_key, time.time() - 3600, None)
+        self._call(FakeResponse(200))
+        self.assertEqual(mailchimp.circuit_state(self.API_KEY), 'closed')
+
+    def test_probe_unexpected_error(self):
+        opened_key = mailchimp._circuit_keys(self.API_KEY)[0]
+        cache.set(opened_key, time.time() - 3600, None)
+
+        # The probe is released so the next call can probe again
+        with self.assertRaises(ValueError):
+            self._call(ValueError('unexpected'))
+        self._call(FakeResponse(200))
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(mailchimp.circuit_state(self.API_KEY), 'closed')
+
+    def test_requeue_outside_worker(self):
+        @mailchimp.requeue_on_open_circuit
+        def func():
+            raise mailchimp.CircuitOpenError(10)
+
+        with self.assertRaises(mailchimp.CircuitOpenError):
+            func()
+
+
+class FakeMembers(object):
+    """
+    The 'lists.members' endpoint, keeping the members in a dict and
+    recording the updates (PATCH requests)
+    """
+    def __init__(self, client, members):
+        self.client = client
+        self.data = members
+        self.updates = []
+
+    def create(self, list_id, data):
+        if data['email_address'] in self.data:
+            self.client.response = FakeResponse(400)
+            raise MailChimpError({'status': 400, 'title': 'Member Exists'})
+        self.client.response = FakeResponse(200)
+        self.data[data['email_address']] = dict(data)
+        return data
+
+    def update(self, list_id, subscriber_hash, data):
+        self.updates.append((subscriber_hash, data))
+        for email, member in self.data.items():
+            if hashlib.md5(email.encode('utf-8')).hexdigest() == subscriber_hash:
+                self.client.response = FakeResponse(200)
+                member.update(data)
+                return member
+        self.client.response = FakeResponse(404)
+        raise MailChimpError({'status': 404, 'title': 'Resource Not Found'})
+
+
+class FakeMembersClient(object):
+    """
+    Client for the 'lists.members.*' paths
+    """
+    def __init__(self, members=None):
+        self.response = None
+        self.lists = self
+        self.members = FakeMembers(self, members or {})
+
+    def last_response(self):
+        return self.response
+
+    def clear_last_response(self):
+        self.response = None
+
+
+class MailChimpSubscribeTest(MailChimpCallTestCase):
+
+    def setUp(self):
+        super(MailChimpSubscribeTest, self).setUp()
+        get_client(self.API_KEY)
+        self.client = mailchimp._clients[self.API_KEY] = FakeMembersClient({
+            'existing@example.com': {'email_type': 'text', 'status': 'unsubscribed'},
+            'member@example.com': {'email_type': 'html', 'status': 'subscribed'},
+        })
+        self.list = MailChimpList(api_key=self.API_KEY, list_id='subscribe-test')
+
+    def test_subscribe_new_member(self):
+        self.assertTrue(self.list.subscribe('new@example.com', double_optin=False))
+        member = self.client.members.data['new@example.com']
+        self.assertEqual(member['status'], 'subscribed')
+        self.assertEqual(member['email_type'], 'html')
+
+    def test_subscribe_keeps_existing_member(self):
+        self.assertTrue(self.list.subscribe('existing@example.com', email_type='html'))
+        self.assertEqual(self.client.members.data['existing@example.com'],
+            {'email_type': 'text', 'status': 'unsubscribed'})
+
+    def test_unsubscribe_member(self):
+        self.assertTrue(self.list.unsubscribe('member@example.com'))
+        self.assertEqual(self.client.members.data['member@example.com']['status'], 'unsubscribed')
+        self.assertEqual(len(self.client.members.updates), 1)
+
+    def test_unsubscribe_missing_member(self):
+        self.assertTrue(self.list.unsubscribe('missing@example.com'))
+        self.assertEqual(len(self.client.members.updates), 1)
+        self.assertNotIn('missing@example.com', self.client.members.data)
+
+    def test_update_profile(self):
+        self.assertTrue(self.list.update_profile('member@example.com', 'new@example.com',
+            {'INTERESTS': {'abc123': True}}))
+        self.assertEqual(self.client.members.updates, [(
+            hashlib.md5(b'member@example.com').hexdigest(),
+            {'merge_fields': {'EMAIL': 'new@example.com'}, 'interests': {'abc123': True}},
+        )])
+
+    def test_update_profile_missing_member(self):
+        self.assertFalse(self.list.update_profile('missing@example.com', 'new@example.com'))
+        self.assertEqual(len(self.client.members.updates), 1)
+
+
+def batch_archive(results):
+    """
+    Build a batch result archive: a gzipped tar archive of JSON files, each
+    one holding (at most two) operation results
+    """
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode='w:gz') as archive:
+        for i in range(0, len(results), 2):
+            data = json.dumps(results[i:i + 2]).encode('utf-8')
+            info = tarfile.TarInfo('results/%d.json' % i)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return content.getvalue()
+
+
+class FakeBatchesClient(object):
+    """
+    Client for the 'batches.*' paths. Operations on the members given in
+    ``statuses'' answer with the given status code, others with 200.
+    """
+    def __init__(self, statuses=None):
+        self.batches = self
+        self.statuses = dict(
+            (hashlib.md5(email.encode('utf-8')).hexdigest(), status)
+            for email, status in (statuses or {}).items()
+        )
+        self.operations = []
+
+    def create(self, data):
+        self.operations.append(data['operations'])
+        return {'id': str(len(self.operations) - 1)}
+
+    def get(self, batch_id):
+        return {
+            'status': 'finished',
+            'total_operations': len(self.operations[int(batch_id)]),
+            'errored_operations': 0,
+            'response_body_url': batch_id,
+        }
+
+    def archive(self, batch_id):
+        results = []
+        for operation in self.operations[int(batch_id)]:
+            status = self.statuses.get(operation['path'].split('/')[-1], 200)
+            results.append({
+                'operation_id': operation['operation_id'],
+                'status_code': status,
+                'response': json.dumps({'detail': 'Error %d' % status} if status != 200 else {}),
+            })
+        return batch_archive(results)
+
+    def last_response(self):
+        return None
+
+    def clear_last_response(self):
+        pass
+
+
+@override_settings(MAILINGLISTS_MAILCHIMP_BATCH_SIZE=2, MAILINGLISTS_MAILCHIMP_BATCH_POLL_INTERVAL=0)
+class MailChimpBatchTest(MailChimpCallTestCase):
+
+    def setUp(self):
+        super(MailChimpBatchTest, self).setUp()
+        get_client(self.API_KEY)
+        self.client = mailchimp._clients[self.API_KEY] = FakeBatchesClient({
+            'bad@example.com': 400,
+            'gone@example.com': 404,
+        })
+        self.fetch_batch_results = mailchimp.fetch_batch_results
+        mailchimp.fetch_batch_results = self._fetch_batch_results
+        self.list = MailChimpList(api_key=self.API_KEY, list_id='batch-test')
+
+    def tearDown(self):
+        mailchimp.fetch_batch_results = self.fetch_batch_results
+        super(MailChimpBatchTest, self).tearDown()
+
+    def _fetch_batch_results(self, url):
+        # The fake batches use their id as result URL
+        return mailchimp.parse_batch_results(self.client.archive(url))
+
+    def test_parse_batch_results(self):
+        content = batch_archive([
+            {'operation_id': 'a', 'status_code': 200, 'response': '{"id": "1"}'},
+            {'operation_id': 'b', 'status_code': 404, 'response': '{"detail": "Not found"}'},
+            {'operation_id': 'c', 'status_code': 500, 'response': ''},
+        ])
+        self.assertEqual(mailchimp.parse_batch_results(content), {
+            'a': (200, {'id': '1'}),
+            'b': (404, {'detail': 'Not found'}),
+            'c': (500, {}),
+        })
+
+    def test_run_batch(self):
+        operations = [
+            {'method': 'GET', 'path': 'lists/batch-test/members/%d' % i, 'operation_id': str(i)}
+            for i in range(5)
+        ]
+        results = mailchimp.run_batch(self.API_KEY, operations)
+        self.assertEqual([len(batch) for batch in self.client.operations], [2, 2, 1])
+        self.assertEqual(sorted(results.keys()), ['0', '1', '2', '3', '4'])
+
+    def test_bulk_unsubscribe(self):
+        errors = self.list.bulk_unsubscribe(['a@example.com', 'bad@example.com', 'gone@example.com'])
+        self.assertEqual(errors, {'bad@example.com': 'Error 400'})
+
+    def test_bulk_upsert(self):
+        good = Subscriber.objects.create(email='a@example.com')
+        bad = Subscriber.objects.create(email='bad@example.com')
+        empty = Subscriber.objects.create(email='')
+        other = Subscriber.objects.create(email='b@example.com')
+
+        errors = self.list.bulk_upsert([good, bad, empty, other])
+        self.assertEqual(errors, {bad: 'Error 400', empty: 'No email address'})
+        self.assertEqual(
+            [json.loads(operation['body'])['email_address'] for batch in self.client.operations for operation in batch],
+            ['a@example.com', 'bad@example.com', 'b@example.com'])
+
+
+class UpdateBufferTest(TestCase):
+    CONF = {'list_id': 'abc123', 'double_optin': False, 'send_welcome': False,
+        'delete_member': False, 'send_goodbye': False}
+
+    def setUp(self):
+        cache.clear()
+
+    def test_merge_changes(self):
+        from djangoplicity.mailinglists.tasks.mailchimp_actions import merge_changes
+
+        changes = merge_changes(
+            {'email': ('a@example.com', 'b@example.com')},
+            {'email': ('b@example.com', 'c@example.com'), 'name': ('A', 'B')},
+        )
+        self.assertEqual(changes, {
+            'email': ('a@example.com', 'c@example.com'),
+            'name': ('A', 'B'),
+        })
+
+    def test_buffer_update(self):
+        from djangoplicity.mailinglists.tasks.mailchimp_actions import buffer_update, pop_update
+
+        self.assertTrue(buffer_update(self.CONF, 'contacts.contact', '1', {'name': ('A', 'B')}, 60))
+        self.assertFalse(buffer_update(self.CONF, 'contacts.contact', '1', {'name': ('B', 'C')}, 60))
+        self.assertTrue(buffer_update(self.CONF, 'contacts.contact', '2', {'name': ('X', 'Y')}, 60))
+
+        buffered = pop_update('abc123', 'contacts.contact', '1')
+        self.assertEqual(buffered['changes'], {'name': ('A', 'C')})
+        self.assertIsNone(pop_update('abc123', 'contacts.contact', '1'))
+
+
+class MappingPlanTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.list = MailChimpList.objects.create(
+            api_key=TEST_API_KEY,
+            list_id='mapping-plan-test',
+            web_id='1',
+            content_type=ContentType.objects.get_for_model(Subscriber),
+        )
+        self.list.primary_key_field = MailChimpMergeVar.objects.create(
+            list=self.list, name='Django ID', tag='DJANGOID')
+        self.list.save()
+        self.email_var = MailChimpMergeVar.objects.create(
+            list=self.list, name='Email', tag='EMAIL')
+        MergeVarMapping.objects.create(list=self.list,
+            merge_var=self.email_var, field='email')
+        self.subscriber = Subscriber.objects.create(email='plan@example.com')
+
+    def test_create_merge_fields_without_queries(self):
+        self.list.create_merge_fields(self.subscriber)
+
+        with self.assertNumQueries(0):
+            merge_fields = self.list.create_merge_fields(self.subscriber)
+
+        self.assertEqual(merge_fields, {
+            'DJANGOID': 'mailinglists.subscriber:%s' % self.subscriber.pk,
+            'EMAIL': 'plan@example.com',
+        })
+
+    def test_plan_invalidated_on_change(self):
+        self.list.create_merge_fields(self.subscriber)
+        self.email_var.tag = 'MAIL'
+        self.email_var.save()
+
+        merge_fields = self.list.create_merge_fields(self.subscriber)
+        self.assertEqual(merge_fields['MAIL'], 'plan@example.com')
+        self.assertNotIn('EMAIL', merge_fields)
+
+    def test_get_objects(self):
+        plan = self.list.get_mapping_plan()
+        merges = [
+            {'DJANGOID': 'mailinglists.subscriber:%s' % self.subscriber.pk, 'EMAIL': 'new@example.com'},
+            {'DJANGOID': 'mailinglists.subscriber:0'},
+            {'EMAIL': 'plan@example.com'},
+            {'DJANGOID': 'mailinglists.subscriber:%s' % self.subscriber.pk},
+        ]
+
+        with self.assertNumQueries(1):
+            objects = plan.get_objects(merges)
+
+        self.assertEqual(objects, [self.subscriber, None, None, self.subscriber])
+        self.assertEqual(plan.parse_merge_fields(merges[0]), {'email': 'new@example.com'})
+
+
+class BadEmailAddressFilterTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        BadEmailAddress.objects.create(email='bad@example.com')
+
+    def test_is_bad_without_query(self):
+        BadEmailAddress.get_filter()
+
+        with self.assertNumQueries(0):
+            self.assertFalse(BadEmailAddress.is_bad('good@example.com'))
+
+        self.assertTrue(BadEmailAddress.is_bad('bad@example.com'))
+
+    def test_filter_updated_incrementally(self):
+        BadEmailAddress.get_filter()
+        BadEmailAddress.objects.create(email='cleaned@example.com')
+
+        self.assertTrue(BadEmailAddress.is_bad('cleaned@example.com'))
+        self.assertEqual(
+            BadEmailAddress.filter_bad(['good@example.com', 'cleaned@example.com', 'bad@example.com']),
+            {'cleaned@example.com', 'bad@example.com'},
+        )
+
+        BadEmailAddress.objects.filter(email='cleaned@example.com').delete()
+        self.assertFalse(BadEmailAddress.is_bad('cleaned@example.com'))
+
+    def test_additions_keep_base(self):
+        from djangoplicity.mailinglists.models import BAD_EMAIL_FILTER_VERSION_KEY
+
+        BadEmailAddress.get_filter()
+        version = cache.get(BAD_EMAIL_FILTER_VERSION_KEY)
+
+        BadEmailAddress.objects.create(email='cleaned1@example.com')
+        BadEmailAddress.add_to_filter('cleaned2@example.com', 'cleaned3@example.com')
+
+        self.assertEqual(cache.get(BAD_EMAIL_FILTER_VERSION_KEY), version)
+        bloom, delta = BadEmailAddress.get_filter()
+        self.assertEqual(set(delta), {'cleaned1@example.com', 'cleaned2@example.com', 'cleaned3@example.com'})
+
+    def test_filter_built_by_lock_holder_only(self):
+        from djangoplicity.mailinglists.models import BAD_EMAIL_FILTER_LOCK_KEY
+
+        # Another process is building the filter: query the database
+        cache.add(BAD_EMAIL_FILTER_LOCK_KEY, True)
+        self.assertEqual(BadEmailAddress.get_filter(), None)
+        self.assertTrue(BadEmailAddress.is_bad('bad@example.com'))
+
+        # Addresses added while it is built are kept in the delta
+        BadEmailAddress.objects.create(email='cleaned@example.com')
+        cache.delete(BAD_EMAIL_FILTER_LOCK_KEY)
+        bloom, delta = BadEmailAddress.get_filter()
+        self.assertIn('cleaned@example.com', delta)
+        self.assertIn('bad@example.com', bloom)
+
 
 class MailChimpListTokenTest(TestCase):
     def test_get_token(self):
@@ -248,6 +944,32 @@ class MailChimpListTokenTest(TestCase):
         t2 = MailChimpListToken.get_token(t.token)
         self.assertEqual(t2, None)
 
+    def test_lookup(self):
+        from djangoplicity.mailinglists.models import MailChimpList, MailChimpListToken
+        from datetime import timedelta
+
+        list = MailChimpList(api_key=TEST_API_KEY, list_id=TEST_LIST_ID, connected=True)
+        list.save()
+
+        t = MailChimpListToken.create(list)
+        self.assertEqual(MailChimpListToken.lookup(t.token), (list.pk, list.list_id))
+        self.assertEqual(MailChimpListToken.lookup('unknown'), None)
+
+        # Known tokens are checked without queries
+        with self.assertNumQueries(0):
+            self.assertEqual(MailChimpListToken.lookup(t.token), (list.pk, list.list_id))
+
+        # Expiring the tokens like the webhooks task does
+        MailChimpListToken.objects.filter(pk=t.pk).update(
+            expired=timezone.now() - timedelta(minutes=11))
+        MailChimpListToken.invalidate_tokens()
+        self.assertEqual(MailChimpListToken.lookup(t.token), None)
+
+        # Saving a token invalidates the valid tokens as well
+        t.expired = timezone.now() - timedelta(minutes=9)
+        t.save()
+        self.assertEqual(MailChimpListToken.lookup(t.token), (list.pk, list.list_id))
+
 
 class WebHooksTest(TestCase):
     def setUp(self):
@@ -331,6 +1053,76 @@ class WebHooksTest(TestCase):
         response = self._mailchimp_webhook(data)
         self.assertEqual(response.status_code, 200)
 
+    def test_events_journal(self):
+        from djangoplicity.mailinglists.models import MailChimpWebhookEvent
+        from djangoplicity.mailinglists.tasks import mailchimp_webhook_events
+
+        for email in ['cleaned1@example.com', 'cleaned2@example.com', 'cleaned1@example.com']:
+            response = self._mailchimp_webhook({
+                "type": "cleaned",
+                "fired_at": "2009-03-26 22:01:00",
+                "data[list_id]": self.list.list_id,
+                "data[reason]": "hard",
+                "data[email]": email,
+            })
+            self.assertEqual(response.status_code, 200)
+
+        events = list(MailChimpWebhookEvent.objects.all())
+        self.assertEqual(len(events), 3)
+        self.assertEqual(events[0].list_id, self.list.pk)
+        self.assertEqual(events[0].type, 'cleaned')
+        self.assertEqual(events[0].get_params()['email'], 'cleaned1@example.com')
+
+        mailchimp_webhook_events()
+
+        self.assertFalse(MailChimpWebhookEvent.objects.exists())
+        self.assertTrue(BadEmailAddress.is_bad('cleaned1@example.com'))
+        self.assertTrue(BadEmailAddress.is_bad('cleaned2@example.com'))
+
+    def _journal(self, *events):
+        from djangoplicity.mailinglists.models import MailChimpWebhookEvent
+        import json
+
+        for event_type, email in events:
+            MailChimpWebhookEvent.objects.create(list=self.list, type=event_type,
+                params=json.dumps({'email': email, 'list_id': self.list.list_id}))
+        return list(MailChimpWebhookEvent.objects.all())
+
+    def test_group_events_keeps_address_order(self):
+        from djangoplicity.mailinglists.tasks.mailchimp_tasks import group_events
+
+        events = self._journal(
+            ('cleaned', 'x@example.com'),
+            ('subscribe', 'x@example.com'),
+            ('cleaned', 'y@example.com'),
+            ('subscribe', 'z@example.com'),
+            ('unsubscribe', 'x@example.com'),
+            ('subscribe', 'x@example.com'),
+        )
+        runs = [(event_type, [e.get_params()['email'] for e in group])
+            for (list_pk, event_type), group in group_events(events)]
+
+        self.assertEqual(runs, [
+            ('cleaned', ['x@example.com', 'y@example.com']),
+            ('subscribe', ['x@example.com', 'z@example.com']),
+            ('unsubscribe', ['x@example.com']),
+            ('subscribe', ['x@example.com']),
+        ])
+
+    def test_events_journal_mixed_types(self):
+        from djangoplicity.mailinglists.tasks import mailchimp_webhook_events
+
+        self._journal(
+            ('cleaned', 'resubscribed@example.com'),
+            ('subscribe', 'cleaned@example.com'),
+            ('subscribe', 'resubscribed@example.com'),
+            ('cleaned', 'cleaned@example.com'),
+        )
+        mailchimp_webhook_events()
+
+        self.assertFalse(BadEmailAddress.is_bad('resubscribed@example.com'))
+        self.assertTrue(BadEmailAddress.is_bad('cleaned@example.com'))
+
     def test_profile(self):
         data = {
             "type": "profile",
@@ -380,3 +1172,127 @@ class SimpleModelsTest(TestCase):
         merge_var = MailChimpMergeVar(list=self.list, name='merge_var_test')
         merge_var_mapping = MergeVarMapping(list=self.list, merge_var=merge_var, field='sample_field')
         self.assertEqual(str(merge_var_mapping), '%s -> sample_field' % str(merge_var))
+
+
+class FakeContact(object):
+    def __init__(self, email):
+        self.email = email
+
+
+class FakeContactSet(object):
+    def __init__(self, contacts, fail_after=None):
+        self.contacts = list(contacts)
+        self.fail_after = fail_after
+        self.removed = []
+
+    def filter(self, email__in):
+        return [c for c in self.contacts if c.email in email__in]
+
+    def remove(self, *contacts):
+        if self.fail_after is not None and len(self.removed) >= self.fail_after:
+            raise Exception('Worker killed')
+        self.removed.append([c.email for c in contacts])
+        self.contacts = [c for c in self.contacts if c not in contacts]
+
+    def add(self, *contacts):
+        pass
+
+
+class FakeGroup(object):
+    def __init__(self, name, emails, **kwargs):
+        self.name = name
+        self.contact_set = FakeContactSet([FakeContact(e) for e in emails], **kwargs)
+
+
+class FakeSyncList(object):
+    name = 'sync-test'
+
+    def __init__(self, mailman_emails, fail_push=False):
+        self.mailman_emails = set(mailman_emails)
+        self.fail_push = fail_push
+        self.updated = []
+        self.pushed = 0
+
+    def get_mailman_emails(self):
+        return self.mailman_emails
+
+    def update_subscribers(self, emails):
+        self.updated.append(set(emails))
+        return {}
+
+    def push(self, remove_existing=True):
+        if self.fail_push:
+            raise Exception('Mailman down')
+        self.pushed += 1
+
+
+@override_settings(MAILINGLISTS_MAILMAN_SYNC_CHUNK_SIZE=2)
+class MailmanSyncActionTest(TestCase):
+    conf = {'list_name': 'sync-test', 'remove_existing': True}
+    emails = ['a@example.com', 'b@example.com', 'c@example.com', 'd@example.com', 'e@example.com']
+
+    def setUp(self):
+        from celery import current_app
+        from djangoplicity.mailinglists.tasks.mailman_actions import MailmanSyncAction
+
+        cache.clear()
+        # Bound to the app so that requests (i.e. task ids) can be pushed
+        MailmanSyncAction.bind(current_app)
+        self.unsub = FakeGroup('unsub_group', [])
+        self.action = MailmanSyncAction()
+        self.action._get_unsub_group = lambda obj, model_identifier: self.unsub
+        self.action._log_moved = lambda conf, contacts, obj, l: None
+
+    def _run(self, task_id, group, mlist):
+        self.action._get_emails = lambda model_identifier, pk: (group, [c.email for c in group.contact_set.contacts])
+        self.action._get_list = lambda list_name: mlist
+        self.action.push_request(id=task_id)
+        try:
+            self.action.run(self.conf, 'contacts.group', '1')
+        finally:
+            self.action.pop_request()
+
+    def test_chunked_resume(self):
+        group = FakeGroup('group', self.emails, fail_after=1)
+        mlist = FakeSyncList(['e@example.com'])
+
+        with self.assertRaises(Exception):
+            self._run('task-1', group, mlist)
+        self.assertEqual(group.contact_set.removed, [['a@example.com', 'b@example.com']])
+
+        # The retry continues after the last chunk done
+        group.contact_set.fail_after = None
+        self._run('task-1', group, mlist)
+        self.assertEqual(group.contact_set.removed, [
+            ['a@example.com', 'b@example.com'],
+            ['c@example.com', 'd@example.com'],
+        ])
+        self.assertEqual(mlist.updated, [{'e@example.com'}])
+        self.assertEqual(mlist.pushed, 1)
+
+    def test_new_run_starts_over(self):
+        group = FakeGroup('group', self.emails)
+        mlist = FakeSyncList(self.emails, fail_push=True)
+
+        with self.assertRaises(Exception):
+            self._run('task-1', group, mlist)
+        self.assertEqual(len(mlist.updated), 1)
+
+        # The retry only pushes
+        mlist.fail_push = False
+        self._run('task-1', group, mlist)
+        self.assertEqual(len(mlist.updated), 1)
+        self.assertEqual(mlist.pushed, 1)
+
+        # A failed push isn't resumed by another task
+        mlist.fail_push = True
+        with self.assertRaises(Exception):
+            self._run('task-2', group, mlist)
+        self.assertEqual(len(mlist.updated), 2)
+
+        mlist.fail_push = False
+        mlist.mailman_emails = set(self.emails[1:])
+        self._run('task-3', group, mlist)
+        self.assertEqual(group.contact_set.removed, [['a@example.com']])
+        self.assertEqual(len(mlist.updated), 3)
+        self.assertEqual(mlist.pushed, 2)
@@ -1,10 +1,18 @@
+import time
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
-from djangoplicity.newsletters.models import Mailer, MailerParameter, MailerLog, make_nl_id, Newsletter, NewsletterType, MailChimpCampaign, Language, NewsletterLanguage, NewsletterGenerator, DataSourceSelector
+from django.test.utils import CaptureQueriesContext
+from djangoplicity.newsletters.models import Mailer, MailerParameter, MailerLog, make_nl_id, Newsletter, NewsletterType, MailChimpCampaign, Language, NewsletterLanguage, NewsletterGenerator, DataSourceSelector, NewsletterContent, NewsletterDataSource
 from djangoplicity.newsletters.mailers import MailChimpMailerPlugin, MailmanMailerPlugin, EmailMailerPlugin
 from test_project.models import SimpleMailer, SimpleMailChimpMailerPlugin
 from django.conf import settings
 
-from djangoplicity.mailinglists.models import MailChimpList
+from djangoplicity.mailinglists import mailchimp
+from djangoplicity.mailinglists.mailchimp import get_client
+from djangoplicity.mailinglists.models import MailChimpList, Subscriber
 
 from test_project.settings import NEWSLETTERS_MAILCHIMP_API_KEY, NEWSLETTERS_MAILCHIMP_LIST_ID
 
@@ -177,6 +185,37 @@ class MailerTestCase(TestCase):
         a = self.createNewMailer()
         self.assertEquals(make_nl_id(), u'1')
 
+    def test_get_id_skips_existing(self):
+        nlt = self.createNewsletterType()
+        nl = self.createNewsletter(nlt)
+        self.assertEquals(make_nl_id(), u'2')
+        self.assertEquals(make_nl_id(), u'3')
+
+    def test_get_id_queries(self):
+        nlt = self.createNewsletterType()
+        self.assertEquals(make_nl_id(), u'1')
+
+        # Lock and update the counter, whatever the number of newsletters
+        counts = []
+        for i in range(3):
+            for j in range(10):
+                Newsletter.objects.create(type=nlt)
+            with CaptureQueriesContext(connection) as queries:
+                make_nl_id()
+            counts.append(len(queries))
+            # Existing IDs are neither scanned nor looked up
+            self.assertFalse([q for q in queries.captured_queries
+                if '"newsletters_newsletter"' in q['sql']])
+
+        self.assertEqual(counts, [counts[0]] * 3)
+
+    def test_manual_id_bumps_counter(self):
+        nlt = self.createNewsletterType()
+        self.assertEquals(make_nl_id(), u'1')
+        Newsletter.objects.create(id='5', type=nlt)
+        Newsletter.objects.create(id='manual', type=nlt)
+        self.assertEquals(make_nl_id(), u'6')
+
     def test_on_scheduled(self):
         # l = self._valid_list()
         # sm = SimpleMailChimpMailerPlugin()
@@ -224,6 +263,36 @@ class MailerTestCase(TestCase):
         nlt.save()
         self.assertIsInstance(nlt.get_generator(), NewsletterGenerator)
 
+    def test_update_newsletter(self):
+        nlt = self.createNewsletterType()
+        NewsletterLanguage.objects.create(
+            newsletter_type=nlt,
+            language=Language.objects.create(lang='de'),
+            default_editorial='Editorial',
+        )
+        NewsletterDataSource.objects.create(
+            type=nlt,
+            name='subscribers',
+            title='Subscribers',
+            content_type=ContentType.objects.get_for_model(Subscriber),
+        )
+        for i in range(3):
+            Subscriber.objects.create(email='generator%s@example.com' % i)
+        nl = self.createNewsletter(nlt)
+
+        generator = nlt.get_generator()
+        generator.update_newsletter(nl)
+        generator.update_newsletter(nl)
+
+        self.assertEquals(NewsletterContent.objects.filter(newsletter=nl).count(), 3)
+        local = nl.translations.get(lang='de')
+        self.assertEquals(local.id, '1-de')
+        self.assertEquals(local.type, nlt)
+        self.assertEquals(local.editorial, 'Editorial')
+        # createNewsletterType() adds a NewsletterLanguage for LANGUAGE_CODE
+        self.assertEquals(sorted(nl.translations.values_list('lang', flat=True)),
+            sorted([settings.LANGUAGE_CODE, 'de']))
+
     def test_get_absolute_url(self):
         l = self._valid_list()
         m = self.createNewMailer()
@@ -273,3 +342,94 @@ class MailerTestCase(TestCase):
         nlt = self.createNewsletterType()
         nl = self.createNewsletter(nlt)
         self.assertEquals(nl.get_feed_data(), {})
+
+
+class FakeCampaignContent(object):
+    def __init__(self, client):
+        self.client = client
+
+    def update(self, campaign_id, data):
+        if self.client.fail_content:
+            raise Exception('Content update failed')
+        self.client.contents[campaign_id] = data
+
+
+class FakeCampaignsClient(object):
+    """
+    MailChimp client for the 'campaigns.*' paths
+    """
+    def __init__(self):
+        self.campaigns = self
+        self.content = FakeCampaignContent(self)
+        self.created = []
+        self.contents = {}
+        self.fail_content = False
+
+    def get(self, campaign_id):
+        return {'id': campaign_id}
+
+    def create(self, data):
+        self.created.append(data)
+        return {'id': 'campaign-%s' % len(self.created)}
+
+    def update(self, campaign_id, data):
+        return {'id': campaign_id}
+
+    def last_response(self):
+        return None
+
+    def clear_last_response(self):
+        pass
+
+
+class MailChimpUploadTestCase(TestCase):
+    API_KEY = '5b9aa23a4e53e80db2de92975de8dd5b-us9'
+
+    def setUp(self):
+        cache.clear()
+        newsletter_type = NewsletterType.objects.create(
+            name='Upload Test',
+            slug='upload-test',
+            default_from_name='test',
+            default_from_email='test@example.com',
+            html_template='{{ editorial }}',
+            text_template='{{ editorial_text }}',
+        )
+        self.newsletter = Newsletter.objects.create(id='upload-test', type=newsletter_type,
+            subject='Upload test', editorial='Editorial')
+        MailChimpList.objects.create(api_key=self.API_KEY, list_id='upload-test', web_id='1')
+        self.plugin = MailChimpMailerPlugin({'list_id': 'upload-test', 'enable_browser_link': False})
+
+        get_client(self.API_KEY)
+        self.client = mailchimp._clients[self.API_KEY] = FakeCampaignsClient()
+
+    def tearDown(self):
+        mailchimp._clients.pop(self.API_KEY, None)
+
+    def test_upload_newsletter(self):
+        self.assertEqual(self.plugin._upload_newsletter(self.newsletter), {'': 'created'})
+        self.assertEqual(MailChimpCampaign.objects.get(newsletter=self.newsletter, lang='').campaign_id, 'campaign-1')
+        self.assertEqual(self.client.contents['campaign-1']['html'], 'Editorial')
+
+        self.assertEqual(self.plugin._upload_newsletter(self.newsletter), {'': 'updated'})
+        self.assertEqual(len(self.client.created), 1)
+
+    def test_upload_newsletter_content_failure(self):
+        """Test that a campaign is recorded if its content upload fails"""
+        self.client.fail_content = True
+        with self.assertRaises(Exception):
+            self.plugin._upload_newsletter(self.newsletter)
+        self.assertEqual(MailChimpCampaign.objects.get(newsletter=self.newsletter, lang='').campaign_id, 'campaign-1')
+
+        # The next upload updates the campaign rather than creating another one
+        self.client.fail_content = False
+        self.assertEqual(self.plugin._upload_newsletter(self.newsletter), {'': 'updated'})
+        self.assertEqual(len(self.client.created), 1)
+        self.assertIn('campaign-1', self.client.contents)
+
+    def test_upload_newsletter_circuit_open(self):
+        """Test that an open circuit is raised as is, so that tasks re-queue"""
+        cache.set(mailchimp._circuit_keys(self.API_KEY)[0], time.time(), None)
+        with self.assertRaises(mailchimp.CircuitOpenError):
+            self.plugin._upload_newsletter(self.newsletter)
+        self.assertEqual(len(self.client.created), 0)
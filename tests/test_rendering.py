@@ -0,0 +1,350 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from djangoplicity.mailinglists.models import Subscriber
+from djangoplicity.newsletters.models import DataSourceOrdering, Mailer, Newsletter, \
+    NewsletterContent, NewsletterData, NewsletterDataSource, NewsletterProxy, NewsletterType
+from test_project.models import Country, Exhibition
+
+
+class TemplateCacheTestCase(TestCase):
+    fixtures = ['newsletters']
+
+    def setUp(self):
+        NewsletterType.clear_template_cache()
+        self.newsletter = Newsletter.objects.get(pk=10000)
+
+    def test_compiled_templates_are_reused(self):
+        """Test that rendering twice only compiles the templates once"""
+        before = NewsletterType.template_cache_info()
+        self.newsletter.render({}, store=False)
+        self.newsletter.render({}, store=False)
+        after = NewsletterType.template_cache_info()
+
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['size'], 1)
+
+    def test_cache_invalidated_on_save(self):
+        """Test that saving a newsletter type drops its compiled templates"""
+        typ = self.newsletter.type
+        typ.get_templates()
+        self.assertEqual(NewsletterType.template_cache_info()['size'], 1)
+
+        typ.subject_template = 'New subject'
+        typ.save()
+        self.assertEqual(NewsletterType.template_cache_info()['size'], 0)
+
+        templates = typ.get_templates()
+        self.assertEqual(templates['subject'].source, 'New subject')
+
+    def test_cache_replaced_on_change(self):
+        """Test that changed templates replace the cached ones of the type"""
+        typ = self.newsletter.type
+        stale = NewsletterType.objects.get(pk=typ.pk)
+        typ.get_templates()
+
+        # Other processes only see the change in the database, not the signal
+        for i in range(3):
+            stale.subject_template = 'Subject %s' % i
+            templates = stale.get_templates()
+            self.assertEqual(templates['subject'].source, 'Subject %s' % i)
+            self.assertEqual(NewsletterType.template_cache_info()['size'], 1)
+
+
+class MailerRenderingTestCase(TestCase):
+    fixtures = ['newsletters']
+
+    def setUp(self):
+        self.newsletter = Newsletter.objects.get(pk=10000)
+        self.mailer_context = {
+            'unsubscribe_link': 'http://www.example.com/listinfo/test',
+            'preferences_link': 'http://www.example.com/listinfo/test',
+            'browser_link': '',
+            'is_mailman_mailer': True,
+        }
+
+    def _set_templates(self, html, text='{{ editorial_text }}'):
+        typ = self.newsletter.type
+        typ.html_template = html
+        typ.text_template = text
+        typ.subject_template = ''
+        typ.save()
+
+    def test_render_for_mailer_substitutes_links(self):
+        """Test that the mailer version matches a full render"""
+        self._set_templates('<a href="{{ unsubscribe_link }}">{{ editorial }}</a>{{ browser_link }}')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data, self.newsletter.render(self.mailer_context, store=False))
+        self.assertTrue(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_falls_back_on_flags(self):
+        """Test that templates branching on the mailer flags are fully rendered"""
+        self._set_templates('{% if is_mailman_mailer %}mailman{% endif %}{{ unsubscribe_link }}')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data['html'], 'mailmanhttp://www.example.com/listinfo/test')
+        self.assertFalse(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_falls_back_on_link_tests(self):
+        """Test that templates testing a link are fully rendered"""
+        self._set_templates('{% if browser_link %}<a href="{{ browser_link }}">View</a>{% endif %}')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data['html'], '')
+
+    def test_render_for_mailer_falls_back_on_filters(self):
+        """Test that templates encoding a link are fully rendered"""
+        self._set_templates('<a href="http://www.example.com/?next={{ unsubscribe_link|urlencode }}">x</a>')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data, self.newsletter.render(self.mailer_context, store=False))
+        self.assertFalse(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_falls_back_on_cut(self):
+        """Test that filters leaving the placeholder unchanged are fully rendered"""
+        self._set_templates('{{ unsubscribe_link|cut:"|" }}')
+        self.mailer_context['unsubscribe_link'] = '*|UNSUB|*'
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data['html'], '*UNSUB*')
+        self.assertFalse(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_falls_back_on_urlize(self):
+        """Test that links turned into anchors are fully rendered"""
+        self._set_templates('{% with link=unsubscribe_link|urlize %}{{ link }}{% endwith %}')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data, self.newsletter.render(self.mailer_context, store=False))
+        self.assertIn('<a href="http://www.example.com/listinfo/test"', data['html'])
+        self.assertFalse(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_allows_escaping(self):
+        """Test that escaping a link doesn't prevent substituting it"""
+        self._set_templates('<a href="{{ unsubscribe_link|escape }}">x</a>')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data, self.newsletter.render(self.mailer_context, store=False))
+        self.assertTrue(self.newsletter._mailer_rendering.is_reusable())
+
+    def test_render_for_mailer_falls_back_on_comparisons(self):
+        """Test that templates comparing a link are fully rendered"""
+        self._set_templates('{% if browser_link == "" %}No link{% endif %}')
+
+        data = self.newsletter.render_for_mailer(self.mailer_context, store=False)
+        self.assertEqual(data['html'], 'No link')
+        self.assertFalse(self.newsletter._mailer_rendering.is_reusable())
+
+
+class DataContextTestCase(TestCase):
+
+    def setUp(self):
+        self.newsletter_type = NewsletterType.objects.create(
+            name='Data Context Test',
+            slug='data-context-test',
+            default_from_name='test',
+            default_from_email='test@example.com',
+            html_template='{% for s in data.source1 %}{{ s.name }}{% endfor %}',
+            text_template='{{ data.source0 }}',
+        )
+        self.newsletter = Newsletter.objects.create(id='data-context', type=self.newsletter_type)
+        models = [Subscriber, Mailer]
+
+        for i in range(10):
+            modelcls = models[i % 2]
+            datasrc = NewsletterDataSource.objects.create(
+                type=self.newsletter_type,
+                list=i % 3 != 0,
+                name='source%s' % i,
+                title='Source %s' % i,
+                content_type=ContentType.objects.get_for_model(modelcls),
+            )
+            for j in range(3):
+                if modelcls is Subscriber:
+                    obj = Subscriber.objects.create(email='source%s-%s@example.com' % (i, j))
+                else:
+                    obj = Mailer.objects.create(plugin='', name='Source %s-%s' % (i, j))
+                NewsletterContent.objects.create(newsletter=self.newsletter, data_source=datasrc, object_id=obj.pk)
+
+    def test_data_context_queries(self):
+        """Test that the number of queries doesn't depend on the number of data sources"""
+        langs = ['l%02d' % i for i in range(30)]
+
+        for lang in langs:
+            # Data sources, content rows, one query per content model
+            with self.assertNumQueries(4):
+                ctx = NewsletterContent.data_context(self.newsletter, lang=lang)
+
+            self.assertEqual(len(ctx['source1']), 3)
+            self.assertEqual(ctx['source1'], sorted(ctx['source1'], key=lambda obj: obj.pk))
+            self.assertIsInstance(ctx['source0'], Subscriber)
+
+    def test_data_context_queries_with_country(self):
+        """Test that content with a country doesn't add a query per object"""
+        austria = Country.objects.create(isocode='at', name='Austria')
+        germany = Country.objects.create(isocode='de', name='Germany')
+        datasrc = NewsletterDataSource.objects.create(
+            type=self.newsletter_type,
+            list=True,
+            name='exhibitions',
+            title='Exhibitions',
+            content_type=ContentType.objects.get_for_model(Exhibition),
+        )
+        for i, country in enumerate([austria, germany, None] * 3):
+            obj = Exhibition.objects.create(name='Exhibition %s' % i, country=country)
+            NewsletterContent.objects.create(newsletter=self.newsletter, data_source=datasrc, object_id=obj.pk)
+
+        for lang in ['de-at', 'de', 'fr'] + ['l%02d' % i for i in range(27)]:
+            # Data sources, content rows, one query per content model
+            with self.assertNumQueries(5):
+                ctx = NewsletterContent.data_context(self.newsletter, lang=lang)
+
+            countries = set(obj.country.isocode for obj in ctx['exhibitions'] if obj.country)
+            self.assertEqual(countries, {'de-at': {'at'}, 'de': {'de'}}.get(lang, set()))
+            self.assertEqual(len(ctx['exhibitions']), 6 if countries else 3)
+
+    def test_data_context_custom_ordering(self):
+        """Test that data sources sharing an ordering are ordered with one query"""
+        ordering = DataSourceOrdering.objects.create(name='Email', fields='-email')
+        NewsletterDataSource.objects.filter(
+            type=self.newsletter_type,
+            list=True,
+            content_type=ContentType.objects.get_for_model(Subscriber),
+        ).update(ordering=ordering)
+
+        # Data sources, content rows, one query per content model, ordering
+        with self.assertNumQueries(5):
+            ctx = NewsletterContent.data_context(self.newsletter)
+
+        emails = [obj.email for obj in ctx['source2']]
+        self.assertEqual(emails, sorted(emails, reverse=True))
+
+    def _create_translations(self):
+        for lang in ['de', 'fr', 'it']:
+            NewsletterProxy.objects.create(
+                id='data-context-%s' % lang,
+                source=self.newsletter,
+                lang=lang,
+                type=self.newsletter_type,
+            )
+
+    def test_render_translations_shares_content(self):
+        """Test that re-rendering the translations fetches the content once"""
+        self._create_translations()
+        self.newsletter.save()
+
+        with CaptureQueriesContext(connection) as queries:
+            saved = self.newsletter.render_translations(self.newsletter.render_generation)
+
+        content_queries = [q for q in queries.captured_queries
+            if q['sql'].startswith('SELECT') and 'FROM "newsletters_newslettercontent"' in q['sql']]
+        self.assertEqual(len(content_queries), 1)
+        self.assertEqual(saved, 3)
+
+        for local in self.newsletter.translations.all():
+            self.assertEqual(local.html, self.newsletter.html)
+
+        status = self.newsletter.render_status()
+        self.assertEqual(status['done'], 3)
+        self.assertEqual(status['total'], 3)
+
+    def test_render_translations_drops_outdated(self):
+        """Test that renderings for an outdated generation are not saved"""
+        self._create_translations()
+        self.newsletter.save()
+        generation = self.newsletter.render_generation
+        self.newsletter.save()
+
+        self.assertEqual(self.newsletter.render_generation, generation + 1)
+        self.assertEqual(self.newsletter.render_translations(generation), 0)
+        self.assertEqual(self.newsletter.render_status()['done'], 0)
+
+    def test_concurrent_saves_get_distinct_generations(self):
+        """Test that saves of stale instances don't reuse a render generation"""
+        self._create_translations()
+        first = Newsletter.objects.get(pk=self.newsletter.pk)
+        second = Newsletter.objects.get(pk=self.newsletter.pk)
+        generation = first.render_generation
+
+        first.save()
+        second.save()
+
+        self.assertEqual(first.render_generation, generation + 1)
+        self.assertEqual(second.render_generation, generation + 2)
+        self.assertEqual(first.render_translations(first.render_generation), 0)
+        self.assertEqual(second.render_translations(second.render_generation), 3)
+
+    def test_local_versions_kept_while_sending(self):
+        """Test that local versions are only kept on the instance while sending"""
+        self._create_translations()
+
+        with self.newsletter._reuse_renderings():
+            local = self.newsletter.get_local_version('de')
+            with self.assertNumQueries(0):
+                self.assertIs(self.newsletter.get_local_version('de'), local)
+
+        self.assertIsNot(self.newsletter.get_local_version('de'), local)
+
+    def test_translations_rendered_before_freezing(self):
+        """Test that sending renders the translations before freezing the newsletter"""
+        self._create_translations()
+        self.newsletter.save()
+        self.newsletter.render_translations(None)
+
+        datasrc = NewsletterDataSource.objects.get(type=self.newsletter_type, name='source1')
+        obj = Mailer.objects.create(plugin='', name='Added before sending')
+        NewsletterContent.objects.create(newsletter=self.newsletter, data_source=datasrc, object_id=obj.pk)
+
+        self.newsletter._send(check_scheduled=False)
+
+        self.assertTrue(self.newsletter.frozen)
+        self.assertIn('Added before sending', self.newsletter.html)
+        for local in self.newsletter.translations.all():
+            self.assertEqual(local.html, self.newsletter.html)
+
+
+class TranslatedContentTestCase(TestCase):
+
+    def setUp(self):
+        self.newsletter_type = NewsletterType.objects.create(
+            name='Translated Content Test',
+            slug='translated-content-test',
+            default_from_name='test',
+            default_from_email='test@example.com',
+        )
+        self.newsletter = Newsletter.objects.create(id='translated-content', type=self.newsletter_type)
+        datasrc = NewsletterDataSource.objects.create(
+            type=self.newsletter_type,
+            list=True,
+            name='issues',
+            title='Issues',
+            content_type=ContentType.objects.get_for_model(Newsletter),
+        )
+
+        for i in range(3):
+            issue = Newsletter.objects.create(id='translated-content-%s' % i, type=self.newsletter_type)
+            NewsletterContent.objects.create(newsletter=self.newsletter, data_source=datasrc, object_id=issue.pk)
+            NewsletterProxy.objects.create(
+                id='translated-content-%s-de' % i,
+                source=issue,
+                lang='de',
+                type=self.newsletter_type,
+            )
+
+    def test_prefetch_translations(self):
+        """Test that the translations of all languages are fetched with one query"""
+        content = NewsletterData(self.newsletter)
+
+        with self.assertNumQueries(1):
+            content.prefetch_translations(['de', 'fr'])
+
+        with self.assertNumQueries(0):
+            de = content.data_context(lang='de')
+            fr = content.data_context(lang='fr')
+
+        self.assertEqual([obj.lang for obj in de['issues']], ['de'] * 3)
+        self.assertEqual([obj.source_id for obj in de['issues']], [obj.pk for obj in fr['issues']])
+        self.assertEqual(fr['issues'], content.data_context()['issues'])